@@ -0,0 +1,80 @@
+"""
+Throughput of decode_jwt with and without the verified token cache.
+
+Verifies a working set of tokens repeatedly, as an API gateway checking the
+same refresh tokens on every request would, and prints one JSON object per
+algorithm. RS256 needs the cryptography package.
+
+    PYTHONPATH=src python benchmarks/bench_jwt_cache.py
+"""
+
+import argparse
+import json
+import random
+import time
+
+from signi_email_otp.jwt_utils import decode_jwt, generate_jwt
+from signi_email_otp.token_cache import TokenCache
+
+
+def _keys(algorithm):
+    if algorithm == "HS256":
+        return "benchmark-secret", "benchmark-secret"
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return private_pem, public_pem
+
+
+def _ops_per_second(tokens, verify_key, algorithm, operations, cache):
+    started = time.perf_counter()
+    for _ in range(operations):
+        decode_jwt(random.choice(tokens), verify_key, algorithm, cache=cache)
+    return operations / (time.perf_counter() - started)
+
+
+def run(algorithm, working_set, operations):
+    signing_key, verify_key = _keys(algorithm)
+    tokens = [
+        generate_jwt(f"user{i}@example.com", signing_key, algorithm, 3600)[0]
+        for i in range(working_set)
+    ]
+    uncached = _ops_per_second(tokens, verify_key, algorithm, operations, None)
+    cache = TokenCache(maxsize=working_set, ttl=3600)
+    cached = _ops_per_second(tokens, verify_key, algorithm, operations, cache)
+    stats = cache.stats()
+    return {
+        "benchmark": "decode_jwt",
+        "algorithm": algorithm,
+        "working_set": working_set,
+        "operations": operations,
+        "uncached_ops_per_second": uncached,
+        "cached_ops_per_second": cached,
+        "speedup": cached / uncached,
+        "cache_hits": stats.hits,
+        "cache_misses": stats.misses,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--algorithms", default="HS256,RS256")
+    parser.add_argument("--working-set", type=int, default=1000)
+    parser.add_argument("--operations", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    for algorithm in args.algorithms.split(","):
+        print(json.dumps(run(algorithm, args.working_set, args.operations)))
+
+
+if __name__ == "__main__":
+    main()
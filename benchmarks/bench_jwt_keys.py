@@ -0,0 +1,101 @@
+"""
+Sign and verify throughput with raw key strings versus prepared key objects.
+
+"raw" passes the secret or PEM key straight to PyJWT, which parses it on every
+call, as generate_jwt/decode_jwt used to. "prepared" goes through
+keys.KeyManager, which parses each key once. Prints one JSON object per
+algorithm. RS256 and EdDSA need the cryptography package.
+
+    PYTHONPATH=src python benchmarks/bench_jwt_keys.py
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+from signi_email_otp.keys import KeyManager, load_key
+
+
+def _keys(algorithm):
+    """Return the signing and verification key as strings."""
+    if algorithm == "HS256":
+        return "benchmark-secret", "benchmark-secret"
+    if algorithm == "RS256":
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    public_pem = (
+        private_key.public_key()
+        .public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        .decode()
+    )
+    return private_pem, public_pem
+
+
+def _raw_generate_jwt(email, secret, algorithm, expiry_seconds):
+    # generate_jwt before keys were prepared
+    exp_timestamp = int(time.time()) + expiry_seconds
+    payload = {"email": email, "exp": exp_timestamp}
+    token = jwt.encode(payload, secret, algorithm=algorithm)
+    return token, datetime.fromtimestamp(exp_timestamp, timezone.utc)
+
+
+def _ops_per_second(operation, operations):
+    started = time.perf_counter()
+    for i in range(operations):
+        operation(i)
+    return operations / (time.perf_counter() - started)
+
+
+def run(algorithm, operations):
+    signing_key, verify_key = _keys(algorithm)
+    keys = KeyManager([load_key("bench", algorithm, signing_key, verify_key)])
+    payload = {"email": "user@example.com", "exp": int(time.time()) + 3600}
+    token = jwt.encode(payload, signing_key, algorithm=algorithm)
+    kid_token, _ = keys.generate_jwt("user@example.com", 3600)
+
+    results = {
+        "raw_sign": lambda i: _raw_generate_jwt(
+            "user@example.com", signing_key, algorithm, 3600
+        ),
+        "prepared_sign": lambda i: keys.generate_jwt("user@example.com", 3600),
+        "raw_verify": lambda i: jwt.decode(token, verify_key, algorithms=[algorithm]),
+        "prepared_verify": lambda i: keys.decode_jwt(kid_token),
+    }
+    result = {"benchmark": "jwt_keys", "algorithm": algorithm, "operations": operations}
+    for name, operation in results.items():
+        result[f"{name}_ops_per_second"] = _ops_per_second(operation, operations)
+    result["sign_speedup"] = (
+        result["prepared_sign_ops_per_second"] / result["raw_sign_ops_per_second"]
+    )
+    result["verify_speedup"] = (
+        result["prepared_verify_ops_per_second"] / result["raw_verify_ops_per_second"]
+    )
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--algorithms", default="HS256,RS256,EdDSA")
+    parser.add_argument("--operations", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    for algorithm in args.algorithms.split(","):
+        print(json.dumps(run(algorithm, args.operations)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Email lookup latency on the otp table before and after schema migration 1.
+
+Loads the pre-migration schema with N rows, times lookups by email, applies
+the migration in place and times the same lookups again. Prints one JSON
+object per table size.
+
+    PYTHONPATH=src python benchmarks/bench_lookup.py --rows 1000000,10000000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, text
+
+from signi_email_otp import migrations
+
+INSERT_CHUNK = 50_000
+
+
+def _create_legacy_schema(engine):
+    with engine.begin() as conn:
+        for table in ("otp", "refresh_tokens", migrations.schema_version.name):
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(
+            text(
+                "CREATE TABLE otp (id INTEGER PRIMARY KEY, email VARCHAR NOT NULL, "
+                "otp_code VARCHAR NOT NULL, created_at TIMESTAMP, used BOOLEAN, "
+                "attempts_left INTEGER NOT NULL)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE refresh_tokens (id INTEGER PRIMARY KEY, "
+                "email VARCHAR NOT NULL, refresh_token VARCHAR NOT NULL, "
+                "created_at TIMESTAMP, expires_at TIMESTAMP)"
+            )
+        )
+
+
+def _load(engine, rows):
+    now = datetime.now(timezone.utc)
+    insert = text(
+        "INSERT INTO otp (id, email, otp_code, created_at, used, attempts_left) "
+        "VALUES (:id, :email, '123456', :created_at, false, 3)"
+    )
+    for start in range(0, rows, INSERT_CHUNK):
+        batch = [
+            {"id": i + 1, "email": f"user{i}@example.com", "created_at": now}
+            for i in range(start, min(start + INSERT_CHUNK, rows))
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert, batch)
+
+
+def _time_lookups(engine, rows, samples):
+    query = text("SELECT id, otp_code FROM otp WHERE email = :email LIMIT 1")
+    latencies = []
+    with engine.connect() as conn:
+        for _ in range(samples):
+            email = f"user{random.randrange(rows)}@example.com"
+            started = time.perf_counter()
+            conn.execute(query, {"email": email}).first()
+            latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "samples": samples,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "mean_ms": statistics.fmean(latencies),
+    }
+
+
+def run(db_url, rows, samples_before, samples_after):
+    engine = create_engine(db_url)
+    try:
+        _create_legacy_schema(engine)
+        _load(engine, rows)
+        before = _time_lookups(engine, rows, samples_before)
+        started = time.perf_counter()
+        migrations.upgrade(engine, target=1)
+        migration_seconds = time.perf_counter() - started
+        after = _time_lookups(engine, rows, samples_after)
+    finally:
+        engine.dispose()
+    return {
+        "benchmark": "otp_email_lookup",
+        "dialect": engine.dialect.name,
+        "rows": rows,
+        "before": before,
+        "after": after,
+        "migration_seconds": migration_seconds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--db-url",
+        help="Database to benchmark against, defaults to a temporary SQLite file.",
+    )
+    parser.add_argument("--rows", default="1000000,10000000")
+    parser.add_argument("--samples-before", type=int, default=20)
+    parser.add_argument("--samples-after", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        for rows in (int(r) for r in args.rows.split(",")):
+            result = run(db_url, rows, args.samples_before, args.samples_after)
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Cost per OTP code of the generators request_otp could use, under threads.
+
+"randint" is the str(random.randint(100000, 999999)) request_otp used,
+"secrets" draws each digit with secrets.choice, and "generator" is
+otp_generator.OTPGenerator, which slices codes off prefetched os.urandom
+buffers. generator_speedup is relative to "secrets", the unbuffered way to
+draw codes from the same source. Every thread generates --codes codes.
+Prints one JSON object per thread count with microseconds per code,
+measured over the wall time of all threads.
+
+    PYTHONPATH=src python benchmarks/bench_otp_generator.py --threads 1,4,16
+"""
+
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+
+from signi_email_otp.otp_generator import OTPGenerator
+
+DIGITS = "0123456789"
+
+
+def _randint():
+    return str(random.randint(100000, 999999))
+
+
+def _secrets():
+    return "".join(secrets.choice(DIGITS) for _ in range(6))
+
+
+def _microseconds_per_code(generate, threads, codes):
+    def worker():
+        for _ in range(codes):
+            generate()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - started) / (threads * codes) * 1e6
+
+
+def run(threads, codes):
+    generators = {
+        "randint": _randint,
+        "secrets": _secrets,
+        "generator": OTPGenerator().generate,
+    }
+    result = {"benchmark": "otp_generator", "threads": threads, "codes": codes}
+    for name, generate in generators.items():
+        result[f"{name}_us"] = _microseconds_per_code(generate, threads, codes)
+    result["generator_speedup"] = result["secrets_us"] / result["generator_us"]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", default="1,4,16")
+    parser.add_argument("--codes", type=int, default=50000, help="Per thread.")
+    args = parser.parse_args(argv)
+    for threads in args.threads.split(","):
+        print(json.dumps(run(int(threads), args.codes)))
+
+
+if __name__ == "__main__":
+    main()
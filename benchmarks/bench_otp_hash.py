@@ -0,0 +1,85 @@
+"""
+Cost of checking an OTP against plaintext versus keyed hash storage.
+
+"plain" is the string comparison verify_otp made against stored codes.
+"hmac_per_call" builds the HMAC from the secret on every check, "prepared"
+goes through otp_hash.OTPHasher, which computes the key schedule once.
+"memory_store_*" times a full issue and consume on MemoryOTPStore. Prints one
+JSON object with microseconds per operation.
+
+    PYTHONPATH=src python benchmarks/bench_otp_hash.py
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import time
+
+from signi_email_otp.otp_hash import OTPHasher
+from signi_email_otp.otp_store import MemoryOTPStore
+
+SECRET = "benchmark-secret"
+EMAIL = "user@example.com"
+
+
+def _hmac_per_call(email, code, otp_hash):
+    message = f"{email}\0{code}".encode()
+    expected = hmac.new(SECRET.encode(), message, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, otp_hash)
+
+
+class _PlainHasher(OTPHasher):
+    """Stores codes as they are, as the otp table did before migration 3."""
+
+    def hash(self, email, code):
+        return code
+
+    def verify(self, email, code, otp_hash):
+        return code == otp_hash
+
+
+def _microseconds_per_op(operation, operations):
+    started = time.perf_counter()
+    for i in range(operations):
+        operation(i)
+    return (time.perf_counter() - started) / operations * 1e6
+
+
+def _issue_and_consume(store):
+    def operation(i):
+        email = f"user{i}@example.com"
+        store.issue(email, "123456")
+        store.consume(email, "123456")
+
+    return operation
+
+
+def run(operations):
+    hasher = OTPHasher(SECRET)
+    code, otp_hash = "123456", hasher.hash(EMAIL, "123456")
+    results = {
+        "plain": lambda i: code != otp_hash,
+        "hmac_per_call": lambda i: _hmac_per_call(EMAIL, code, otp_hash),
+        "prepared": lambda i: hasher.verify(EMAIL, code, otp_hash),
+        "memory_store_plain": _issue_and_consume(
+            MemoryOTPStore(hasher=_PlainHasher(SECRET))
+        ),
+        "memory_store_hashed": _issue_and_consume(MemoryOTPStore(hasher=hasher)),
+    }
+    result = {"benchmark": "otp_hash", "operations": operations}
+    for name, operation in results.items():
+        result[f"{name}_us"] = _microseconds_per_op(operation, operations)
+    result["prepared_speedup"] = result["hmac_per_call_us"] / result["prepared_us"]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--operations", type=int, default=100000)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.operations)))
+
+
+if __name__ == "__main__":
+    main()
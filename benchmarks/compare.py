@@ -0,0 +1,75 @@
+"""
+Compare two benchmark result files and report regressions.
+
+Reads the JSON lines written by bench_auth.py (e.g. from one release and the
+next), matches runs by their parameters and flags any run whose throughput
+dropped, or whose p99 latency rose, by more than --threshold. Exits with
+status 1 when a regression is found.
+
+    python benchmarks/compare.py baseline.jsonl candidate.jsonl --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+KEY_FIELDS = (
+    "benchmark",
+    "operation",
+    "dialect",
+    "rows",
+    "concurrency",
+    "hot_emails",
+    "hot_ratio",
+    "jwt_cache",
+)
+
+
+def load(path: str) -> dict[tuple, dict]:
+    results = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if "ops_per_second" not in result:
+                continue
+            # Later runs with the same parameters replace earlier ones.
+            results[tuple(result.get(field) for field in KEY_FIELDS)] = result
+    return results
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[dict]:
+    rows = []
+    for key in sorted(baseline.keys() & candidate.keys(), key=str):
+        old, new = baseline[key], candidate[key]
+        if not old["ops_per_second"] or not old["latency_ms"]["p99"]:
+            continue
+        throughput = new["ops_per_second"] / old["ops_per_second"] - 1
+        p99 = new["latency_ms"]["p99"] / old["latency_ms"]["p99"] - 1
+        rows.append(
+            {
+                **dict(zip(KEY_FIELDS, key)),
+                "ops_per_second_change": throughput,
+                "p99_change": p99,
+                "regression": throughput < -threshold or p99 > threshold,
+            }
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    rows = compare(load(args.baseline), load(args.candidate), args.threshold)
+    for row in rows:
+        print(json.dumps(row))
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+"""
+asyncio API for signi_email_otp, built on SQLAlchemy's AsyncEngine.
+Install with the aio extra for the async database drivers and SMTP client.
+"""
+
+from .auth import request_otp, request_otp_and_send_email, verify_otp
+from .db import get_db, dispose
+
+__all__ = [
+    "request_otp",
+    "request_otp_and_send_email",
+    "verify_otp",
+    "get_db",
+    "dispose",
+]
@@ -0,0 +1,102 @@
+from sqlalchemy import select
+
+from ..config import (
+    SMTP_HOST,
+    SMTP_PORT,
+    SMTP_FROM_EMAIL,
+    SMTP_FROM_PASSWORD,
+    SMTP_USE_SSL,
+    get_settings,
+)
+from .. import metrics
+from ..core import logger
+from ..exception import (  # noqa: F401
+    RateLimitOTPExceededException,
+    OTPNotFoundException,
+    InvalidOTPException,
+    OTPExpiredException,
+    OTPAttemptsExceededException,
+)
+from ..models import JWT
+from ..otp_generator import generate_otp
+from ..otp_store import issue_outcome
+from .db import get_db
+from .email_service import send_otp_email
+from .otp_store import get_otp_store
+from .rate_limit import check_otp_request
+from .send_dedup import get_send_coalescer
+from ..tokens import reusable, store_new_token
+
+
+async def request_otp(email, client_ip: str | None = None) -> str:
+    """
+    Issue a new OTP for email. client_ip, when known, is rate
+    limited along with the email and its domain before anything else.
+    """
+    await check_otp_request(email, client_ip)
+    logger.info("Requesting OTP for email: %s", email)
+    new_code = generate_otp()
+    with metrics.timer("otp_request_seconds"):
+        try:
+            otp = await get_otp_store().issue(email, new_code)
+        except RateLimitOTPExceededException as e:
+            metrics.increment("otp_requests_total", outcome=issue_outcome(e, new_code))
+            raise
+    metrics.increment("otp_requests_total", outcome=issue_outcome(otp, new_code))
+    return otp
+
+
+async def request_otp_and_send_email(email, client_ip: str | None = None) -> str:
+    """
+    Request an OTP for the given email and send it via email.
+    An unexpired OTP is sent again.
+    Returns send_dedup.QUEUED, or COALESCED as the sync version does.
+    """
+
+    async def send():
+        otp = await request_otp(email, client_ip)
+        settings = get_settings()
+        await send_otp_email(
+            SMTP_HOST,
+            int(SMTP_PORT),
+            SMTP_FROM_EMAIL,
+            SMTP_FROM_PASSWORD,
+            email,
+            settings.otp_email_subject,
+            settings.otp_email_body.format(otp=otp),
+            use_tls=SMTP_USE_SSL,
+        )
+
+    return await get_send_coalescer().run(email, send)
+
+
+async def verify_otp(email, otp) -> str:
+    """See signi_email_otp.auth.verify_otp."""
+    try:
+        return await _verify_otp(email, otp)
+    finally:
+        get_send_coalescer().forget(email)
+
+
+async def _verify_otp(email, otp) -> str:
+    with metrics.timer("otp_verify_seconds"):
+        try:
+            await get_otp_store().consume(email, otp)
+        except Exception as e:
+            metrics.increment("otp_verifications_total", outcome=metrics.error_label(e))
+            raise
+    metrics.increment("otp_verifications_total", outcome="verified")
+
+    async with get_db() as session:
+        # Reuse an existing JWT, e.g. when logging in from another device,
+        # unless it expires within JWT_RENEW_BEFORE_SECONDS.
+        result = await session.execute(select(JWT).filter_by(email=email))
+        jwt_obj = result.scalars().first()
+        if reusable(jwt_obj):
+            logger.info("JWT already exists for %s, reusing it.", email)
+            return jwt_obj.refresh_token
+
+        logger.info("No reusable JWT for %s, generating a new one.", email)
+        jwt_obj = store_new_token(email, jwt_obj)
+        session.add(jwt_obj)
+    return jwt_obj.refresh_token
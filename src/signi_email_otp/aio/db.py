@@ -0,0 +1,127 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator
+
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from ..config import (
+    ASYNC_DB_URL,
+    DB_ECHO,
+    DB_AUTO_MIGRATE,
+    DB_POOL_WARMUP,
+    MAX_CONN,
+)
+from .. import metrics
+from ..core import logger
+from ..db import initialize_schema, is_sharded, pool_options
+
+_engine: AsyncEngine | None = None
+_SessionLocal: async_sessionmaker[AsyncSession] | None = None
+_init_lock: asyncio.Lock | None = None
+
+
+def _get_engine() -> AsyncEngine:
+    """Get the SQLAlchemy async engine."""
+    options = pool_options()
+    logger.info("Creating async database engine with URL: %s", ASYNC_DB_URL)
+    logger.info("Database pool settings: %s", options)
+    engine = create_async_engine(ASYNC_DB_URL, echo=DB_ECHO, **options)
+    metrics.instrument_engine(engine.sync_engine)
+    metrics.instrument_pool(engine.sync_engine, "async")
+    return engine
+
+
+async def init(
+    migrate: bool = DB_AUTO_MIGRATE, warmup_connections: int = DB_POOL_WARMUP
+) -> async_sessionmaker[AsyncSession]:
+    """
+    Create the engine and session factory unless already done, see
+    signi_email_otp.db.init. Returns the session factory.
+
+    Raises ValueError with DB_SHARD_URLS set, since ASYNC_DB_URL would hold
+    different OTPs and refresh tokens than the shards the sync API uses.
+    """
+    global _engine, _SessionLocal, _init_lock
+    if is_sharded():
+        raise ValueError("DB_SHARD_URLS is not supported by the asyncio API")
+    factory = _SessionLocal
+    if factory is None:
+        if _init_lock is None:
+            _init_lock = asyncio.Lock()
+        async with _init_lock:
+            factory = _SessionLocal
+            if factory is None:
+                engine = _get_engine()
+                async with engine.connect() as conn:
+                    await conn.run_sync(initialize_schema, migrate)
+                _engine = engine
+                factory = _SessionLocal = async_sessionmaker(
+                    engine, autoflush=False, expire_on_commit=False
+                )
+    if warmup_connections:
+        await warmup(warmup_connections)
+    return factory
+
+
+async def warmup(connections: int = MAX_CONN):
+    """Open up to connections pool connections ahead of the first request."""
+    engine: AsyncEngine = (await init(warmup_connections=0)).kw["bind"]
+    held = []
+    try:
+        for _ in range(connections):
+            held.append(await engine.connect())
+    finally:
+        for conn in held:
+            await conn.close()
+    logger.info("Opened %s connections to %s", len(held), engine.url)
+
+
+async def _get_session_factory() -> async_sessionmaker[AsyncSession]:
+    return _SessionLocal or await init(warmup_connections=0)
+
+
+def _reset_after_fork():
+    """
+    Give a forked child its own pool and init lock, the inherited
+    connections are left open for the parent.
+    """
+    global _init_lock
+    _init_lock = None
+    if _engine is not None:
+        _engine.sync_engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@asynccontextmanager
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    session_factory = await _get_session_factory()
+    session = session_factory()
+    try:
+        if metrics.enabled():
+            with metrics.timer("db_connection_wait_seconds"):
+                await session.connection()
+        yield session
+        await session.commit()  # commit by default
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+async def dispose():
+    """Close all pooled connections, e.g. on application shutdown."""
+    global _engine, _SessionLocal
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _SessionLocal = None
@@ -0,0 +1,45 @@
+from email.mime.text import MIMEText
+
+from ..core import logger
+
+
+async def send_otp_email(
+    smtp_host: str,
+    smtp_port: int,
+    email_from: str,
+    email_password: str,
+    email_to: str,
+    subject: str,
+    body: str,
+    use_tls: bool = True,
+) -> str | None:
+    """
+    asyncio counterpart of email_service.send_otp_email.
+    Requires the optional aiosmtplib package.
+    """
+    import aiosmtplib
+
+    msg = MIMEText(body)
+    msg["Subject"] = subject
+    msg["From"] = email_from
+    msg["To"] = email_to
+
+    try:
+        await aiosmtplib.send(
+            msg,
+            hostname=smtp_host,
+            port=smtp_port,
+            username=email_from if email_password else None,
+            password=email_password or None,
+            use_tls=use_tls,
+            start_tls=False,
+        )
+        logger.info(
+            "Email sent successfully to %s with subject '%s'", email_to, subject
+        )
+        return None
+    except Exception as e:
+        logger.error(
+            "Failed to send email to %s with subject '%s': %s", email_to, subject, e
+        )
+        raise
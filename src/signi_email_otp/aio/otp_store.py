@@ -0,0 +1,290 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from ..config import (
+    OTP_STORE,
+    OTP_STORE_REDIS_URL,
+    OTP_VERIFY_ATTEMPTS,
+    get_settings,
+)
+from ..core import logger
+from ..exception import OTPAttemptsExceededException
+from ..models import OTP
+from ..otp_hash import OTPHasher, get_otp_hasher
+from ..otp_store import (
+    OTP_REQUEST_ATTEMPTS,
+    LockoutCache,
+    MemoryOTPStore,
+    OTPStore,
+    _REDIS_CONSUME_SCRIPT,
+    _REDIS_ISSUE_SCRIPT,
+    _REDIS_RESEAL_SCRIPT,
+    _UPSERT_INSERTS,
+    _attempts_exceeded,
+    locked_until,
+    redis_consume_result,
+    redis_issue_args,
+    redis_issued_code,
+    reissue,
+    reseal_statement,
+    take_verify_attempt,
+    upsert_statement,
+    upserted_code,
+    verify_error,
+    verify_statement,
+)
+from .db import get_db
+
+
+class AsyncOTPStore(ABC):
+    """asyncio counterpart of otp_store.OTPStore."""
+
+    def __init__(
+        self,
+        expiry_seconds: float | None = None,
+        max_requests: int = OTP_REQUEST_ATTEMPTS,
+        hasher: OTPHasher | None = None,
+        max_verify_attempts: int = OTP_VERIFY_ATTEMPTS,
+    ):
+        self._expiry_seconds = expiry_seconds
+        self.max_requests = max_requests
+        self._hasher = hasher
+        self.max_verify_attempts = max_verify_attempts
+
+    @property
+    def expiry_seconds(self) -> float:
+        """See OTPStore.expiry_seconds."""
+        if self._expiry_seconds is not None:
+            return self._expiry_seconds
+        return get_settings().otp_expiry_seconds
+
+    @property
+    def hasher(self) -> OTPHasher:
+        """See OTPStore.hasher."""
+        return self._hasher or get_otp_hasher()
+
+    @abstractmethod
+    async def issue(self, email: str, new_code: str) -> str:
+        """See OTPStore.issue."""
+
+    @abstractmethod
+    async def consume(self, email: str, otp: str) -> None:
+        """See OTPStore.consume."""
+
+
+class AsyncSQLOTPStore(AsyncOTPStore):
+    """OTPs kept in the otp table, accessed through an AsyncSession."""
+
+    def __init__(self, get_db_func=None, lockouts: LockoutCache | None = None, **kw):
+        super().__init__(**kw)
+        self._get_db = get_db_func
+        self.lockouts = lockouts if lockouts is not None else LockoutCache()
+
+    def session(self):
+        return (self._get_db or get_db)()
+
+    async def issue(self, email: str, new_code: str) -> str:
+        hasher = self.hasher
+        otp_hash, otp_sealed = hasher.hash(email, new_code), hasher.seal(
+            email, new_code
+        )
+        async with self.session() as session:
+            insert = _UPSERT_INSERTS.get(session.bind.dialect.name)
+            if insert is None:
+                return await self._locked_issue(
+                    session, email, new_code, otp_hash, otp_sealed
+                )
+            stmt = upsert_statement(
+                insert,
+                email,
+                otp_hash,
+                otp_sealed,
+                self.expiry_seconds,
+                self.max_requests,
+                self.max_verify_attempts,
+            )
+            row = (await session.execute(stmt)).first()
+            code = upserted_code(email, row, hasher)
+            if code is None:
+                await session.execute(reseal_statement(email, otp_hash, otp_sealed))
+                return new_code
+            return code
+
+    async def _locked_issue(
+        self, session, email, new_code, otp_hash, otp_sealed
+    ) -> str:
+        result = await session.execute(
+            select(OTP).filter_by(email=email).with_for_update()
+        )
+        otp_obj = result.scalars().first()
+        if otp_obj:
+            return reissue(
+                otp_obj,
+                email,
+                new_code,
+                otp_hash,
+                otp_sealed,
+                self.expiry_seconds,
+                self.max_requests,
+                self.max_verify_attempts,
+                self.hasher,
+            )
+        try:
+            async with session.begin_nested():
+                session.add(
+                    OTP(
+                        email=email,
+                        otp_hash=otp_hash,
+                        otp_sealed=otp_sealed,
+                        created_at=datetime.now(timezone.utc),
+                        attempts_left=self.max_requests,
+                        verify_attempts_left=self.max_verify_attempts,
+                    )
+                )
+        except IntegrityError:
+            return await self._locked_issue(
+                session, email, new_code, otp_hash, otp_sealed
+            )
+        logger.info("Generated new OTP for %s", email)
+        return new_code
+
+    async def consume(self, email: str, otp: str) -> None:
+        if self.lockouts.locked(email):
+            raise _attempts_exceeded(email)
+        async with self.session() as session:
+            if session.bind.dialect.update_returning:
+                stmt = verify_statement(email, self.hasher.hash(email, otp))
+                row = (await session.execute(stmt)).first()
+            else:
+                result = await session.execute(
+                    select(OTP).filter_by(email=email).with_for_update()
+                )
+                otp_obj = result.scalars().first()
+                row = take_verify_attempt(otp_obj, email, otp, self.hasher)
+            error = verify_error(email, row, self.expiry_seconds)
+            if error is None:
+                await session.execute(delete(OTP).where(OTP.email == email))
+        if error is not None:
+            if isinstance(error, OTPAttemptsExceededException):
+                self.lockouts.add(email, locked_until(row, self.expiry_seconds))
+            raise error
+
+
+class AsyncStoreAdapter(AsyncOTPStore):
+    """
+    Expose a synchronous store whose operations never block, such as
+    MemoryOTPStore, through the async interface.
+    """
+
+    def __init__(self, store: OTPStore):
+        super().__init__(
+            max_requests=store.max_requests,
+            max_verify_attempts=store.max_verify_attempts,
+        )
+        self.store = store
+
+    @property
+    def expiry_seconds(self) -> float:
+        return self.store.expiry_seconds
+
+    async def issue(self, email: str, new_code: str) -> str:
+        return self.store.issue(email, new_code)
+
+    async def consume(self, email: str, otp: str) -> None:
+        self.store.consume(email, otp)
+
+
+class AsyncRedisOTPStore(AsyncOTPStore):
+    """
+    asyncio counterpart of otp_store.RedisOTPStore, sharing its scripts and
+    key layout. Requires the optional redis client package.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        url: str = OTP_STORE_REDIS_URL,
+        key_prefix: str = "signi_email_otp:otp:",
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        if client is None:
+            import redis.asyncio
+
+            client = redis.asyncio.Redis.from_url(url)
+        self.client = client
+        self.key_prefix = key_prefix
+        self._issue = client.register_script(_REDIS_ISSUE_SCRIPT)
+        self._reseal = client.register_script(_REDIS_RESEAL_SCRIPT)
+        self._consume = client.register_script(_REDIS_CONSUME_SCRIPT)
+        self._scripts_loaded = False
+
+    def _key(self, email):
+        return f"{self.key_prefix}{email}"
+
+    async def _load_scripts(self):
+        # Loaded once up front so requests do not pay for a NOSCRIPT round trip.
+        if not self._scripts_loaded:
+            for script in (self._issue, self._reseal, self._consume):
+                await self.client.script_load(script.script)
+            self._scripts_loaded = True
+
+    async def issue(self, email: str, new_code: str) -> str:
+        await self._load_scripts()
+        key, args = self._key(email), redis_issue_args(self, email, new_code)
+        sealed = await self._issue(keys=[key], args=args)
+        while (code := redis_issued_code(email, sealed, self.hasher)) is None:
+            sealed = await self._reseal(keys=[key], args=[*args, sealed])
+        return code
+
+    async def consume(self, email: str, otp: str) -> None:
+        await self._load_scripts()
+        otp_hash = self.hasher.hash(email, otp)
+        status = await self._consume(
+            keys=[self._key(email)], args=[otp_hash, self.max_verify_attempts]
+        )
+        redis_consume_result(email, status)
+
+
+def _memory_store(**kwargs) -> AsyncOTPStore:
+    return AsyncStoreAdapter(MemoryOTPStore(**kwargs))
+
+
+_STORE_BACKENDS: dict[str, Callable[..., AsyncOTPStore]] = {
+    "sql": AsyncSQLOTPStore,
+    "memory": _memory_store,
+    "redis": AsyncRedisOTPStore,
+}
+
+_store: AsyncOTPStore | None = None
+
+
+def create_otp_store(backend: str = OTP_STORE, **kwargs) -> AsyncOTPStore:
+    """Build the async OTP store for the named backend: sql, memory or redis."""
+    try:
+        store_factory = _STORE_BACKENDS[backend.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unknown OTP store backend {backend!r}, "
+            f"expected one of {sorted(_STORE_BACKENDS)}"
+        ) from None
+    return store_factory(**kwargs)
+
+
+def get_otp_store() -> AsyncOTPStore:
+    """Return the async OTP store selected by the OTP_STORE setting."""
+    global _store
+    if _store is None:
+        _store = create_otp_store()
+        logger.info("Using %s for async OTP storage", type(_store).__name__)
+    return _store
+
+
+def set_otp_store(store: AsyncOTPStore | None):
+    """Replace the async OTP store, None reverts to the configured one."""
+    global _store
+    _store = store
@@ -0,0 +1,115 @@
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable
+
+from ..config import RATE_LIMIT, RATE_LIMIT_REDIS_URL
+from ..core import logger
+from ..rate_limit import (
+    REDIS_ACQUIRE_SCRIPT,
+    Limit,
+    MemoryRateLimiter,
+    NullRateLimiter,
+    RateLimiter,
+    otp_request_buckets,
+    rate_limited,
+    redis_script_args,
+)
+
+
+class AsyncRateLimiter(ABC):
+    """asyncio counterpart of rate_limit.RateLimiter."""
+
+    enabled = True
+
+    @abstractmethod
+    async def acquire(self, buckets: list[tuple[str, Limit]]) -> str | None:
+        """See rate_limit.RateLimiter.acquire."""
+
+
+class AsyncLimiterAdapter(AsyncRateLimiter):
+    """
+    Expose a synchronous limiter whose operations never block, such as
+    MemoryRateLimiter, through the async interface.
+    """
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+        self.enabled = limiter.enabled
+
+    async def acquire(self, buckets: list[tuple[str, Limit]]) -> str | None:
+        return self.limiter.acquire(buckets)
+
+
+class AsyncRedisRateLimiter(AsyncRateLimiter):
+    """
+    asyncio counterpart of rate_limit.RedisRateLimiter, sharing its script
+    and key layout. Requires the optional redis client package.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        url: str = RATE_LIMIT_REDIS_URL,
+        key_prefix: str = "signi_email_otp:rate:",
+    ):
+        if client is None:
+            import redis.asyncio
+
+            client = redis.asyncio.Redis.from_url(url)
+        self.client = client
+        self.key_prefix = key_prefix
+        self._acquire: Callable[..., Awaitable[Any]] = client.register_script(
+            REDIS_ACQUIRE_SCRIPT
+        )
+
+    async def acquire(self, buckets: list[tuple[str, Limit]]) -> str | None:
+        if not buckets:
+            return None
+        keys, args = redis_script_args(self.key_prefix, buckets)
+        empty = int(await self._acquire(keys=keys, args=args))
+        return buckets[empty - 1][0] if empty else None
+
+
+_LIMITER_BACKENDS: dict[str, Callable[..., AsyncRateLimiter]] = {
+    "none": lambda: AsyncLimiterAdapter(NullRateLimiter()),
+    "memory": lambda **kwargs: AsyncLimiterAdapter(MemoryRateLimiter(**kwargs)),
+    "redis": AsyncRedisRateLimiter,
+}
+
+_limiter: AsyncRateLimiter | None = None
+
+
+def create_rate_limiter(backend: str = RATE_LIMIT, **kwargs) -> AsyncRateLimiter:
+    """Build the async rate limiter for the named backend: none, memory or redis."""
+    try:
+        limiter_factory = _LIMITER_BACKENDS[backend.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unknown rate limit backend {backend!r}, "
+            f"expected one of {sorted(_LIMITER_BACKENDS)}"
+        ) from None
+    return limiter_factory(**kwargs)
+
+
+def get_rate_limiter() -> AsyncRateLimiter:
+    """Return the async rate limiter selected by the RATE_LIMIT setting."""
+    global _limiter
+    if _limiter is None:
+        _limiter = create_rate_limiter()
+        logger.info("Using %s for async OTP rate limiting", type(_limiter).__name__)
+    return _limiter
+
+
+def set_rate_limiter(limiter: AsyncRateLimiter | None):
+    """Replace the async rate limiter, None reverts to the configured one."""
+    global _limiter
+    _limiter = limiter
+
+
+async def check_otp_request(email: str, client_ip: str | None = None):
+    """See rate_limit.check_otp_request."""
+    limiter = get_rate_limiter()
+    if not limiter.enabled:
+        return
+    key = await limiter.acquire(otp_request_buckets(email, client_ip))
+    if key is not None:
+        raise rate_limited(email, key)
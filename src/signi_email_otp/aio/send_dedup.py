@@ -0,0 +1,69 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from ..send_dedup import QUEUED, RecentSends, _coalesced
+from .. import metrics
+
+
+class AsyncSendCoalescer:
+    """
+    asyncio counterpart of send_dedup.SendCoalescer, for one event loop.
+    When the request in flight is cancelled, the ones waiting for it start
+    over, so one of them sends.
+    """
+
+    def __init__(self, recent: RecentSends | None = None):
+        self.recent = recent if recent is not None else RecentSends()
+        # Each flight's result is whether the send completed.
+        self._flights: dict[str, asyncio.Future[bool]] = {}
+
+    async def run(self, email: str, send: Callable[[], Awaitable[None]]) -> str:
+        """Await send() for email unless coalesced, returning QUEUED or COALESCED."""
+        while True:
+            if email in self.recent:
+                return _coalesced(email)
+            waiting_for = self._flights.get(email)
+            if waiting_for is None:
+                break
+            # shield, so a cancelled waiter does not cancel the send
+            if await asyncio.shield(waiting_for):
+                return _coalesced(email)
+        flight = self._flights[email] = asyncio.get_running_loop().create_future()
+        try:
+            await send()
+            self.recent.add(email)
+        except asyncio.CancelledError:
+            flight.set_result(False)
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            # Retrieved, so an error nobody waited for is not logged as lost
+            flight.exception()
+            raise
+        else:
+            flight.set_result(True)
+        finally:
+            del self._flights[email]
+        metrics.increment("otp_emails_total", outcome=QUEUED)
+        return QUEUED
+
+    def forget(self, email: str):
+        """See send_dedup.SendCoalescer.forget."""
+        self.recent.discard(email)
+
+
+_coalescer: AsyncSendCoalescer | None = None
+
+
+def get_send_coalescer() -> AsyncSendCoalescer:
+    """Return the AsyncSendCoalescer of the async API."""
+    global _coalescer
+    if _coalescer is None:
+        _coalescer = AsyncSendCoalescer()
+    return _coalescer
+
+
+def set_send_coalescer(coalescer: AsyncSendCoalescer | None):
+    """Replace the AsyncSendCoalescer, None reverts to a new one."""
+    global _coalescer
+    _coalescer = coalescer
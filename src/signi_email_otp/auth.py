@@ -1,134 +1,174 @@
-import random
-from datetime import datetime, timezone, timedelta
-from .email_service import send_otp_email
-from .jwt_utils import generate_jwt
-from .config import (
-    OTP_EXPIRY_SECONDS,
-    JWT_SECRET,
-    JWT_EXPIRY_SECONDS,
-    JWT_ALGORITHM,
-)
-from .db import get_db
-from .models import OTP, JWT
+from itertools import islice
+from typing import Iterable, Iterator
+from . import fast_verify, metrics
+from .email_queue import enqueue_email
+from .config import OTP_BATCH_CHUNK_SIZE, get_settings
+from .db import get_db, get_read_db, has_read_replica, is_sharded
+from .models import JWT
 from .core import logger
-from .exception import (
+from .otp_generator import generate_otp
+from .otp_store import get_otp_store, issue_outcome
+from .rate_limit import check_otp_request
+from .send_dedup import get_send_coalescer
+from .tokens import login_token, reusable
+from .exception import (  # noqa: F401
+    EmailQueueFullException,
     RateLimitOTPExceededException,
     OTPNotFoundException,
     InvalidOTPException,
     OTPExpiredException,
+    OTPAttemptsExceededException,
 )
 
 
-def request_otp(email) -> str:
-    logger.info(f"Requesting OTP for email: {email}")
-    otp: str = ""
-    with get_db() as session:
-        logger.debug(f"Requesting OTP for email: {email} and db session: {JWT_SECRET}")
-        # Check existing valid OTP
-        otp_obj = session.query(OTP).filter_by(email=email).first()
-
-        if otp_obj:
-            existing_otp = otp_obj.otp_code
-            created_at = otp_obj.created_at
-            attempts_left = otp_obj.attempts_left
-            otp_age = (datetime.now(timezone.utc) - created_at).total_seconds()
-            if otp_age < OTP_EXPIRY_SECONDS:
-                if attempts_left > 0:
-                    otp_obj.attempts_left -= 1
-                    session.add(otp_obj)
-                    logger.info(
-                        (
-                            (
-                                f"Reusing existing OTP for {email}, "
-                                f"age: {otp_age} seconds"
-                            )
-                        )
-                    )
-                    otp = existing_otp
+def request_otp(email, client_ip: str | None = None) -> str:
+    """
+    Issue a new OTP for email. client_ip, when known, is rate
+    limited along with the email and its domain before anything else.
+    """
+    check_otp_request(email, client_ip)
+    logger.info("Requesting OTP for email: %s", email)
+    new_code = generate_otp()
+    with metrics.timer("otp_request_seconds"):
+        try:
+            otp = get_otp_store().issue(email, new_code)
+        except RateLimitOTPExceededException as e:
+            metrics.increment("otp_requests_total", outcome=issue_outcome(e, new_code))
+            raise
+    metrics.increment("otp_requests_total", outcome=issue_outcome(otp, new_code))
+    return otp
+
+
+def request_otp_and_send_email(email, client_ip: str | None = None) -> str:
+    """
+    Request an OTP for the given email and send it via email.
+    An unexpired OTP is sent again.
+    The email is queued for delivery by the email workers, so this does not
+    wait on SMTP. Raises EmailQueueFullException when the queue is full.
+    Returns send_dedup.QUEUED, or COALESCED when a request for the same
+    email is in flight or queued one within OTP_RESEND_WINDOW_SECONDS, in
+    which case no new OTP is issued and nothing is queued.
+    """
+
+    def send():
+        otp = request_otp(email, client_ip)
+        settings = get_settings()
+        enqueue_email(
+            email, settings.otp_email_subject, settings.otp_email_body.format(otp=otp)
+        )
+
+    return get_send_coalescer().run(email, send)
+
+
+def request_otp_batch(
+    emails: Iterable[str],
+    chunk_size: int = OTP_BATCH_CHUNK_SIZE,
+    send_email: bool = False,
+) -> Iterator[dict[str, str | Exception]]:
+    """
+    Request OTPs for many emails, e.g. for bulk onboarding.
+    emails is consumed lazily in chunks of chunk_size, each chunk is issued
+    with one bulk statement and yields a mapping of email to its OTP, or to
+    the exception request_otp would have raised. Resending and rate limiting
+    follow request_otp, an email repeated within a chunk counts as another
+    request. With send_email, each chunk's OTPs are queued for delivery.
+    """
+    store = get_otp_store()
+    emails = iter(emails)
+    while chunk := list(islice(emails, chunk_size)):
+        results: dict[str, str | Exception] = {}
+        while chunk:
+            new_codes: dict[str, str] = {}
+            repeated = []
+            for email in chunk:
+                if email in new_codes:
+                    repeated.append(email)
                 else:
-                    logger.warning(
-                        (
-                            f"OTP for {email} has no attempts left, "
-                            "rate limiting applied."
-                        )
+                    new_codes[email] = generate_otp()
+            with metrics.timer("otp_request_batch_seconds"):
+                issued = store.issue_many(new_codes)
+            if metrics.enabled():
+                for email, otp in issued.items():
+                    metrics.increment(
+                        "otp_requests_total",
+                        outcome=issue_outcome(otp, new_codes[email]),
                     )
-                    raise RateLimitOTPExceededException(
-                        "Maximum attempts exceeded. Please try again later."
+            results.update(issued)
+            chunk = repeated
+        if send_email:
+            settings = get_settings()
+            for email, otp in results.items():
+                if isinstance(otp, Exception):
+                    continue
+                try:
+                    enqueue_email(
+                        email,
+                        settings.otp_email_subject,
+                        settings.otp_email_body.format(otp=otp),
                     )
-            else:
-                logger.info(f"Existing OTP for {email} expired, generating new OTP.")
-                otp = str(random.randint(100000, 999999))
-                otp_obj.otp_code = otp
-                otp_obj.created_at = datetime.now(timezone.utc)
-                otp_obj.attempts_left = 3
-                session.add(otp_obj)
-        else:
-            logger.debug(f"No existing OTP found for {email}, " "generating new OTP.")
-            otp = str(random.randint(100000, 999999))
-            otp_obj = OTP(
-                email=email,
-                otp_code=otp,
-                created_at=datetime.now(timezone.utc),
-                attempts_left=3,
-            )
-            session.add(otp_obj)
-            logger.info(f"Generated new OTP for {email}")
-    return otp
+                except EmailQueueFullException as e:
+                    results[email] = e
+        yield results
 
 
-def request_otp_and_send_email(email):
+def _replica_refresh_token(email) -> str | None:
     """
-    Request an OTP for the given email and send it via email.
-    If an existing valid OTP exists, it will be reused.
+    Look for a reusable refresh token on the read replica, if one is
+    configured. Rows there may be missing or outdated because of replication
+    lag, so only a token that is not due for renewal is returned, and None
+    sends the caller to the primary. The replica mirrors DB_URL, which holds no refresh
+    tokens when sharding is on.
     """
-    otp = request_otp(email)
-    send_otp_email(email, otp)
+    if not has_read_replica() or is_sharded():
+        return None
+    with metrics.timer("jwt_lookup_seconds", pool="replica"), get_read_db() as session:
+        jwt_obj = session.query(JWT).filter_by(email=email).first()
+        if reusable(jwt_obj):
+            metrics.increment("jwt_replica_lookups_total", result="hit")
+            return jwt_obj.refresh_token
+    metrics.increment("jwt_replica_lookups_total", result="fallback")
+    return None
 
 
 def verify_otp(email, otp):
-    with get_db() as session:
-        # Cleanup expired OTPs
-        expiry_time = datetime.now(timezone.utc) - timedelta(seconds=OTP_EXPIRY_SECONDS)
-        session.query(OTP).filter(OTP.created_at < expiry_time).delete(
-            synchronize_session=False
-        )
+    """
+    Check otp for email and return the email's refresh token. Raises the
+    store's exceptions when the OTP is wrong, expired, locked out or missing.
+    """
+    try:
+        return _verify_otp(email, otp)
+    finally:
+        # The OTP may be gone whatever the outcome, so the next request for
+        # email must send a new one rather than be coalesced.
+        get_send_coalescer().forget(email)
 
-        otp_obj = session.query(OTP).filter_by(email=email).first()
-        if not otp_obj:
-            logger.warning(f"OTP not found for email: {email}")
-            raise OTPNotFoundException("OTP not found for this email")
-        db_otp = otp_obj.otp_code
-        created_at = otp_obj.created_at
 
-        if db_otp != otp:
-            logger.warning(f"Invalid OTP for email: {email}")
-            raise InvalidOTPException("Invalid OTP provided.")
+def _verify_otp(email, otp):
+    store = get_otp_store()
+    if fast_verify.enabled(store):
+        try:
+            token = fast_verify.verify_otp(store, email, otp)
+        except Exception as e:
+            metrics.increment("otp_verifications_total", outcome=metrics.error_label(e))
+            raise
+        if token is not None:
+            metrics.increment("otp_verifications_total", outcome="verified")
+            return token
 
-        otp_age = (datetime.now(timezone.utc) - created_at).total_seconds()
-        if otp_age > OTP_EXPIRY_SECONDS:
-            logger.warning(f"OTP expired for email: {email}")
-            raise OTPExpiredException("OTP has expired")
+    with metrics.timer("otp_verify_seconds"):
+        try:
+            store.consume(email, otp)
+        except Exception as e:
+            metrics.increment("otp_verifications_total", outcome=metrics.error_label(e))
+            raise
+    metrics.increment("otp_verifications_total", outcome="verified")
 
-        # Delete the OTP after successful verification, to avoid reuse
-        session.delete(otp_obj)
+    token = _replica_refresh_token(email)
+    if token is not None:
+        logger.info("JWT already exists for %s, reusing it.", email)
+        return token
 
-        # Lets first check for an existing JWT for the email
-        # assume if user logged in from different device, we will reuse the JWT.
-        jwt_obj = session.query(JWT).filter_by(email=email).first()
-        if jwt_obj:
-            logger.info(f"JWT already exists for {email}, reusing it.")
-            token = jwt_obj.refresh_token
-        else:
-            logger.info(f"No JWT found for {email}, generating a new one.")
-            # Generate and store JWT
-            token, exp_time = generate_jwt(
-                email, JWT_SECRET, JWT_ALGORITHM, JWT_EXPIRY_SECONDS
-            )
-            jwt_obj = JWT(
-                email=email,
-                refresh_token=token,
-                created_at=datetime.now(timezone.utc),
-                expires_at=exp_time,
-            )
-            session.add(jwt_obj)
-    return token
+    with metrics.timer("jwt_lookup_seconds", pool="primary"), get_db(email) as session:
+        # Reuse the email's token, e.g. when logging in from another device,
+        # unless it expires within JWT_RENEW_BEFORE_SECONDS.
+        return login_token(session, email)
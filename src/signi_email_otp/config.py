@@ -1,41 +1,524 @@
+"""
+Settings, read from the environment and optionally a KEY=VALUE file named by
+SIGNI_OTP_CONFIG_FILE (the environment wins). Every value is parsed and
+validated once into a typed Settings object.
+
+The module level constants are the values at import and need a restart to
+change. Settings marked reloadable can be changed on a running process with
+reload_settings, e.g. on SIGHUP via install_reload_handler, and are read
+through get_settings() where they are used.
+"""
+
 import os
+import re
+import signal
+import threading
+from dataclasses import dataclass, field, fields, replace
+from typing import Callable
+
 from signi_email_otp.core import logger
 
+_TRUE = ("1", "true", "yes")
+
 
 def get_env(key, default=None):
     value = os.environ.get(key, default)
     if value is not None:
-        if key in os.environ:
-            logger.info(f"Environment variable {key} found: {value}")
-        else:
-            logger.warning(
-                f"Environment variable {key} not found, using default: {default}"
-            )
+        # Values are not logged, they may be secrets, see Settings.redacted.
+        logger.debug(
+            "Setting %s read from %s", key, "env" if key in os.environ else "default"
+        )
         return value
     raise KeyError(f"{key} not found in environment")
 
 
-# OTP expiration in seconds
-OTP_EXPIRY_SECONDS = get_env("OTP_EXPIRY_SECONDS", 300)
+@dataclass(frozen=True)
+class Limit:
+    """A token bucket holding capacity tokens, refilled over period_seconds."""
+
+    capacity: int
+    period_seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period_seconds
+
+    def __str__(self):
+        return f"{self.capacity}/{self.period_seconds:g}"
+
+
+def parse_limit(value: str) -> Limit | None:
+    """Parse count/seconds, e.g. 5/60. An empty value means no limit."""
+    if not value:
+        return None
+    try:
+        count, seconds = value.split("/")
+        limit = Limit(int(count), float(seconds))
+    except ValueError:
+        raise ValueError(f"Invalid rate limit {value!r}, expected count/seconds")
+    if limit.capacity <= 0 or limit.period_seconds <= 0:
+        raise ValueError(f"Invalid rate limit {value!r}, expected positive values")
+    return limit
+
+
+def _setting(
+    env: str,
+    default,
+    *,
+    reloadable: bool = False,
+    minimum: float | None = None,
+    redact: str | None = None,
+    case: str | None = None,
+    parser: Callable[[str], object] | None = None,
+):
+    """
+    Describe a Settings field read from env. redact is "secret" to hide the
+    value, or "url" to hide URL passwords. case is "lower" or "upper".
+    parser turns the raw value into the field's type, raising ValueError.
+    """
+    return field(
+        default=default,
+        metadata={
+            "env": env,
+            "reloadable": reloadable,
+            "minimum": minimum,
+            "redact": redact,
+            "case": case,
+            "parser": parser,
+        },
+    )
+
+
+@dataclass(frozen=True)
+class Settings:
+    # OTP expiration in seconds
+    otp_expiry_seconds: int = _setting(
+        "OTP_EXPIRY_SECONDS", 300, reloadable=True, minimum=1
+    )
+    # Characters per OTP code and the characters codes are drawn from
+    otp_length: int = _setting("OTP_LENGTH", 6, minimum=1)
+    otp_alphabet: str = _setting("OTP_ALPHABET", "0123456789")
+    # OTP storage backend: "sql", "memory" (single node only) or "redis"
+    otp_store: str = _setting("OTP_STORE", "sql", case="lower")
+    otp_store_redis_url: str = _setting(
+        "OTP_STORE_REDIS_URL", "redis://localhost:6379/0", redact="url"
+    )
+    # Number of independently locked stripes in the memory backend
+    otp_store_stripes: int = _setting("OTP_STORE_STRIPES", 64, minimum=1)
+    # Key OTPs are hashed with before they are stored, defaults to JWT_SECRET.
+    # Changing it invalidates pending OTPs.
+    otp_hash_secret: str = _setting("OTP_HASH_SECRET", "", redact="secret")
+    # Wrong codes allowed per OTP, after which it is locked until it expires
+    otp_verify_attempts: int = _setting("OTP_VERIFY_ATTEMPTS", 5, minimum=1)
+    # Locked out emails each process remembers, to reject them without a query
+    otp_lockout_cache_size: int = _setting("OTP_LOCKOUT_CACHE_SIZE", 10000, minimum=0)
+    # Seconds after an OTP email is queued during which further requests for
+    # the same email are coalesced with it, 0 only coalesces concurrent ones
+    otp_resend_window_seconds: float = _setting(
+        "OTP_RESEND_WINDOW_SECONDS", 10.0, minimum=0
+    )
+    # Recently emailed addresses each process remembers for that, the workers
+    # of signi-otp-server share SERVER_SHARED_SLOTS of them instead
+    otp_resend_cache_size: int = _setting("OTP_RESEND_CACHE_SIZE", 10000, minimum=0)
+    # How verify_otp reaches the database: "orm" (sessions) or "core", which
+    # consumes the OTP and looks up the refresh token on one connection with
+    # prebuilt Core statements, see fast_verify.py
+    verify_path: str = _setting("VERIFY_PATH", "orm", reloadable=True, case="lower")
+
+    # Token bucket rate limiting of request_otp before any database access:
+    # "none", "memory" (per process) or "redis" (shared by all nodes)
+    rate_limit: str = _setting("RATE_LIMIT", "none", case="lower")
+    # Defaults to OTP_STORE_REDIS_URL
+    rate_limit_redis_url: str = _setting("RATE_LIMIT_REDIS_URL", "", redact="url")
+    # Requests allowed per client IP, email domain and email, as count/seconds.
+    # An empty value turns that limit off.
+    rate_limit_ip: Limit | None = _setting(
+        "RATE_LIMIT_IP", Limit(20, 60), reloadable=True, parser=parse_limit
+    )
+    rate_limit_domain: Limit | None = _setting(
+        "RATE_LIMIT_DOMAIN", Limit(200, 60), reloadable=True, parser=parse_limit
+    )
+    rate_limit_email: Limit | None = _setting(
+        "RATE_LIMIT_EMAIL", Limit(5, 60), reloadable=True, parser=parse_limit
+    )
+    # Buckets kept by the memory backend, the least recently used are evicted
+    rate_limit_max_keys: int = _setting("RATE_LIMIT_MAX_KEYS", 100000, minimum=1)
+
+    # Emails handled per bulk statement by auth.request_otp_batch
+    otp_batch_chunk_size: int = _setting("OTP_BATCH_CHUNK_SIZE", 500, minimum=1)
+
+    # JWT token expiration in seconds (default 7 days)
+    jwt_expiry_seconds: int = _setting(
+        "JWT_EXPIRY_SECONDS", 604700, reloadable=True, minimum=1
+    )
+    # A stored refresh token expiring within this many seconds is replaced
+    # at login instead of reused (default 1 day)
+    jwt_renew_before_seconds: int = _setting(
+        "JWT_RENEW_BEFORE_SECONDS", 86400, reloadable=True, minimum=0
+    )
+    # Replaced refresh tokens remembered per email, presenting one revokes
+    # the email's token once the grace below has passed
+    jwt_rotation_history: int = _setting(
+        "JWT_ROTATION_HISTORY", 5, reloadable=True, minimum=0
+    )
+    # Seconds after a rotation during which tokens.rotate still exchanges
+    # the replaced token for the current one, for concurrent refreshes
+    jwt_rotation_grace_seconds: int = _setting(
+        "JWT_ROTATION_GRACE_SECONDS", 10, reloadable=True, minimum=0
+    )
+    # JWT secret key, or a PEM private key for asymmetric algorithms
+    jwt_secret: str = _setting("JWT_SECRET", "changeme", redact="secret")
+    jwt_algorithm: str = _setting("JWT_ALGORITHM", "HS256")
+    # Optional JSON list of keys for rotation, see keys.load_key_manager, and
+    # the kid of the one new tokens are signed with (default: the first).
+    jwt_keys: str = _setting("JWT_KEYS", "", redact="secret")
+    jwt_active_kid: str = _setting("JWT_ACTIVE_KID", "")
+    # Verified token cache used by decode_jwt, entries never outlive the exp
+    jwt_cache_size: int = _setting("JWT_CACHE_SIZE", 10000, minimum=0)
+    jwt_cache_ttl_seconds: float = _setting("JWT_CACHE_TTL_SECONDS", 60.0, minimum=0)
+
+    # Email sending (for mock SMTP, etc.)
+    smtp_host: str = _setting("SMTP_HOST", "localhost")
+    smtp_port: int = _setting("SMTP_PORT", 25, minimum=1)
+    smtp_from_email: str = _setting("SMTP_FROM_EMAIL", "test@test.com")
+    smtp_from_password: str = _setting("SMTP_PASSWORD", "changeme", redact="secret")
+    smtp_use_ssl: bool = _setting("SMTP_USE_SSL", True)
+    smtp_timeout: float = _setting("SMTP_TIMEOUT", 30.0, minimum=0)
+    # Authenticated SMTP sessions kept open per relay, and messages sent on a
+    # session before it is replaced.
+    smtp_pool_size: int = _setting("SMTP_POOL_SIZE", 4, minimum=1)
+    smtp_pool_max_messages: int = _setting("SMTP_POOL_MAX_MESSAGES", 100, minimum=1)
+    otp_email_subject: str = _setting(
+        "OTP_EMAIL_SUBJECT", "Your one-time password", reloadable=True
+    )
+    # {otp} is replaced with the code
+    otp_email_body: str = _setting(
+        "OTP_EMAIL_BODY", "Your one-time password is {otp}", reloadable=True
+    )
+
+    # Outbound email queue: "memory" or "db" (durable, in the email_outbox table)
+    email_queue: str = _setting("EMAIL_QUEUE", "memory", case="lower")
+    # Messages queued before callers get EmailQueueFullException, 0 is unbounded
+    email_queue_maxsize: int = _setting("EMAIL_QUEUE_MAXSIZE", 10000, minimum=0)
+    # Seconds request_otp_and_send_email waits for room in a full queue
+    email_queue_put_timeout: float = _setting("EMAIL_QUEUE_PUT_TIMEOUT", 0.1, minimum=0)
+    email_workers: int = _setting("EMAIL_WORKERS", 2, minimum=0)
+    email_batch_size: int = _setting("EMAIL_BATCH_SIZE", 50, minimum=1)
+    email_max_attempts: int = _setting("EMAIL_MAX_ATTEMPTS", 5, minimum=1)
+    email_retry_backoff_seconds: float = _setting(
+        "EMAIL_RETRY_BACKOFF_SECONDS", 1.0, minimum=0
+    )
+
+    # Database configuration
+    db_url: str = _setting(
+        "DB_URL", "postgresql+psycopg2://otpuser:otppass@db:5432/otpdb", redact="url"
+    )
+    # Pool limits are reloadable, db rebuilds its pools when they change.
+    max_conn: int = _setting("DB_POOL_MAX_CONN", 5, reloadable=True, minimum=1)
+    # Connections opened beyond MAX_CONN under load, closed again when returned
+    db_pool_max_overflow: int = _setting(
+        "DB_POOL_MAX_OVERFLOW", 5, reloadable=True, minimum=-1
+    )
+    # Seconds to wait for a free connection before raising
+    db_pool_timeout: float = _setting(
+        "DB_POOL_TIMEOUT", 30.0, reloadable=True, minimum=0
+    )
+    # Connections older than this many seconds are replaced, -1 disables
+    db_pool_recycle: int = _setting(
+        "DB_POOL_RECYCLE", 1800, reloadable=True, minimum=-1
+    )
+    # Test connections on checkout and replace ones the server has closed
+    db_pool_pre_ping: bool = _setting("DB_POOL_PRE_PING", False, reloadable=True)
+    # Reuse the most recently returned connection first, so idle ones can expire
+    db_pool_use_lifo: bool = _setting("DB_POOL_USE_LIFO", False, reloadable=True)
+    # Connections db.init opens ahead of the first request
+    db_pool_warmup: int = _setting("DB_POOL_WARMUP", 0, minimum=0)
+    # Bring the schema up to date on first use. Disable to run
+    # `signi-otp-migrate upgrade` as a separate deployment step instead.
+    db_auto_migrate: bool = _setting("DB_AUTO_MIGRATE", True)
+    # Optional read replica for lookups that tolerate lag, e.g. refresh tokens
+    db_replica_url: str = _setting("DB_REPLICA_URL", "", redact="url")
+    # Comma separated name=url shards for the otp and refresh_tokens tables,
+    # chosen per email. Empty keeps everything on DB_URL.
+    db_shard_urls: str = _setting("DB_SHARD_URLS", "", redact="url")
+    # Log every SQL statement through the sqlalchemy.engine logger
+    db_echo: bool = _setting("DB_ECHO", False)
+    # Database URL with an asyncio driver, used by signi_email_otp.aio
+    async_db_url: str = _setting(
+        "ASYNC_DB_URL",
+        "postgresql+asyncpg://otpuser:otppass@db:5432/otpdb",
+        redact="url",
+    )
+
+    # Expired OTP/JWT reaper
+    reaper_interval_seconds: int = _setting("REAPER_INTERVAL_SECONDS", 60, minimum=0)
+    reaper_batch_size: int = _setting("REAPER_BATCH_SIZE", 1000, minimum=1)
+
+    # signi-otp-server, see server.py: worker processes (0 for one per CPU),
+    # connections all workers together may hold to each database (0 leaves
+    # every worker MAX_CONN plus overflow), and slots of the rate limit and
+    # lockout tables the workers share
+    server_workers: int = _setting("SERVER_WORKERS", 0, minimum=0)
+    server_db_connections: int = _setting("SERVER_DB_CONNECTIONS", 0, minimum=0)
+    server_shared_slots: int = _setting("SERVER_SHARED_SLOTS", 65536, minimum=1)
+
+    # Metrics sink: "none" or "memory" (in-process registry, see metrics.py)
+    metrics: str = _setting("METRICS", "none", case="lower")
+
+    # Logging configuration
+    log_level: str = _setting("LOG_LEVEL", "INFO", reloadable=True, case="upper")
+    log_file: str = _setting("LOG_FILE", "signi_email_otp.log")
+    # "text" or "json" (one object per line)
+    log_format: str = _setting("LOG_FORMAT", "text", case="lower")
+    # Hand records to a background thread so callers never block on log I/O
+    log_queue: bool = _setting("LOG_QUEUE", False)
+
+    def __post_init__(self):
+        if not self.rate_limit_redis_url:
+            object.__setattr__(self, "rate_limit_redis_url", self.otp_store_redis_url)
+        if not self.otp_hash_secret:
+            object.__setattr__(self, "otp_hash_secret", self.jwt_secret)
+
+    def redacted(self) -> dict[str, object]:
+        """Values by environment variable name, with secrets hidden."""
+        values = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if value and f.metadata["redact"] == "secret":
+                value = "***"
+            elif value and f.metadata["redact"] == "url":
+                value = re.sub(r"(://[^:/@]*:)[^@]*@", r"\1***@", value)
+            elif isinstance(value, Limit):
+                value = str(value)
+            values[f.metadata["env"]] = value
+        return values
+
+    def __repr__(self):
+        return f"Settings({self.redacted()})"
+
+
+def _parse(f, value: str):
+    if f.metadata["parser"] is not None:
+        return f.metadata["parser"](value)
+    if f.type is bool:
+        return value.strip().lower() in _TRUE
+    if f.type is int:
+        return int(value)
+    if f.type is float:
+        return float(value)
+    if f.metadata["case"] == "lower":
+        return value.lower()
+    if f.metadata["case"] == "upper":
+        return value.upper()
+    return value
+
+
+def read_config_file(path: str) -> dict[str, str]:
+    """Read KEY=VALUE lines, skipping blank lines and # comments."""
+    values = {}
+    with open(path) as config_file:
+        for number, line in enumerate(config_file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            key, sep, value = line.partition("=")
+            if not sep:
+                raise ValueError(f"{path}:{number}: expected KEY=VALUE")
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+                value = value[1:-1]
+            values[key.strip()] = value
+    return values
+
+
+def load_settings(environ=None, config_file: str | None = None) -> Settings:
+    """
+    Parse and validate settings from environ (default os.environ), over
+    those in config_file (default: SIGNI_OTP_CONFIG_FILE, if set). Raises
+    ValueError naming every invalid setting.
+    """
+    environ = os.environ if environ is None else environ
+    config_file = config_file or environ.get("SIGNI_OTP_CONFIG_FILE")
+    sources = {**read_config_file(config_file), **environ} if config_file else environ
+
+    values, errors = {}, []
+    for f in fields(Settings):
+        env = f.metadata["env"]
+        if env not in sources:
+            continue
+        try:
+            value = _parse(f, sources[env])
+        except ValueError as e:
+            message = str(e)
+            if f.metadata["parser"] is None:
+                message = f"{sources[env]!r} is not a valid {f.type.__name__}"
+            errors.append(f"{env}: {message}")
+            continue
+        minimum = f.metadata["minimum"]
+        if minimum is not None and value < minimum:
+            errors.append(f"{env} must be at least {minimum}, got {value}")
+            continue
+        values[f.name] = value
+    if errors:
+        raise ValueError("Invalid settings: " + "; ".join(errors))
+    return Settings(**values)
+
+
+def reloadable_settings() -> list[str]:
+    return [f.metadata["env"] for f in fields(Settings) if f.metadata["reloadable"]]
+
+
+_settings = load_settings()
+_settings_lock = threading.Lock()
+_reload_listeners: list[Callable[[Settings, Settings], None]] = []
+
+
+def get_settings() -> Settings:
+    """The current settings, a cheap read meant for the hot path."""
+    return _settings
+
+
+def set_settings(settings: Settings | None):
+    """Replace the settings without notifying listeners, None reloads them."""
+    global _settings
+    with _settings_lock:
+        _settings = settings if settings is not None else load_settings()
+
+
+def on_reload(listener: Callable[[Settings, Settings], None]):
+    """Call listener(old, new) after reload_settings changes a setting."""
+    _reload_listeners.append(listener)
+
+
+def reload_settings(environ=None, config_file: str | None = None) -> Settings:
+    """
+    Read the settings again and apply the reloadable ones that changed.
+    Other changes are logged and ignored until a restart. Invalid settings
+    raise ValueError and leave the current ones in place.
+    """
+    global _settings
+    loaded = load_settings(environ, config_file)
+    with _settings_lock:
+        old = _settings
+        changed = [
+            f
+            for f in fields(Settings)
+            if getattr(loaded, f.name) != getattr(old, f.name)
+        ]
+        applied = [f for f in changed if f.metadata["reloadable"]]
+        _settings = replace(old, **{f.name: getattr(loaded, f.name) for f in applied})
+        new = _settings
+    ignored = [f.metadata["env"] for f in changed if not f.metadata["reloadable"]]
+    if ignored:
+        logger.warning("Settings %s only take effect after a restart", ignored)
+    if applied:
+        shown = new.redacted()
+        logger.info(
+            "Reloaded settings %s",
+            {f.metadata["env"]: shown[f.metadata["env"]] for f in applied},
+        )
+        for listener in list(_reload_listeners):
+            try:
+                listener(old, new)
+            except Exception as e:
+                logger.error("Settings reload listener %r failed: %s", listener, e)
+    return new
+
+
+def install_reload_handler(signum: int | None = None):
+    """
+    Reload settings when the process receives signum, SIGHUP by default.
+    The reload runs on a short lived thread, not in the signal handler.
+    Must be called from the main thread.
+    """
+    signum = signal.SIGHUP if signum is None else signum
+
+    def reload_in_background():
+        try:
+            reload_settings()
+        except ValueError as e:
+            logger.error("Settings not reloaded: %s", e)
 
-# JWT token expiration in seconds (default 7 days)
-JWT_EXPIRY_SECONDS = get_env("JWT_EXPIRY_SECONDS", 604700)
-# JWT secret key
-JWT_SECRET = get_env("JWT_SECRET", "changeme")
-JWT_ALGORITHM = get_env("JWT_ALGORITHM", "changeme")
+    def handler(signum, frame):
+        threading.Thread(
+            target=reload_in_background, name="signi-email-otp-reload", daemon=True
+        ).start()
 
+    return signal.signal(signum, handler)
 
-# Email sending (for mock SMTP, etc.)
-SMTP_HOST = get_env("SMTP_HOST", "localhost")
-SMTP_PORT = get_env("SMTP_PORT", 25)
-SMTP_FROM_EMAIL = get_env("SMTP_FROM_EMAIL", "test@test.com")
-SMTP_FROM_PASSWORD = get_env("SMTP_PASSWORD", "changeme")
 
-# Database configuration
-DB_URL = get_env("DB_URL", "postgresql+psycopg2://otpuser:otppass@db:5432/otpdb")
-MAX_CONN = int(get_env("DB_POOL_MAX_CONN", 5))
+def log_settings(settings: Settings | None = None):
+    """Log the settings in use, with secrets hidden."""
+    logger.info("Settings: %s", (settings or _settings).redacted())
 
 
-# Logging configuration
-LOG_LEVEL = get_env("LOG_LEVEL", "INFO").upper()
-LOG_FILE = get_env("LOG_FILE", "signi_email_otp.log")
+# Values at import, for settings that take effect on restart.
+OTP_EXPIRY_SECONDS = _settings.otp_expiry_seconds
+OTP_LENGTH = _settings.otp_length
+OTP_ALPHABET = _settings.otp_alphabet
+OTP_STORE = _settings.otp_store
+OTP_STORE_REDIS_URL = _settings.otp_store_redis_url
+OTP_STORE_STRIPES = _settings.otp_store_stripes
+OTP_HASH_SECRET = _settings.otp_hash_secret
+OTP_VERIFY_ATTEMPTS = _settings.otp_verify_attempts
+OTP_LOCKOUT_CACHE_SIZE = _settings.otp_lockout_cache_size
+OTP_RESEND_WINDOW_SECONDS = _settings.otp_resend_window_seconds
+OTP_RESEND_CACHE_SIZE = _settings.otp_resend_cache_size
+VERIFY_PATH = _settings.verify_path
+RATE_LIMIT = _settings.rate_limit
+RATE_LIMIT_REDIS_URL = _settings.rate_limit_redis_url
+RATE_LIMIT_IP = _settings.rate_limit_ip
+RATE_LIMIT_DOMAIN = _settings.rate_limit_domain
+RATE_LIMIT_EMAIL = _settings.rate_limit_email
+RATE_LIMIT_MAX_KEYS = _settings.rate_limit_max_keys
+OTP_BATCH_CHUNK_SIZE = _settings.otp_batch_chunk_size
+JWT_EXPIRY_SECONDS = _settings.jwt_expiry_seconds
+JWT_RENEW_BEFORE_SECONDS = _settings.jwt_renew_before_seconds
+JWT_ROTATION_HISTORY = _settings.jwt_rotation_history
+JWT_ROTATION_GRACE_SECONDS = _settings.jwt_rotation_grace_seconds
+JWT_SECRET = _settings.jwt_secret
+JWT_ALGORITHM = _settings.jwt_algorithm
+JWT_KEYS = _settings.jwt_keys
+JWT_ACTIVE_KID = _settings.jwt_active_kid
+JWT_CACHE_SIZE = _settings.jwt_cache_size
+JWT_CACHE_TTL_SECONDS = _settings.jwt_cache_ttl_seconds
+SMTP_HOST = _settings.smtp_host
+SMTP_PORT = _settings.smtp_port
+SMTP_FROM_EMAIL = _settings.smtp_from_email
+SMTP_FROM_PASSWORD = _settings.smtp_from_password
+SMTP_USE_SSL = _settings.smtp_use_ssl
+SMTP_TIMEOUT = _settings.smtp_timeout
+SMTP_POOL_SIZE = _settings.smtp_pool_size
+SMTP_POOL_MAX_MESSAGES = _settings.smtp_pool_max_messages
+OTP_EMAIL_SUBJECT = _settings.otp_email_subject
+OTP_EMAIL_BODY = _settings.otp_email_body
+EMAIL_QUEUE = _settings.email_queue
+EMAIL_QUEUE_MAXSIZE = _settings.email_queue_maxsize
+EMAIL_QUEUE_PUT_TIMEOUT = _settings.email_queue_put_timeout
+EMAIL_WORKERS = _settings.email_workers
+EMAIL_BATCH_SIZE = _settings.email_batch_size
+EMAIL_MAX_ATTEMPTS = _settings.email_max_attempts
+EMAIL_RETRY_BACKOFF_SECONDS = _settings.email_retry_backoff_seconds
+DB_URL = _settings.db_url
+MAX_CONN = _settings.max_conn
+DB_POOL_MAX_OVERFLOW = _settings.db_pool_max_overflow
+DB_POOL_TIMEOUT = _settings.db_pool_timeout
+DB_POOL_RECYCLE = _settings.db_pool_recycle
+DB_POOL_PRE_PING = _settings.db_pool_pre_ping
+DB_POOL_USE_LIFO = _settings.db_pool_use_lifo
+DB_POOL_WARMUP = _settings.db_pool_warmup
+DB_AUTO_MIGRATE = _settings.db_auto_migrate
+DB_REPLICA_URL = _settings.db_replica_url
+DB_SHARD_URLS = _settings.db_shard_urls
+DB_ECHO = _settings.db_echo
+ASYNC_DB_URL = _settings.async_db_url
+REAPER_INTERVAL_SECONDS = _settings.reaper_interval_seconds
+REAPER_BATCH_SIZE = _settings.reaper_batch_size
+SERVER_WORKERS = _settings.server_workers
+SERVER_DB_CONNECTIONS = _settings.server_db_connections
+SERVER_SHARED_SLOTS = _settings.server_shared_slots
+METRICS = _settings.metrics
+LOG_LEVEL = _settings.log_level
+LOG_FILE = _settings.log_file
+LOG_FORMAT = _settings.log_format
+LOG_QUEUE = _settings.log_queue
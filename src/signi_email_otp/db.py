@@ -1,28 +1,62 @@
+import os
+import threading
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from functools import partial
+from sqlalchemy import Connection, create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from typing import Callable, ContextManager, Generator
 
-from .config import DB_URL, MAX_CONN
+from .config import (
+    DB_ECHO,
+    DB_URL,
+    DB_REPLICA_URL,
+    DB_SHARD_URLS,
+    MAX_CONN,
+    DB_POOL_WARMUP,
+    DB_AUTO_MIGRATE,
+    get_settings,
+    on_reload,
+)
+from . import metrics
 from .core import logger
-from .models import Base
+from .migrations import HEAD_VERSION, current_version, upgrade
+from .sharding import parse_shard_urls, shard_for
 
 _SessionLocal = None
+_ReadSessionLocal = None
+_ShardSessionLocals: dict[str, sessionmaker] | None = None
+_init_lock = threading.Lock()
+# Connections each pool may hold, see set_pool_budget.
+_pool_budget: int | None = None
 
 
-def _get_engine():
-    """Get the SQLAlchemy engine."""
-    logger.info(
-        f"Creating database engine with URL: {DB_URL} and max connections: {MAX_CONN}"
-    )
-    return create_engine(
-        DB_URL,
-        echo=True,
-        pool_size=MAX_CONN,
-        max_overflow=5,
-        pool_timeout=30,
-        pool_recycle=1800,
-    )
+def pool_options(settings=None) -> dict:
+    """
+    Connection pool arguments for create_engine, from the DB_POOL_* settings
+    or the budget given to set_pool_budget.
+    """
+    settings = settings or get_settings()
+    return {
+        "pool_size": _pool_budget or settings.max_conn,
+        "max_overflow": 0 if _pool_budget else settings.db_pool_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_use_lifo": settings.db_pool_use_lifo,
+    }
+
+
+def _get_engine(url: str | None = None, pool_name: str = "primary"):
+    """Get the SQLAlchemy engine, for DB_URL unless url is given."""
+    options = pool_options()
+    engine = create_engine(url or DB_URL, echo=DB_ECHO, **options)
+    # engine.url renders without the password.
+    logger.info("Created %s database engine with URL: %s", pool_name, engine.url)
+    logger.info("Database pool settings: %s", options)
+    metrics.instrument_engine(engine)
+    metrics.instrument_pool(engine, pool_name)
+    return engine
 
 
 def _get_session_factory(engine=None):
@@ -30,26 +64,197 @@ def _get_session_factory(engine=None):
     return sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-def _initialize_db():
-    """Initialize the database connection."""
-    engine = _get_engine()
+def initialize_schema(bind, migrate: bool = True):
+    """
+    Bring the schema up to date, or with migrate=False only warn when it
+    is behind. bind is an Engine or Connection.
+    """
+    version: int | None
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database tables created successfully.")
+        if migrate:
+            version = upgrade(bind)
+        else:
+            version = current_version(bind)
+            if version != HEAD_VERSION:
+                logger.warning(
+                    "Database schema is at version %s, expected %s. "
+                    "Run signi-otp-migrate upgrade.",
+                    version,
+                    HEAD_VERSION,
+                )
+        logger.info("Database schema is at version %s.", version)
     except Exception as e:
-        logger.error(f"Failed to initialize database connection: {e}")
+        logger.error("Failed to initialize database connection: %s", e)
         raise
 
 
-@contextmanager
-def get_db() -> Generator[Session, None, None]:
+def init(
+    migrate: bool = DB_AUTO_MIGRATE, warmup_connections: int = DB_POOL_WARMUP
+) -> sessionmaker:
+    """
+    Create the engine and session factory, unless already done, e.g. at
+    application startup instead of on the first get_db. Safe to call from
+    several threads, one engine is created. With migrate the schema is
+    upgraded, otherwise it is left to `signi-otp-migrate upgrade`. Returns
+    the primary's session factory.
+    """
     global _SessionLocal
-    if _SessionLocal is None:
-        _SessionLocal = _get_session_factory(_get_engine())
-        _initialize_db()
+    factory = _SessionLocal
+    if factory is None:
+        with _init_lock:
+            factory = _SessionLocal
+            if factory is None:
+                engine = _get_engine()
+                initialize_schema(engine, migrate)
+                factory = _SessionLocal = _get_session_factory(engine)
+    if warmup_connections:
+        warmup(warmup_connections)
+    return factory
+
+
+def _get_primary_session_factory() -> sessionmaker:
+    return _SessionLocal or init(warmup_connections=0)
+
+
+def _get_read_session_factory():
+    global _ReadSessionLocal
+    if _ReadSessionLocal is None:
+        with _init_lock:
+            if _ReadSessionLocal is None:
+                _ReadSessionLocal = _get_session_factory(
+                    _get_engine(DB_REPLICA_URL, "replica")
+                )
+    return _ReadSessionLocal
+
+
+def is_sharded() -> bool:
+    return bool(DB_SHARD_URLS)
+
+
+def _get_shard_session_factories() -> dict[str, sessionmaker]:
+    """Session factories for the DB_SHARD_URLS shards, by shard name."""
+    global _ShardSessionLocals
+    if _ShardSessionLocals is None:
+        with _init_lock:
+            if _ShardSessionLocals is None:
+                factories = {}
+                for name, url in parse_shard_urls(DB_SHARD_URLS).items():
+                    engine = _get_engine(url, f"shard:{name}")
+                    initialize_schema(engine, DB_AUTO_MIGRATE)
+                    factories[name] = _get_session_factory(engine)
+                _ShardSessionLocals = factories
+    return _ShardSessionLocals
+
+
+def shard_names() -> list[str]:
+    """Names of the configured shards, empty unless sharding is on."""
+    if not is_sharded():
+        return []
+    return list(_get_shard_session_factories())
+
+
+def shard_of(email: str) -> str | None:
+    """Name of the shard holding email's rows, None unless sharding is on."""
+    if not is_sharded():
+        return None
+    return shard_for(email, _get_shard_session_factories())
+
+
+def warmup(connections: int = MAX_CONN):
+    """
+    Open up to connections pool connections, on the primary and on the
+    replica if there is one, so early requests do not pay for connecting.
+    """
+    factories = [init(warmup_connections=0)]
+    if has_read_replica():
+        factories.append(_get_read_session_factory())
+    if is_sharded():
+        factories.extend(_get_shard_session_factories().values())
+    for factory in factories:
+        engine = factory.kw["bind"]
+        held = []
+        try:
+            for _ in range(connections):
+                held.append(engine.connect())
+        finally:
+            for conn in held:
+                conn.close()
+        logger.info("Opened %s connections to %s", len(held), engine.url)
+
+
+def _rebuild_pools(old, new):
+    """
+    Move the engines to pools built with new settings when a DB_POOL_*
+    setting was reloaded. Idle connections of the old pools are closed,
+    sessions already open finish on the connection they hold.
+    """
+    if pool_options(old) != pool_options(new):
+        _rebuild_engines()
+
+
+def _rebuild_engines():
+    with _init_lock:
+        factories = {
+            "primary": _SessionLocal,
+            "replica": _ReadSessionLocal,
+            **{f"shard:{n}": f for n, f in (_ShardSessionLocals or {}).items()},
+        }
+        for pool_name, factory in factories.items():
+            if factory is None:
+                continue
+            old_engine = factory.kw["bind"]
+            factory.configure(bind=_get_engine(old_engine.url, pool_name))
+            old_engine.dispose()
+
+
+on_reload(_rebuild_pools)
+
+
+def set_pool_budget(connections: int | None):
+    """
+    Cap every pool at connections with no overflow, in place of
+    DB_POOL_MAX_CONN and DB_POOL_MAX_OVERFLOW, e.g. for a server worker's
+    share of SERVER_DB_CONNECTIONS. Engines already created are rebuilt.
+    None goes back to the settings.
+    """
+    global _pool_budget
+    _pool_budget = connections
+    _rebuild_engines()
+
+
+def _reset_after_fork():
+    """
+    Give a forked child, e.g. a pre-fork server worker, its own pools. The
+    inherited connections belong to the parent and are left open for it.
+    """
+    global _init_lock
+    _init_lock = threading.Lock()
+    shards = list((_ShardSessionLocals or {}).values())
+    for factory in (_SessionLocal, _ReadSessionLocal, *shards):
+        if factory is not None:
+            factory.kw["bind"].dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _connect(session: Session, pool_name: str):
+    """Check out the session's connection up front to time the pool wait."""
+    try:
+        with metrics.timer("db_connection_wait_seconds", pool=pool_name):
+            session.connection()
+    except PoolTimeoutError:
+        metrics.increment("db_pool_timeouts_total", pool=pool_name)
+        raise
+
 
-    session = _SessionLocal()
+@contextmanager
+def _session_scope(factory, pool_name: str) -> Generator[Session, None, None]:
+    session = factory()
     try:
+        if metrics.enabled():
+            _connect(session, pool_name)
         yield session
         session.commit()  # commit by default
     except Exception:
@@ -57,3 +262,88 @@ def get_db() -> Generator[Session, None, None]:
         raise
     finally:
         session.close()
+
+
+@contextmanager
+def get_db(email: str | None = None) -> Generator[Session, None, None]:
+    """
+    Session on the primary database. With DB_SHARD_URLS set and an email
+    given, the session is on the shard holding that email's OTP and refresh
+    token instead; the other tables always stay on the primary.
+    """
+    name = None if email is None else shard_of(email)
+    if name is not None:
+        with get_shard_db(name) as session:
+            yield session
+        return
+
+    with _session_scope(_get_primary_session_factory(), "primary") as session:
+        yield session
+
+
+@contextmanager
+def get_shard_db(name: str) -> Generator[Session, None, None]:
+    """Session on the named shard, e.g. to sweep every shard in turn."""
+    factory = _get_shard_session_factories()[name]
+    with _session_scope(factory, f"shard:{name}") as session:
+        yield session
+
+
+def _engine_for(email: str | None):
+    """The engine get_db(email) binds to, and its pool name for metrics."""
+    name = None if email is None else shard_of(email)
+    if name is not None:
+        return _get_shard_session_factories()[name].kw["bind"], f"shard:{name}"
+    return _get_primary_session_factory().kw["bind"], "primary"
+
+
+@contextmanager
+def get_connection(email: str | None = None) -> Generator[Connection, None, None]:
+    """
+    Core connection in a transaction, on the database get_db(email) would
+    use, for statements that need no ORM session. Commits on success.
+    """
+    engine, pool_name = _engine_for(email)
+    try:
+        with metrics.timer("db_connection_wait_seconds", pool=pool_name):
+            conn = engine.connect()
+    except PoolTimeoutError:
+        metrics.increment("db_pool_timeouts_total", pool=pool_name)
+        raise
+    with conn, conn.begin():
+        yield conn
+
+
+def get_dbs() -> list[Callable[[], ContextManager[Session]]]:
+    """
+    A session factory per shard, or just get_db without sharding, for
+    statements that touch the otp or refresh_tokens rows of every email.
+    """
+    return [partial(get_shard_db, name) for name in shard_names()] or [get_db]
+
+
+def has_read_replica() -> bool:
+    return bool(DB_REPLICA_URL)
+
+
+@contextmanager
+def get_read_db() -> Generator[Session, None, None]:
+    """
+    Session for read-only lookups, bound to DB_REPLICA_URL when set and to
+    the primary otherwise. The replica may lag behind the primary, callers
+    must treat a missing or stale row as "check the primary". Nothing is
+    committed.
+    """
+    if not has_read_replica():
+        with get_db() as session:
+            yield session
+        return
+
+    session = _get_read_session_factory()()
+    try:
+        if metrics.enabled():
+            _connect(session, "replica")
+        yield session
+    finally:
+        session.rollback()
+        session.close()
@@ -0,0 +1,514 @@
+import heapq
+import itertools
+import os
+import smtplib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone, timedelta
+from email.mime.text import MIMEText
+
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, update
+
+from .config import (
+    EMAIL_QUEUE,
+    EMAIL_QUEUE_MAXSIZE,
+    EMAIL_QUEUE_PUT_TIMEOUT,
+    EMAIL_WORKERS,
+    EMAIL_BATCH_SIZE,
+    EMAIL_MAX_ATTEMPTS,
+    EMAIL_RETRY_BACKOFF_SECONDS,
+    SMTP_HOST,
+    SMTP_PORT,
+    SMTP_FROM_EMAIL,
+    SMTP_FROM_PASSWORD,
+    SMTP_USE_SSL,
+)
+from .core import logger
+from .db import get_db
+from .exception import EmailQueueFullException
+from .models import EmailOutbox
+from .smtp_pool import SMTPConnectionPool, get_smtp_pool
+
+
+@dataclass
+class OutboundEmail:
+    email_to: str
+    subject: str
+    body: str
+    attempts: int = 0
+    # Row id in the durable queue
+    id: int | None = None
+
+    def as_string(self, email_from: str) -> str:
+        msg = MIMEText(self.body)
+        msg["Subject"] = self.subject
+        msg["From"] = email_from
+        msg["To"] = self.email_to
+        return msg.as_string()
+
+
+class EmailQueue(ABC):
+    """
+    Queue of emails waiting to be sent. Messages handed out by get_batch
+    must be passed back to exactly one of ack, retry or fail.
+    """
+
+    @abstractmethod
+    def put(self, message: OutboundEmail, timeout: float | None = None):
+        """
+        Add message, waiting up to timeout seconds for room.
+        Raises EmailQueueFullException when the queue stays full.
+        """
+
+    @abstractmethod
+    def get_batch(self, max_items: int, timeout: float) -> list[OutboundEmail]:
+        """Return up to max_items messages, waiting up to timeout for one."""
+
+    @abstractmethod
+    def ack(self, messages: list[OutboundEmail]):
+        """Remove delivered messages."""
+
+    @abstractmethod
+    def retry(self, message: OutboundEmail, delay: float):
+        """Make message available again after delay seconds."""
+
+    @abstractmethod
+    def fail(self, message: OutboundEmail):
+        """Give up on message."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of messages queued or waiting for a retry."""
+
+
+class MemoryEmailQueue(EmailQueue):
+    """
+    Bounded in-process queue, messages are lost on restart. A maxsize of 0
+    leaves it unbounded.
+    """
+
+    def __init__(self, maxsize: int = EMAIL_QUEUE_MAXSIZE, clock=time.monotonic):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._ready: deque[OutboundEmail] = deque()
+        self._delayed: list[tuple[float, int, OutboundEmail]] = []
+        self._in_flight = 0
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._ready) + len(self._delayed)
+
+    def _size(self):
+        return len(self._ready) + len(self._delayed) + self._in_flight
+
+    def put(self, message: OutboundEmail, timeout: float | None = None):
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self.maxsize <= 0 or self._size() < self.maxsize,
+                timeout=timeout,
+            ):
+                raise EmailQueueFullException()
+            self._ready.append(message)
+            self._cond.notify_all()
+
+    def _promote_due(self, now):
+        while self._delayed and self._delayed[0][0] <= now:
+            self._ready.append(heapq.heappop(self._delayed)[2])
+
+    def get_batch(self, max_items: int, timeout: float) -> list[OutboundEmail]:
+        deadline = self._clock() + timeout
+        with self._cond:
+            while True:
+                now = self._clock()
+                self._promote_due(now)
+                if self._ready or now >= deadline:
+                    break
+                wait = deadline - now
+                if self._delayed:
+                    wait = min(wait, self._delayed[0][0] - now)
+                self._cond.wait(wait)
+            batch: list[OutboundEmail] = []
+            while self._ready and len(batch) < max_items:
+                batch.append(self._ready.popleft())
+            self._in_flight += len(batch)
+            return batch
+
+    def _done(self, count):
+        with self._cond:
+            self._in_flight -= count
+            self._cond.notify_all()
+
+    def ack(self, messages: list[OutboundEmail]):
+        self._done(len(messages))
+
+    def retry(self, message: OutboundEmail, delay: float):
+        with self._cond:
+            self._in_flight -= 1
+            heapq.heappush(
+                self._delayed, (self._clock() + delay, next(self._sequence), message)
+            )
+            self._cond.notify_all()
+
+    def fail(self, message: OutboundEmail):
+        self._done(1)
+
+
+class DBEmailQueue(EmailQueue):
+    """
+    Durable queue in the email_outbox table, messages survive restarts.
+    Claimed messages that are neither acked nor retried within
+    visibility_timeout seconds, e.g. because the worker died, are handed
+    out again. A maxsize of 0 leaves it unbounded. The bound is checked by
+    the INSERT itself, so concurrent writers may overshoot it by at most
+    one message each.
+    """
+
+    def __init__(
+        self,
+        get_db_func=None,
+        maxsize: int = EMAIL_QUEUE_MAXSIZE,
+        poll_interval: float = 0.5,
+        visibility_timeout: float = 300,
+    ):
+        self._get_db = get_db_func
+        self.maxsize = maxsize
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+
+    def session(self):
+        return (self._get_db or get_db)()
+
+    def __len__(self):
+        with self.session() as session:
+            return session.scalar(
+                select(func.count())
+                .select_from(EmailOutbox)
+                .where(EmailOutbox.status != "failed")
+            )
+
+    def put(self, message: OutboundEmail, timeout: float | None = None):
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            with self.session() as session:
+                message.id = self._insert(session, message)
+            if message.id is not None:
+                return
+            if time.monotonic() >= deadline:
+                raise EmailQueueFullException()
+            time.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+
+    def _insert(self, session, message: OutboundEmail) -> int | None:
+        """
+        Insert message in one statement if the queue has room, counting at
+        most maxsize rows. Returns the row id, or None when the queue is full.
+        """
+        now = datetime.now(timezone.utc)
+        values = {
+            "email_to": message.email_to,
+            "subject": message.subject,
+            "body": message.body,
+            "attempts": message.attempts,
+            "status": "pending",
+            "not_before": now,
+            "created_at": now,
+        }
+        if self.maxsize <= 0 or not session.get_bind().dialect.insert_returning:
+            if self.maxsize > 0 and self._count(session) >= self.maxsize:
+                return None
+            row = EmailOutbox(**values)
+            session.add(row)
+            session.flush()
+            return row.id
+        row_values = select(
+            *(
+                literal(value, getattr(EmailOutbox, name).type)
+                for name, value in values.items()
+            )
+        ).where(self._count_statement().scalar_subquery() < self.maxsize)
+        return session.execute(
+            insert(EmailOutbox)
+            .from_select(list(values), row_values)
+            .returning(EmailOutbox.id)
+        ).scalar()
+
+    def _count_statement(self):
+        """Count the queued rows, stopping at maxsize."""
+        queued = (
+            select(EmailOutbox.id)
+            .where(EmailOutbox.status != "failed")
+            .limit(self.maxsize)
+            .subquery()
+        )
+        return select(func.count()).select_from(queued)
+
+    def _count(self, session) -> int:
+        return session.scalar(self._count_statement())
+
+    def _claim(self, max_items: int) -> list[OutboundEmail]:
+        now = datetime.now(timezone.utc)
+        stale = now - timedelta(seconds=self.visibility_timeout)
+        claimable = or_(
+            and_(EmailOutbox.status == "pending", EmailOutbox.not_before <= now),
+            and_(EmailOutbox.status == "sending", EmailOutbox.claimed_at < stale),
+        )
+        with self.session() as session:
+            rows = (
+                session.execute(
+                    select(EmailOutbox)
+                    .where(claimable)
+                    .order_by(EmailOutbox.id)
+                    .limit(max_items)
+                    .with_for_update(skip_locked=True)
+                )
+                .scalars()
+                .all()
+            )
+            for row in rows:
+                row.status = "sending"
+                row.claimed_at = now
+            return [
+                OutboundEmail(row.email_to, row.subject, row.body, row.attempts, row.id)
+                for row in rows
+            ]
+
+    def get_batch(self, max_items: int, timeout: float) -> list[OutboundEmail]:
+        deadline = time.monotonic() + timeout
+        while True:
+            batch = self._claim(max_items)
+            remaining = deadline - time.monotonic()
+            if batch or remaining <= 0:
+                return batch
+            time.sleep(min(self.poll_interval, remaining))
+
+    def ack(self, messages: list[OutboundEmail]):
+        with self.session() as session:
+            session.execute(
+                delete(EmailOutbox).where(
+                    EmailOutbox.id.in_([message.id for message in messages])
+                )
+            )
+
+    def _update(self, message: OutboundEmail, **values):
+        with self.session() as session:
+            session.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id == message.id)
+                .values(attempts=message.attempts, claimed_at=None, **values)
+            )
+
+    def retry(self, message: OutboundEmail, delay: float):
+        not_before = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        self._update(message, status="pending", not_before=not_before)
+
+    def fail(self, message: OutboundEmail):
+        self._update(message, status="failed")
+
+
+@dataclass
+class EmailWorkerStats:
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, name: str, count: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + count)
+
+
+def _is_transient(error: Exception) -> bool:
+    """4xx replies and dropped connections are worth retrying, 5xx are not."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return True
+
+
+class EmailWorkerPool:
+    """
+    Threads draining an EmailQueue. Each batch is sent over a single pooled
+    SMTP session, transient failures are retried with exponential backoff
+    up to max_attempts.
+    """
+
+    def __init__(
+        self,
+        queue: EmailQueue,
+        smtp_pool: SMTPConnectionPool | None = None,
+        email_from: str = SMTP_FROM_EMAIL,
+        workers: int = EMAIL_WORKERS,
+        batch_size: int = EMAIL_BATCH_SIZE,
+        max_attempts: int = EMAIL_MAX_ATTEMPTS,
+        backoff_seconds: float = EMAIL_RETRY_BACKOFF_SECONDS,
+        poll_interval: float = 0.5,
+    ):
+        self.queue = queue
+        self.smtp_pool = smtp_pool or get_smtp_pool(
+            SMTP_HOST, SMTP_PORT, SMTP_FROM_EMAIL, SMTP_FROM_PASSWORD, SMTP_USE_SSL
+        )
+        self.email_from = email_from
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.poll_interval = poll_interval
+        self.stats = EmailWorkerStats()
+        self._threads: list[threading.Thread] = []
+        self._stop_event = threading.Event()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"signi-email-otp-mailer-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None):
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                batch = self.queue.get_batch(self.batch_size, self.poll_interval)
+                if batch:
+                    self.deliver(batch)
+            except Exception as e:
+                logger.error("Email worker failed: %s", e)
+                self._stop_event.wait(self.poll_interval)
+
+    def deliver(self, batch: list[OutboundEmail]):
+        """Send batch, reusing one SMTP session for as many messages as it allows."""
+        pending = deque(batch)
+        sent: list[OutboundEmail] = []
+        try:
+            while pending:
+                with self.smtp_pool.connection() as conn:
+                    while pending and conn.messages_sent < self.smtp_pool.max_messages:
+                        message = pending[0]
+                        try:
+                            conn.smtp.sendmail(
+                                self.email_from,
+                                [message.email_to],
+                                message.as_string(self.email_from),
+                            )
+                            conn.messages_sent += 1
+                        except (
+                            smtplib.SMTPResponseException,
+                            smtplib.SMTPRecipientsRefused,
+                        ) as e:
+                            pending.popleft()
+                            self._delivery_failed(message, e)
+                            continue
+                        pending.popleft()
+                        sent.append(message)
+        except Exception as e:
+            # The session could not be opened or was dropped, retry the rest.
+            while pending:
+                self._delivery_failed(pending.popleft(), e)
+        finally:
+            if sent:
+                self.queue.ack(sent)
+                self.stats.add("sent", len(sent))
+
+    def _delivery_failed(self, message: OutboundEmail, error: Exception):
+        message.attempts += 1
+        if _is_transient(error) and message.attempts < self.max_attempts:
+            delay = self.backoff_seconds * 2 ** (message.attempts - 1)
+            logger.warning(
+                "Sending email to %s failed (%s), retrying in %.1fs",
+                message.email_to,
+                error,
+                delay,
+            )
+            self.queue.retry(message, delay)
+            self.stats.add("retried")
+        else:
+            logger.error(
+                "Giving up sending email to %s after %s attempts: %s",
+                message.email_to,
+                message.attempts,
+                error,
+            )
+            self.queue.fail(message)
+            self.stats.add("failed")
+
+
+_QUEUE_BACKENDS = {
+    "memory": MemoryEmailQueue,
+    "db": DBEmailQueue,
+}
+
+_queue: EmailQueue | None = None
+_workers: EmailWorkerPool | None = None
+_queue_lock = threading.Lock()
+
+
+def get_email_queue() -> EmailQueue:
+    """
+    Return the process wide email queue selected by EMAIL_QUEUE, starting
+    its worker pool on first use.
+    """
+    global _queue, _workers
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                try:
+                    queue = _QUEUE_BACKENDS[EMAIL_QUEUE.lower()]()
+                except KeyError:
+                    raise ValueError(
+                        f"Unknown email queue backend {EMAIL_QUEUE!r}, "
+                        f"expected one of {sorted(_QUEUE_BACKENDS)}"
+                    ) from None
+                _workers = EmailWorkerPool(queue)
+                _workers.start()
+                _queue = queue
+    return _queue
+
+
+def set_email_queue(queue: EmailQueue | None, workers: EmailWorkerPool | None = None):
+    """
+    Replace the process wide queue and its workers, stopping the current
+    workers. None reverts to the configured queue on next use.
+    """
+    global _queue, _workers
+    with _queue_lock:
+        if _workers is not None:
+            _workers.stop()
+        _queue, _workers = queue, workers
+
+
+def _reset_after_fork():
+    """
+    The worker threads do not survive a fork, and queued messages belong to
+    the parent. A forked child starts its own queue on next use.
+    """
+    global _queue, _workers, _queue_lock
+    _queue = None
+    _workers = None
+    _queue_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def enqueue_email(
+    email_to: str,
+    subject: str,
+    body: str,
+    timeout: float | None = EMAIL_QUEUE_PUT_TIMEOUT,
+) -> OutboundEmail:
+    """Queue an email for delivery and return immediately."""
+    message = OutboundEmail(email_to, subject, body)
+    get_email_queue().put(message, timeout=timeout)
+    return message
@@ -1,6 +1,7 @@
-import smtplib
 from email.mime.text import MIMEText
+from .config import SMTP_USE_SSL
 from .core import logger
+from .smtp_pool import get_smtp_pool
 
 
 def send_otp_email(
@@ -18,15 +19,17 @@ def send_otp_email(
     msg["To"] = email_to
 
     try:
-        with smtplib.SMTP_SSL(smtp_host, smtp_port) as server:
-            server.login(email_from, email_password)
-            server.sendmail(email_from, [email_to], msg.as_string())
-            logger.info(
-                (f"Email sent successfully to {email_to} " f"with subject '{subject}'")
-            )
-            return None
+        # Sessions are kept open and reused across calls, see smtp_pool.
+        pool = get_smtp_pool(
+            smtp_host, smtp_port, email_from, email_password, SMTP_USE_SSL
+        )
+        pool.send(email_from, [email_to], msg.as_string())
+        logger.info(
+            "Email sent successfully to %s with subject '%s'", email_to, subject
+        )
+        return None
     except Exception as e:
         logger.error(
-            f"Failed to send email to {email_to} with subject '{subject}': {e}"
+            "Failed to send email to %s with subject '%s': %s", email_to, subject, e
         )
         raise
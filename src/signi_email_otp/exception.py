@@ -30,3 +30,24 @@ class OTPNotFoundException(signiEmailOTPException):
 
     def __init__(self, message="OTP not found. Please request a new one."):
         super().__init__(message)
+
+
+class OTPAttemptsExceededException(signiEmailOTPException):
+    """Raised when too many wrong codes were tried for an OTP."""
+
+    def __init__(self, message="Too many failed attempts. Please try again later."):
+        super().__init__(message)
+
+
+class RefreshTokenRevokedException(signiEmailOTPException):
+    """Raised when a refresh token was revoked or replaced too long ago."""
+
+    def __init__(self, message="Refresh token is no longer valid. Please log in."):
+        super().__init__(message)
+
+
+class EmailQueueFullException(signiEmailOTPException):
+    """Raised when the outbound email queue is full."""
+
+    def __init__(self, message="Email queue is full. Please try again later."):
+        super().__init__(message)
@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, cast
+
+from sqlalchemy import Select, Table, bindparam, delete, select
+from sqlalchemy.sql.dml import ReturningDelete, ReturningInsert, ReturningUpdate
+
+from . import metrics
+from .config import get_settings
+from .core import logger
+from .db import get_connection
+from .exception import OTPAttemptsExceededException
+from .keys import get_key_manager
+from .models import JWT, OTP
+from .otp_store import (
+    _UPSERT_INSERTS,
+    OTPStore,
+    SQLOTPStore,
+    _attempts_exceeded,
+    locked_until,
+    verify_error,
+    verify_statement,
+)
+from .token_cache import token_cache
+from .tokens import push_digest, reusable
+
+VERIFY_PATHS = ("orm", "core")
+
+
+@dataclass(frozen=True)
+class VerifyStatements:
+    """The statements of the core verify path, built once per dialect."""
+
+    consume: ReturningDelete[Any]
+    attempt: ReturningUpdate[Any]
+    lookup: Select[Any]
+    store: ReturningInsert[Any]
+
+
+@lru_cache(maxsize=None)
+def verify_statements(dialect_name: str) -> VerifyStatements | None:
+    """
+    Build the core verify path statements with bound parameters, so every
+    call executes the same statement objects and reuses their compiled
+    form. None for dialects without INSERT ... ON CONFLICT.
+    """
+    insert = _UPSERT_INSERTS.get(dialect_name)
+    if insert is None:
+        return None
+    otp_table = cast(Table, OTP.__table__)
+    jwt_table = cast(Table, JWT.__table__)
+    consume = (
+        delete(otp_table)
+        .where(
+            otp_table.c.email == bindparam("email"),
+            otp_table.c.otp_hash == bindparam("otp_hash"),
+            otp_table.c.created_at > bindparam("issued_after"),
+            otp_table.c.verify_attempts_left > 0,
+        )
+        .returning(otp_table.c.id)
+    )
+    attempt = verify_statement(bindparam("attempt_email"), bindparam("attempt_hash"))
+    lookup = select(
+        jwt_table.c.refresh_token, jwt_table.c.expires_at, jwt_table.c.rotated_digests
+    ).where(jwt_table.c.email == bindparam("email"))
+    stmt = insert(jwt_table).values(
+        email=bindparam("new_email"),
+        refresh_token=bindparam("new_token"),
+        created_at=bindparam("new_created_at"),
+        expires_at=bindparam("new_expires_at"),
+        rotated_digests="",
+    )
+    # Only replace the token that was looked up, a concurrent login may
+    # have renewed it in between.
+    store = stmt.on_conflict_do_update(
+        index_elements=[jwt_table.c.email],
+        set_={
+            "refresh_token": stmt.excluded.refresh_token,
+            "created_at": stmt.excluded.created_at,
+            "expires_at": stmt.excluded.expires_at,
+            "rotated_digests": bindparam("history"),
+        },
+        where=jwt_table.c.refresh_token == bindparam("replaced"),
+    ).returning(jwt_table.c.refresh_token)
+    return VerifyStatements(consume, attempt, lookup, store)
+
+
+def enabled(store: OTPStore) -> bool:
+    """Whether VERIFY_PATH selects the core path and store can take it."""
+    path = get_settings().verify_path
+    if path not in VERIFY_PATHS:
+        raise ValueError(
+            f"Unknown VERIFY_PATH {path!r}, expected one of {', '.join(VERIFY_PATHS)}"
+        )
+    return path == "core" and isinstance(store, SQLOTPStore)
+
+
+def verify_otp(store: SQLOTPStore, email: str, otp: str) -> str | None:
+    """
+    Consume a matching OTP and return the refresh token for email on one
+    connection and in one transaction: a DELETE ... RETURNING of the OTP,
+    the token lookup and, only when the token is missing or due for
+    renewal, an upsert. An OTP that does not match, is expired or locked is
+    settled on the same connection with store's verify statement, which
+    takes the verify attempt, and the exception store.consume would raise
+    is raised once that has committed. Returns None, changing nothing, when
+    the database lacks DELETE or UPDATE ... RETURNING; the caller then goes through
+    store.consume. Refresh tokens are read from the primary, never from the
+    replica.
+    """
+    if store.lockouts.locked(email):
+        raise _attempts_exceeded(email)
+    otp_hash = store.hasher.hash(email, otp)
+    issued_after = datetime.now(timezone.utc) - timedelta(seconds=store.expiry_seconds)
+    with get_connection(email) as conn:
+        statements = verify_statements(conn.dialect.name)
+        dialect = conn.dialect
+        if statements is None or not (
+            dialect.delete_returning and dialect.update_returning
+        ):
+            return None
+        with metrics.timer("otp_verify_seconds"):
+            consumed = conn.execute(
+                statements.consume,
+                {"email": email, "otp_hash": otp_hash, "issued_after": issued_after},
+            ).first()
+            error = None
+            if consumed is None:
+                row = conn.execute(
+                    statements.attempt,
+                    {"attempt_email": email, "attempt_hash": otp_hash},
+                ).first()
+                error = verify_error(email, row, store.expiry_seconds)
+                if error is None:
+                    # A matching OTP issued after the DELETE, consume it like the store.
+                    conn.execute(delete(OTP).where(OTP.email == email))
+        if error is None:
+            with metrics.timer("jwt_lookup_seconds", pool="primary"):
+                return _login_token(conn, statements, email)
+    # Raised once the connection has committed the attempt taken.
+    if isinstance(error, OTPAttemptsExceededException):
+        store.lockouts.add(email, locked_until(row, store.expiry_seconds))
+    raise error
+
+
+def _login_token(conn, statements: VerifyStatements, email: str) -> str:
+    """The core equivalent of tokens.login_token."""
+    row = conn.execute(statements.lookup, {"email": email}).first()
+    if reusable(row):
+        logger.info("JWT already exists for %s, reusing it.", email)
+        return row.refresh_token
+
+    token, expires_at = get_key_manager().generate_jwt(
+        email, get_settings().jwt_expiry_seconds
+    )
+    now = datetime.now(timezone.utc)
+    stored = conn.execute(
+        statements.store,
+        {
+            "new_email": email,
+            "new_token": token,
+            "new_created_at": now,
+            "new_expires_at": expires_at,
+            "history": (
+                push_digest(row.rotated_digests, row.refresh_token, now) if row else ""
+            ),
+            "replaced": row.refresh_token if row else None,
+        },
+    ).first()
+    if stored is None:
+        logger.info("JWT for %s was renewed concurrently, reusing it.", email)
+        return conn.execute(statements.lookup, {"email": email}).first().refresh_token
+    if row is not None:
+        # Core statements skip the ORM events that keep token_cache current.
+        token_cache.invalidate(row.refresh_token)
+    logger.info("Stored new JWT for %s", email)
+    return token
@@ -1,16 +1,87 @@
 import jwt
+import secrets
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from jwt.algorithms import get_default_algorithms
+
+from . import metrics
+from .token_cache import TokenCache
+
+
+def supported_algorithms() -> list[str]:
+    """Algorithms PyJWT can use here, asymmetric ones need cryptography."""
+    return sorted(get_default_algorithms())
+
+
+def validate_algorithm(algorithm: str) -> str:
+    """Return algorithm, or raise ValueError if PyJWT cannot sign with it."""
+    if algorithm == "none" or algorithm not in get_default_algorithms():
+        raise ValueError(
+            f"Unsupported JWT algorithm {algorithm!r}, "
+            f"expected one of {[a for a in supported_algorithms() if a != 'none']}"
+        )
+    return algorithm
+
+
+@lru_cache(maxsize=64)
+def _prepare_key(key, algorithm: str):
+    return get_default_algorithms()[validate_algorithm(algorithm)].prepare_key(key)
+
+
+def prepare_key(key, algorithm: str):
+    """
+    Turn a secret or PEM encoded key into the object PyJWT signs and
+    verifies with, parsing each distinct key only once. Keys that are
+    already prepared are returned as they are.
+    """
+    try:
+        return _prepare_key(key, algorithm)
+    except TypeError:
+        # Unhashable key, e.g. a JWK dict, prepare it every time.
+        return get_default_algorithms()[validate_algorithm(algorithm)].prepare_key(key)
 
 
 def generate_jwt(
-    email: str, secret: str, algorithm: str, expiry_seconds: int
+    email: str, secret, algorithm: str, expiry_seconds: int, kid: str | None = None
 ) -> tuple[str, datetime]:
-    exp_timestamp = int(time.time()) + expiry_seconds
-    payload = {"email": email, "exp": exp_timestamp}
-    token = jwt.encode(payload, secret, algorithm=algorithm)
-    return token, datetime.fromtimestamp(exp_timestamp)
+    """
+    Sign a token for email expiring in expiry_seconds, returning it and its
+    expiry. secret is a shared secret, a private key or a prepared key. kid
+    is added to the header to identify the key, see keys.KeyManager. A
+    random jti claim makes every token distinct, even within one second.
+    """
+    exp_timestamp = int(time.time()) + int(expiry_seconds)
+    payload = {"email": email, "exp": exp_timestamp, "jti": secrets.token_hex(8)}
+    key = prepare_key(secret, algorithm)
+    with metrics.timer("jwt_sign_seconds", algorithm=algorithm):
+        token = jwt.encode(
+            payload,
+            key,
+            algorithm=algorithm,
+            headers={"kid": kid} if kid is not None else None,
+        )
+    return token, datetime.fromtimestamp(exp_timestamp, timezone.utc)
 
 
-def decode_jwt(token: str, secret: str, algorithm: str) -> dict:
-    return jwt.decode(token, secret, algorithms=[algorithm])
+def decode_jwt(
+    token: str, secret, algorithm: str, cache: TokenCache | None = None
+) -> dict:
+    """
+    Verify token and return its claims.
+    With a cache, such as token_cache.token_cache, claims of a previously
+    verified token are returned without checking the signature again.
+    """
+    if cache is not None:
+        cached = cache.get(token, secret, algorithm)
+        if cached is not None:
+            metrics.increment("jwt_cache_lookups_total", result="hit")
+            return cached
+        metrics.increment("jwt_cache_lookups_total", result="miss")
+    key = prepare_key(secret, algorithm)
+    with metrics.timer("jwt_verify_seconds", algorithm=algorithm):
+        claims = jwt.decode(token, key, algorithms=[algorithm])
+    if cache is not None:
+        cache.put(token, secret, algorithm, claims)
+    return claims
@@ -0,0 +1,181 @@
+import json
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Sequence
+
+import jwt
+
+from .config import JWT_SECRET, JWT_ALGORITHM, JWT_KEYS, JWT_ACTIVE_KID
+from .core import logger
+from .jwt_utils import decode_jwt, generate_jwt, prepare_key, validate_algorithm
+from .token_cache import TokenCache
+
+
+@dataclass(frozen=True)
+class JWTKey:
+    """A parsed key pair. For HMAC algorithms both keys are the secret."""
+
+    kid: str | None
+    algorithm: str
+    signing_key: object | None
+    verification_key: object
+
+
+def load_key(
+    kid: str | None,
+    algorithm: str,
+    key,
+    verification_key=None,
+) -> JWTKey:
+    """
+    Parse key, a shared secret or a PEM encoded private key, for algorithm.
+    For asymmetric algorithms the public key is derived from the private
+    one unless given. key may be None for a verification only key.
+    """
+    validate_algorithm(algorithm)
+    signing_key = prepare_key(key, algorithm) if key is not None else None
+    if verification_key is not None:
+        verification_key = prepare_key(verification_key, algorithm)
+    elif hasattr(signing_key, "public_key"):
+        verification_key = signing_key.public_key()
+    elif signing_key is not None:
+        verification_key = signing_key
+    else:
+        raise ValueError(f"JWT key {kid!r} has neither a signing nor a public key")
+    return JWTKey(kid, algorithm, signing_key, verification_key)
+
+
+class KeyManager:
+    """
+    Parsed signing and verification keys addressed by kid. Tokens are signed
+    with the active key and carry its kid in the header, and are verified
+    with the key their kid names, so keys can be rotated without downtime:
+    add the new key, make it active once every node has it, and remove the
+    old one after the tokens it signed have expired. A key with kid None
+    verifies tokens without a kid, such as those issued before rotation.
+    """
+
+    def __init__(self, keys: Sequence[JWTKey] = (), active_kid: str | None = None):
+        self._keys: dict[str | None, JWTKey] = {}
+        self._active: JWTKey | None = None
+        for key in keys:
+            self.add(key)
+        if keys:
+            self.activate(active_kid if active_kid is not None else keys[0].kid)
+
+    def add(self, key: JWTKey):
+        self._keys[key.kid] = key
+
+    def remove(self, kid: str | None):
+        if self._active is not None and self._active.kid == kid:
+            raise ValueError(f"Cannot remove the active JWT key {kid!r}")
+        self._keys.pop(kid, None)
+
+    def activate(self, kid: str | None):
+        key = self._keys.get(kid)
+        if key is None:
+            raise ValueError(f"Unknown JWT key id {kid!r}")
+        if key.signing_key is None:
+            raise ValueError(f"JWT key {kid!r} has no signing key")
+        self._active = key
+
+    def get(self, kid: str | None) -> JWTKey:
+        """
+        The key named kid. An unknown kid, e.g. of a removed key, raises
+        jwt.InvalidSignatureError, since no key can verify the token.
+        """
+        try:
+            return self._keys[kid]
+        except KeyError:
+            raise jwt.InvalidSignatureError(f"Unknown JWT key id {kid!r}") from None
+
+    @property
+    def active(self) -> JWTKey:
+        if self._active is None:
+            raise ValueError("No active JWT key")
+        return self._active
+
+    @property
+    def kids(self) -> list[str | None]:
+        return list(self._keys)
+
+    def generate_jwt(self, email: str, expiry_seconds: int) -> tuple[str, datetime]:
+        """Sign a token for email with the active key."""
+        key = self.active
+        return generate_jwt(
+            email, key.signing_key, key.algorithm, expiry_seconds, kid=key.kid
+        )
+
+    def decode_jwt(self, token: str, cache: TokenCache | None = None) -> dict:
+        """Verify token with the key named by its kid and return its claims."""
+        if len(self._keys) == 1:
+            # The signature check rejects tokens signed with any other key,
+            # the header is only read to report an unknown kid as such.
+            (key,) = self._keys.values()
+            try:
+                return decode_jwt(token, key.verification_key, key.algorithm, cache)
+            except jwt.InvalidTokenError:
+                self.get(jwt.get_unverified_header(token).get("kid"))
+                raise
+        key = self.get(jwt.get_unverified_header(token).get("kid"))
+        return decode_jwt(token, key.verification_key, key.algorithm, cache)
+
+
+def _read(entry: dict, name: str):
+    if entry.get(f"{name}_file"):
+        with open(entry[f"{name}_file"]) as f:
+            return f.read()
+    return entry.get(name)
+
+
+def load_key_manager(
+    keys_json: str = JWT_KEYS,
+    active_kid: str = JWT_ACTIVE_KID,
+    secret: str = JWT_SECRET,
+    algorithm: str = JWT_ALGORITHM,
+) -> KeyManager:
+    """
+    Build a KeyManager from settings. keys_json is a JSON list of objects
+    with kid, algorithm and either key/key_file (secret or private key) or
+    public_key/public_key_file. Without it, secret and algorithm form the
+    only key, with no kid. Raises ValueError for an unsupported algorithm.
+    """
+    if not keys_json:
+        return KeyManager([load_key(None, algorithm, secret)])
+    keys = [
+        load_key(
+            entry.get("kid"),
+            entry.get("algorithm", algorithm),
+            _read(entry, "key"),
+            _read(entry, "public_key"),
+        )
+        for entry in json.loads(keys_json)
+    ]
+    manager = KeyManager(keys, active_kid or None)
+    logger.info("Loaded JWT keys %s, signing with %s", manager.kids, manager.active.kid)
+    return manager
+
+
+_manager: KeyManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_key_manager() -> KeyManager:
+    """
+    Return the process wide KeyManager, loading it from settings on first
+    use. Call it at startup to fail fast on a bad key or algorithm.
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = load_key_manager()
+    return _manager
+
+
+def set_key_manager(manager: KeyManager | None):
+    """Replace the process wide KeyManager, None reloads it from settings."""
+    global _manager
+    with _manager_lock:
+        _manager = manager
@@ -0,0 +1,104 @@
+import atexit
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+from .config import LOG_LEVEL, LOG_FILE, LOG_FORMAT, LOG_QUEUE, log_settings, on_reload
+from .core import logger
+
+_TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+# LogRecord attributes that are not user supplied extra fields
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_handlers: list[logging.Handler] = []
+_listener: QueueListener | None = None
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line. Fields passed with
+    extra={...} are included alongside the standard ones.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _build_formatter(fmt: str) -> logging.Formatter:
+    if fmt == "json":
+        return JSONFormatter()
+    if fmt == "text":
+        return logging.Formatter(_TEXT_FORMAT)
+    raise ValueError(f"Unknown log format: {fmt}")
+
+
+def configure_logging(
+    level: str | int = LOG_LEVEL,
+    log_file: str | None = LOG_FILE,
+    fmt: str = LOG_FORMAT,
+    use_queue: bool = LOG_QUEUE,
+) -> logging.Logger:
+    """
+    Apply LOG_LEVEL, LOG_FILE and LOG_FORMAT to the package logger.
+    Records go to stderr and, if log_file is set, to that file. With
+    use_queue the handlers run on a listener thread, and logging calls
+    only enqueue the record. Calling this again replaces the previous
+    configuration. The settings in use are logged once, secrets hidden.
+    """
+    reset_logging()
+    formatter = _build_formatter(fmt)
+    handlers: list[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    global _listener
+    if use_queue:
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        _listener = QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+        _handlers.extend(handlers)
+        handlers = [QueueHandler(records)]
+
+    logger.setLevel(level)
+    for handler in handlers:
+        logger.addHandler(handler)
+    _handlers.extend(handlers)
+    log_settings()
+    return logger
+
+
+def _apply_log_level(old, new):
+    if old.log_level != new.log_level:
+        logger.setLevel(new.log_level)
+
+
+on_reload(_apply_log_level)
+
+
+def reset_logging():
+    """Flush and remove the handlers added by configure_logging."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    while _handlers:
+        handler = _handlers.pop()
+        logger.removeHandler(handler)
+        handler.close()
+
+
+atexit.register(reset_logging)
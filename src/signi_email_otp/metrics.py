@@ -0,0 +1,347 @@
+import re
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+from .config import METRICS
+
+# Upper bounds, in seconds, of the histogram buckets used by MetricsRegistry
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class MetricsSink(ABC):
+    """
+    Destination for counters and timings. Names are passed without the
+    exported prefix, labels as a tuple of (name, value) pairs.
+    """
+
+    enabled = True
+
+    @abstractmethod
+    def increment(self, name: str, value: float, labels: tuple):
+        """Add value to the counter name."""
+
+    @abstractmethod
+    def observe(self, name: str, value: float, labels: tuple):
+        """Record one value, e.g. a duration in seconds, for name."""
+
+    def gauge(self, name: str, value: float, labels: tuple):
+        """Set the current value of name, ignored unless overridden."""
+
+
+class NullSink(MetricsSink):
+    """Discards everything, the default."""
+
+    enabled = False
+
+    def increment(self, name, value, labels):
+        pass
+
+    def observe(self, name, value, labels):
+        pass
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry(MetricsSink):
+    """
+    Thread-safe in-process counters, gauges and histograms, exported in the
+    Prometheus text format by render_prometheus.
+    """
+
+    def __init__(self, prefix: str = "signi_otp_", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._counters: dict[tuple, float] = {}
+        self._gauges: dict[tuple, float] = {}
+        self._histograms: dict[tuple, _Histogram] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value, labels):
+        with self._lock:
+            self._gauges[(name, labels)] = value
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.counts[bisect_left(self.buckets, value)] += 1
+            histogram.sum += value
+            histogram.count += 1
+
+    def counter(self, name: str, **labels) -> float:
+        """Current value of a counter, 0 if it was never incremented."""
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def gauge_value(self, name: str, **labels) -> float | None:
+        """Last value set for a gauge, None if it was never set."""
+        with self._lock:
+            return self._gauges.get((name, _label_key(labels)))
+
+    def histogram(self, name: str, **labels) -> tuple[int, float]:
+        """Number and sum of the values observed for name."""
+        with self._lock:
+            histogram = self._histograms.get((name, _label_key(labels)))
+            if histogram is None:
+                return 0, 0.0
+            return histogram.count, histogram.sum
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(
+                (key, list(h.counts), h.sum, h.count)
+                for key, h in self._histograms.items()
+            )
+        lines = []
+        typed = set()
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in values:
+                metric = self.prefix + name
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), counts, total, count in histograms:
+            metric = self.prefix + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels + (("le", str(bound)),))
+                lines.append(f"{metric}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+_sink: MetricsSink = MetricsRegistry() if METRICS == "memory" else NullSink()
+# Any object with an OpenTelemetry style start_as_current_span(name, attributes=)
+_tracer = None
+
+
+def get_metrics_sink() -> MetricsSink:
+    return _sink
+
+
+def set_metrics_sink(sink: MetricsSink | None):
+    """Replace the sink, None restores the no-op default."""
+    global _sink
+    _sink = sink if sink is not None else NullSink()
+
+
+def set_tracer(tracer):
+    """
+    Open a span around every timed phase, e.g. with
+    opentelemetry.trace.get_tracer("signi_email_otp"). None disables spans.
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def enabled() -> bool:
+    """Whether timings are being collected, as a metric or a span."""
+    return _sink.enabled or _tracer is not None
+
+
+def increment(name: str, value: float = 1, **labels):
+    if _sink.enabled:
+        _sink.increment(name, value, _label_key(labels))
+
+
+def observe(name: str, value: float, **labels):
+    if _sink.enabled:
+        _sink.observe(name, value, _label_key(labels))
+
+
+def gauge(name: str, value: float, **labels):
+    if _sink.enabled:
+        _sink.gauge(name, value, _label_key(labels))
+
+
+def error_label(error: BaseException) -> str:
+    """Label for an exception, e.g. InvalidOTPException -> invalid_otp."""
+    name = type(error).__name__.removesuffix("Exception") or "error"
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", name).lower()
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self._span = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self._span = _tracer.start_as_current_span(
+                self.name, attributes=self.labels
+            )
+            self._span.__enter__()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self._started, **self.labels)
+        if self._span is not None:
+            self._span.__exit__(*exc)
+        return False
+
+
+def timer(name: str, **labels):
+    """
+    Context manager recording the duration of its block as name, in
+    seconds, and opening a span of the same name when a tracer is set.
+    """
+    if not (_sink.enabled or _tracer is not None):
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+# The start time is kept on the execution context, which is dropped with a
+# failed statement, rather than in conn.info, which outlives the checkout.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    if _sink.enabled and context is not None:
+        context.signi_query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    started = getattr(context, "signi_query_started", None)
+    if started is not None:
+        observe("db_query_seconds", time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    """Record the time spent executing statements on engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+_collectors: list = []
+
+
+def add_collector(collector):
+    """
+    Register collector, called by collect() to refresh gauges that are
+    read on demand. A collector returning False is removed.
+    """
+    _collectors.append(collector)
+
+
+def collect():
+    """Run the registered collectors, e.g. before exporting metrics."""
+    if not _sink.enabled:
+        return
+    for collector in list(_collectors):
+        if collector() is False:
+            _collectors.remove(collector)
+
+
+def instrument_pool(engine, name: str = "primary"):
+    """
+    Count connections opened, checked out and invalidated (e.g. by a
+    failed pre-ping) on engine's pool, labelled pool=name. collect() reports
+    how many connections are checked out and in overflow.
+    """
+    engine_ref = weakref.ref(engine)
+
+    def on_connect(dbapi_connection, connection_record):
+        increment("db_pool_connects_total", pool=name)
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        increment("db_pool_checkouts_total", pool=name)
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        increment("db_pool_invalidations_total", pool=name)
+
+    def pool_gauges():
+        engine = engine_ref()
+        if engine is None:
+            return False
+        # Only QueuePool and its subclasses track these counts.
+        if hasattr(engine.pool, "checkedout"):
+            gauge("db_pool_checked_out", engine.pool.checkedout(), pool=name)
+            gauge("db_pool_overflow", max(engine.pool.overflow(), 0), pool=name)
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "invalidate", on_invalidate)
+    add_collector(pool_gauges)
+
+
+def prometheus_text() -> str:
+    """The current metrics in Prometheus text format, empty when not collected."""
+    if isinstance(_sink, MetricsRegistry):
+        collect()
+        return _sink.render_prometheus()
+    return ""
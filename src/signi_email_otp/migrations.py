@@ -0,0 +1,265 @@
+import argparse
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, cast
+
+from sqlalchemy import Column, Integer, MetaData, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from .config import OTP_VERIFY_ATTEMPTS
+from .core import logger
+from .models import Base, EmailOutbox
+from .otp_hash import get_otp_hasher
+
+_version_metadata = MetaData()
+
+schema_version = Table(
+    "signi_email_otp_schema_version",
+    _version_metadata,
+    Column("version", Integer, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _upgrade_1(conn: Connection):
+    """Unique email lookups and indexes for expiry sweeps."""
+    # Keep the newest row per email so the unique indexes can be built.
+    for table in ("otp", "refresh_tokens"):
+        conn.execute(
+            text(
+                f"DELETE FROM {table} WHERE id NOT IN "
+                f"(SELECT MAX(id) FROM {table} GROUP BY email)"
+            )
+        )
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_otp_email ON otp (email)"))
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_otp_created_at ON otp (created_at)")
+    )
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_refresh_tokens_email "
+            "ON refresh_tokens (email)"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_refresh_tokens_expires_at "
+            "ON refresh_tokens (expires_at)"
+        )
+    )
+
+
+def _upgrade_2(conn: Connection):
+    """Durable outbound email queue."""
+    cast(Table, EmailOutbox.__table__).create(conn, checkfirst=True)
+
+
+# Rows hashed per UPDATE statement by _upgrade_3.
+HASH_BATCH_SIZE = 1000
+
+# First SQLite release with ALTER TABLE ... RENAME COLUMN.
+SQLITE_RENAME_COLUMN_VERSION = (3, 25, 0)
+
+
+def _sqlite_version(conn: Connection) -> tuple[int, ...]:
+    # pysqlite and aiosqlite both run on the sqlite3 module's library.
+    return sqlite3.sqlite_version_info
+
+
+def _rename_otp_code(conn: Connection):
+    """
+    Rename otp.otp_code to otp_hash. SQLite releases before 3.25 cannot
+    rename columns, so the table is rebuilt under the new column name there.
+    """
+    if (
+        conn.dialect.name != "sqlite"
+        or _sqlite_version(conn) >= SQLITE_RENAME_COLUMN_VERSION
+    ):
+        conn.execute(text("ALTER TABLE otp RENAME COLUMN otp_code TO otp_hash"))
+        return
+    conn.execute(
+        text(
+            "CREATE TABLE otp_renamed (id INTEGER NOT NULL PRIMARY KEY, "
+            "email VARCHAR NOT NULL, otp_hash VARCHAR NOT NULL, "
+            "created_at DATETIME, used BOOLEAN, attempts_left INTEGER NOT NULL)"
+        )
+    )
+    conn.execute(
+        text(
+            "INSERT INTO otp_renamed "
+            "(id, email, otp_hash, created_at, used, attempts_left) "
+            "SELECT id, email, otp_code, created_at, used, attempts_left FROM otp"
+        )
+    )
+    conn.execute(text("DROP TABLE otp"))
+    conn.execute(text("ALTER TABLE otp_renamed RENAME TO otp"))
+    conn.execute(text("CREATE UNIQUE INDEX ix_otp_email ON otp (email)"))
+    conn.execute(text("CREATE INDEX ix_otp_created_at ON otp (created_at)"))
+
+
+def _upgrade_3(conn: Connection):
+    """Store keyed hashes of OTPs instead of the codes."""
+    _rename_otp_code(conn)
+    hasher = get_otp_hasher()
+    update = text("UPDATE otp SET otp_hash = :otp_hash WHERE id = :id")
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text(
+                "SELECT id, email, otp_hash FROM otp WHERE id > :last_id "
+                "ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": HASH_BATCH_SIZE},
+        ).all()
+        if not rows:
+            return
+        conn.execute(
+            update,
+            [
+                {"id": row.id, "otp_hash": hasher.hash(row.email, row.otp_hash)}
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+
+def _upgrade_4(conn: Connection):
+    """Count failed verifications."""
+    conn.execute(
+        text(
+            "ALTER TABLE otp ADD COLUMN verify_attempts_left INTEGER NOT NULL "
+            f"DEFAULT {int(OTP_VERIFY_ATTEMPTS)}"
+        )
+    )
+
+
+def _upgrade_5(conn: Connection):
+    """Refresh token rotation history."""
+    conn.execute(
+        text(
+            "ALTER TABLE refresh_tokens ADD COLUMN rotated_digests VARCHAR "
+            "NOT NULL DEFAULT ''"
+        )
+    )
+
+
+def _upgrade_6(conn: Connection):
+    """Sealed OTP codes, so unexpired ones can be resent."""
+    conn.execute(text("ALTER TABLE otp ADD COLUMN otp_sealed VARCHAR"))
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "unique email and expiry indexes", _upgrade_1),
+    Migration(2, "email outbox table", _upgrade_2),
+    Migration(3, "hashed OTPs", _upgrade_3),
+    Migration(4, "verification attempts", _upgrade_4),
+    Migration(5, "refresh token rotation history", _upgrade_5),
+    Migration(6, "sealed OTPs", _upgrade_6),
+]
+
+HEAD_VERSION = MIGRATIONS[-1].version
+
+
+def _read_version(conn: Connection) -> int | None:
+    return conn.execute(select(schema_version.c.version)).scalar()
+
+
+def _write_version(conn: Connection, version: int):
+    if _read_version(conn) is None:
+        conn.execute(schema_version.insert().values(version=version))
+    else:
+        conn.execute(schema_version.update().values(version=version))
+
+
+@contextmanager
+def _begin(bind: Engine | Connection) -> Iterator[Connection]:
+    """Run a transaction on an engine, or on an already open connection."""
+    if isinstance(bind, Connection):
+        with bind.begin():
+            yield bind
+    else:
+        with bind.begin() as conn:
+            yield conn
+
+
+def current_version(bind: Engine | Connection) -> int | None:
+    """Return the applied schema version, or None for an unmanaged database."""
+    with _begin(bind) as conn:
+        if not inspect(conn).has_table(schema_version.name):
+            return None
+        return _read_version(conn)
+
+
+def upgrade(bind: Engine | Connection, target: int = HEAD_VERSION) -> int:
+    """
+    Bring the database schema up to the target version.
+    A database without any tables is created at the latest schema directly,
+    tables created before versioning was introduced are treated as version 0.
+    bind may be an engine or a connection outside of a transaction, such as
+    the one passed to AsyncConnection.run_sync.
+    """
+    with _begin(bind) as conn:
+        _version_metadata.create_all(conn)
+        version = _read_version(conn)
+        if version is None:
+            if not inspect(conn).has_table("otp"):
+                Base.metadata.create_all(conn)
+                _write_version(conn, HEAD_VERSION)
+                logger.info("Created database schema at version %s", HEAD_VERSION)
+                return HEAD_VERSION
+            version = 0
+
+    for migration in MIGRATIONS:
+        if version < migration.version <= target:
+            logger.info(
+                "Applying schema migration %s: %s",
+                migration.version,
+                migration.description,
+            )
+            with _begin(bind) as conn:
+                migration.upgrade(conn)
+                _write_version(conn, migration.version)
+            version = migration.version
+
+    if version == HEAD_VERSION:
+        # Pick up any table that is new in the latest schema.
+        with _begin(bind) as conn:
+            Base.metadata.create_all(conn)
+    return version
+
+
+def main(argv=None):
+    from .db import _get_engine
+    from .log import configure_logging
+    from .sharding import parse_shard_urls
+
+    parser = argparse.ArgumentParser(description="Manage the OTP database schema.")
+    parser.add_argument("command", choices=["upgrade", "current"])
+    parser.add_argument("--target", type=int, default=HEAD_VERSION)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    # The primary, then every DB_SHARD_URLS shard prefixed with its name.
+    engines = {"": _get_engine()}
+    for name, url in parse_shard_urls().items():
+        engines[f"shard:{name} "] = _get_engine(url, f"shard:{name}")
+    try:
+        for prefix, engine in engines.items():
+            if args.command == "upgrade":
+                print(f"{prefix}{upgrade(engine, args.target)}")
+            else:
+                print(f"{prefix}{current_version(engine)}")
+    finally:
+        for engine in engines.values():
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,26 +11,66 @@ def utcnow_timeaware() -> datetime:
     return datetime.now(timezone.utc)
 
 
+def as_utc(value: datetime) -> datetime:
+    """Attach UTC to naive datetimes, as returned by backends such as SQLite."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
 class OTP(Base):
     __tablename__ = "otp"
     id: Mapped[int] = mapped_column(primary_key=True)
-    email: Mapped[str] = mapped_column(String, nullable=False)
-    otp_code: Mapped[str] = mapped_column(String, nullable=False)
+    email: Mapped[str] = mapped_column(String, nullable=False, unique=True, index=True)
+    # OTPHasher hash of the code, see otp_hash
+    otp_hash: Mapped[str] = mapped_column(String, nullable=False)
+    # OTPHasher seal of the code, to resend it, None for OTPs stored before
+    otp_sealed: Mapped[str | None] = mapped_column(String, nullable=True)
     created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), default=utcnow_timeaware
+        DateTime(timezone=True), default=utcnow_timeaware, index=True
     )
     used: Mapped[bool] = mapped_column(Boolean, default=False)
     attempts_left: Mapped[int] = mapped_column(Integer, default=3, nullable=False)
+    # Wrong codes still allowed, the OTP is locked at 0
+    verify_attempts_left: Mapped[int] = mapped_column(
+        Integer, default=5, nullable=False
+    )
 
 
 class JWT(Base):
     __tablename__ = "refresh_tokens"
     id: Mapped[int] = mapped_column(primary_key=True)
-    email: Mapped[str] = mapped_column(String, nullable=False)
+    email: Mapped[str] = mapped_column(String, nullable=False, unique=True, index=True)
     refresh_token: Mapped[str] = mapped_column(String, nullable=False)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=utcnow_timeaware
     )
     expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow_timeaware, index=True
+    )
+    # Digests of the tokens this one replaced, newest first, see tokens.py
+    rotated_digests: Mapped[str] = mapped_column(String, default="", nullable=False)
+
+
+class EmailOutbox(Base):
+    """Durable queue of outbound emails, see email_queue.DBEmailQueue."""
+
+    __tablename__ = "email_outbox"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    email_to: Mapped[str] = mapped_column(String, nullable=False)
+    subject: Mapped[str] = mapped_column(String, nullable=False)
+    body: Mapped[str] = mapped_column(String, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # pending, sending or failed
+    status: Mapped[str] = mapped_column(
+        String(16), default="pending", nullable=False, index=True
+    )
+    not_before: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow_timeaware
+    )
+    claimed_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=utcnow_timeaware
     )
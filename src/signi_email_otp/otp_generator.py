@@ -0,0 +1,104 @@
+import os
+import threading
+import weakref
+
+from .config import OTP_ALPHABET, OTP_LENGTH
+
+# Random bytes fetched per os.urandom call
+BUFFER_SIZE = 4096
+
+
+class OTPGenerator:
+    """
+    OTP codes of length characters from alphabet, drawn from os.urandom.
+    Random bytes are fetched buffer_size at a time and turned into
+    characters with one bytes.translate call: each byte maps to one
+    character, and bytes at or above the largest multiple of len(alphabet)
+    are dropped, so every character is equally likely. Codes are then
+    sliced off the buffer, so most of them cost no system call. Safe to
+    share between threads, and a forked child never reuses its parent's
+    buffer.
+    """
+
+    def __init__(
+        self,
+        length: int = OTP_LENGTH,
+        alphabet: str = OTP_ALPHABET,
+        buffer_size: int = BUFFER_SIZE,
+    ):
+        if length <= 0:
+            raise ValueError("length must be a positive integer")
+        if buffer_size <= 0:
+            raise ValueError("buffer_size must be a positive integer")
+        if not (2 <= len(alphabet) <= 256 and alphabet.isascii()):
+            raise ValueError("alphabet must have 2 to 256 ASCII characters")
+        if len(set(alphabet)) != len(alphabet):
+            raise ValueError(f"alphabet {alphabet!r} repeats characters")
+        self.length = length
+        self.alphabet = alphabet
+        self.buffer_size = buffer_size
+        accepted = 256 - 256 % len(alphabet)
+        self._table = bytes(ord(alphabet[b % len(alphabet)]) for b in range(256))
+        self._rejected = bytes(range(accepted, 256))
+        self._lock = threading.Lock()
+        self._buffer = ""
+        self._position = 0
+        _generators.add(self)
+
+    def _refill(self):
+        """Append fresh characters to the ones not used yet."""
+        start = self._position
+        fresh = os.urandom(self.buffer_size).translate(self._table, self._rejected)
+        self._buffer = self._buffer[start:] + fresh.decode("ascii")
+        self._position = 0
+
+    def generate(self) -> str:
+        with self._lock:
+            while self._position + self.length > len(self._buffer):
+                self._refill()
+            start = self._position
+            end = self._position = start + self.length
+            return self._buffer[start:end]
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._buffer = ""
+        self._position = 0
+
+
+_generators: weakref.WeakSet[OTPGenerator] = weakref.WeakSet()
+_generator: OTPGenerator | None = None
+_generator_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _generator_lock
+    _generator_lock = threading.Lock()
+    for generator in list(_generators):
+        generator._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_otp_generator() -> OTPGenerator:
+    """Return the process wide OTPGenerator for OTP_LENGTH and OTP_ALPHABET."""
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = OTPGenerator()
+    return _generator
+
+
+def set_otp_generator(generator: OTPGenerator | None):
+    """Replace the process wide OTPGenerator, None reverts to the configured one."""
+    global _generator
+    with _generator_lock:
+        _generator = generator
+
+
+def generate_otp() -> str:
+    """A new OTP code from the process wide generator."""
+    return get_otp_generator().generate()
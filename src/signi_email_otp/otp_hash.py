@@ -0,0 +1,84 @@
+import hashlib
+import hmac
+import os
+import threading
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from .config import OTP_HASH_SECRET
+
+# Random bytes prefixed to each sealed code
+SEAL_NONCE_SIZE = 12
+# HKDF info of the seal key, which keeps it apart from the hash key
+_SEAL_KEY_INFO = b"signi_email_otp otp seal"
+
+
+class OTPHasher:
+    """
+    Keyed hashes of OTPs, so stored OTPs are useless without the secret.
+    The HMAC key schedule is computed once and copied for each hash, which
+    keeps a hash to a few microseconds. The email is hashed along with the
+    code, so equal codes for different emails have different hashes.
+    Codes can also be sealed with AES-GCM, under a key derived from the
+    secret with HKDF and bound to the email, so the code of an unexpired
+    OTP can be sent again.
+    """
+
+    def __init__(self, secret: str | bytes = OTP_HASH_SECRET):
+        if isinstance(secret, str):
+            secret = secret.encode()
+        self._context = hmac.new(secret, digestmod=hashlib.sha256)
+        seal_key = HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=_SEAL_KEY_INFO
+        ).derive(secret)
+        self._aead = AESGCM(seal_key)
+
+    def hash(self, email: str, code: str) -> str:
+        context = self._context.copy()
+        context.update(f"{email}\0{code}".encode())
+        return context.hexdigest()
+
+    def verify(self, email: str, code: str, otp_hash: str) -> bool:
+        """Check code against a stored hash in constant time."""
+        return hmac.compare_digest(self.hash(email, code), otp_hash)
+
+    def seal(self, email: str, code: str) -> str:
+        """Encrypt code for email under a fresh nonce, as hex."""
+        nonce = os.urandom(SEAL_NONCE_SIZE)
+        return (nonce + self._aead.encrypt(nonce, code.encode(), email.encode())).hex()
+
+    def unseal(self, email: str, sealed: str) -> str | None:
+        """
+        The code a seal for the same email and secret was made from, or None
+        for any other seal, e.g. one made before OTP_HASH_SECRET changed.
+        """
+        try:
+            raw = bytes.fromhex(sealed)
+            nonce, data = raw[:SEAL_NONCE_SIZE], raw[SEAL_NONCE_SIZE:]
+            return self._aead.decrypt(nonce, data, email.encode()).decode()
+        except (InvalidTag, ValueError):
+            return None
+
+
+_hasher: OTPHasher | None = None
+_hasher_lock = threading.Lock()
+
+
+def get_otp_hasher() -> OTPHasher:
+    """Return the process wide OTPHasher keyed with OTP_HASH_SECRET."""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = OTPHasher()
+    return _hasher
+
+
+def set_otp_hasher(hasher: OTPHasher | None):
+    """Replace the process wide OTPHasher, None reverts to the configured one."""
+    global _hasher
+    with _hasher_lock:
+        _hasher = hasher
@@ -0,0 +1,897 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Callable
+
+from sqlalchemy import and_, case, delete, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from .config import (
+    OTP_STORE,
+    OTP_STORE_REDIS_URL,
+    OTP_STORE_STRIPES,
+    OTP_VERIFY_ATTEMPTS,
+    OTP_LOCKOUT_CACHE_SIZE,
+    get_settings,
+)
+from . import metrics
+from .core import logger
+from .db import get_db, shard_of
+from .exception import (
+    RateLimitOTPExceededException,
+    OTPNotFoundException,
+    InvalidOTPException,
+    OTPExpiredException,
+    OTPAttemptsExceededException,
+)
+from .models import OTP, as_utc
+from .otp_hash import OTPHasher, get_otp_hasher
+from .shared import SharedTable
+
+# Number of times an unexpired OTP can be requested (and resent) again.
+OTP_REQUEST_ATTEMPTS = 3
+
+
+def _rate_limited(email):
+    logger.warning("OTP for %s has no attempts left, rate limiting applied.", email)
+    return RateLimitOTPExceededException(
+        "Maximum attempts exceeded. Please try again later."
+    )
+
+
+def _attempts_exceeded(email):
+    logger.warning("OTP for %s is locked after failed attempts.", email)
+    return OTPAttemptsExceededException()
+
+
+class OTPStore(ABC):
+    """
+    Storage for pending OTPs. Implementations must make issue and consume
+    atomic per email, and keep only the hasher's hash and seal of each code.
+    """
+
+    def __init__(
+        self,
+        expiry_seconds: float | None = None,
+        max_requests: int = OTP_REQUEST_ATTEMPTS,
+        hasher: OTPHasher | None = None,
+        max_verify_attempts: int = OTP_VERIFY_ATTEMPTS,
+    ):
+        self._expiry_seconds = expiry_seconds
+        self.max_requests = max_requests
+        self._hasher = hasher
+        self.max_verify_attempts = max_verify_attempts
+
+    @property
+    def expiry_seconds(self) -> float:
+        """The expiry given to the store, else the current OTP_EXPIRY_SECONDS."""
+        if self._expiry_seconds is not None:
+            return self._expiry_seconds
+        return get_settings().otp_expiry_seconds
+
+    @property
+    def hasher(self) -> OTPHasher:
+        """The hasher given to the store, else the process wide one."""
+        return self._hasher or get_otp_hasher()
+
+    @abstractmethod
+    def issue(self, email: str, new_code: str) -> str:
+        """
+        Return the OTP for email, to be sent. An unexpired OTP is kept and
+        its code, unsealed, returned again with one request fewer left,
+        otherwise new_code is stored with a fresh expiry. Raises
+        RateLimitOTPExceededException when no attempts are left, or the
+        unexpired OTP is locked. An unexpired OTP stored without a seal, or
+        with one the hasher cannot open, cannot be resent and is replaced by
+        new_code, keeping its expiry.
+        """
+
+    @abstractmethod
+    def consume(self, email: str, otp: str) -> None:
+        """
+        Check otp against the stored OTP for email and remove it on success.
+        A wrong otp uses up one of max_verify_attempts in the same atomic
+        step, the last one locks the OTP until it expires. Raises
+        OTPNotFoundException, InvalidOTPException, OTPExpiredException or
+        OTPAttemptsExceededException.
+        """
+
+    def issue_many(self, new_codes: dict[str, str]) -> dict[str, str | Exception]:
+        """
+        issue for several emails, new_codes maps each email to the code used
+        if a new one is needed. Returns each email's OTP, or the exception
+        issue raised for it.
+        """
+        results: dict[str, str | Exception] = {}
+        for email, new_code in new_codes.items():
+            try:
+                results[email] = self.issue(email, new_code)
+            except RateLimitOTPExceededException as e:
+                results[email] = e
+        return results
+
+
+class LockoutCache:
+    """
+    Emails whose OTP is locked, each until the OTP expires, so further
+    guesses are rejected without a database round trip. At most maxsize
+    emails are kept, the oldest lockout is dropped first, which only costs
+    a query. Lockouts end at the same time on every node.
+    """
+
+    def __init__(self, maxsize: int = OTP_LOCKOUT_CACHE_SIZE, clock=time.time):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def locked(self, email: str) -> bool:
+        with self._lock:
+            until = self._entries.get(email)
+            if until is None:
+                return False
+            if until > self._clock():
+                return True
+            del self._entries[email]
+            return False
+
+    def add(self, email: str, until: float):
+        if self.maxsize <= 0 or until <= self._clock():
+            return
+        with self._lock:
+            self._entries[email] = until
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class SharedLockoutCache:
+    """
+    A LockoutCache kept in a shared.SharedTable, so a lockout seen by one
+    signi-otp-server worker rejects guesses in all of them. A full table
+    drops the lockout ending first among those a new email may replace.
+    """
+
+    def __init__(self, table: SharedTable, clock=time.time):
+        self.table = table
+        self._clock = clock
+
+    def __len__(self):
+        return len(self.table)
+
+    def locked(self, email: str) -> bool:
+        with self.table.lock:
+            state = self.table.get(email)
+        return state is not None and state[0] > self._clock()
+
+    def add(self, email: str, until: float):
+        if until <= self._clock():
+            return
+        with self.table.lock:
+            self.table.set(email, until, until)
+
+
+_UPSERT_INSERTS: dict[str, Callable[..., postgresql.Insert | sqlite.Insert]] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+class SQLOTPStore(OTPStore):
+    """
+    OTPs kept in the otp table of the configured database, or of the
+    email's shard when sharding is on. get_db_func(email) replaces db.get_db.
+    Locked out emails are remembered in lockouts and rejected up front.
+    """
+
+    def __init__(
+        self,
+        get_db_func=None,
+        lockouts: LockoutCache | SharedLockoutCache | None = None,
+        **kw,
+    ):
+        super().__init__(**kw)
+        self._get_db = get_db_func
+        self.lockouts = lockouts if lockouts is not None else LockoutCache()
+
+    def session(self, email: str | None = None):
+        return (self._get_db or get_db)(email)
+
+    def issue(self, email: str, new_code: str) -> str:
+        hasher = self.hasher
+        otp_hash, otp_sealed = hasher.hash(email, new_code), hasher.seal(
+            email, new_code
+        )
+        with self.session(email) as session:
+            insert = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+            if insert is None:
+                return self._locked_issue(
+                    session, email, new_code, otp_hash, otp_sealed
+                )
+            stmt = upsert_statement(
+                insert,
+                email,
+                otp_hash,
+                otp_sealed,
+                self.expiry_seconds,
+                self.max_requests,
+                self.max_verify_attempts,
+            )
+            row = session.execute(stmt).first()
+            code = upserted_code(email, row, hasher)
+            if code is None:
+                # The upsert keeps the row locked until the commit.
+                session.execute(reseal_statement(email, otp_hash, otp_sealed))
+                return new_code
+            return code
+
+    def issue_many(self, new_codes: dict[str, str]) -> dict[str, str | Exception]:
+        """issue for several emails with one upsert statement per shard."""
+        by_shard: dict[str | None, dict[str, str]] = {}
+        for email, new_code in new_codes.items():
+            by_shard.setdefault(shard_of(email), {})[email] = new_code
+        results: dict[str, str | Exception] = {}
+        for shard_codes in by_shard.values():
+            results.update(self._issue_shard(shard_codes))
+        return {email: results[email] for email in new_codes}
+
+    def _issue_shard(self, new_codes: dict[str, str]) -> dict[str, str | Exception]:
+        with self.session(next(iter(new_codes))) as session:
+            insert = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+            if insert is None:
+                return super().issue_many(new_codes)
+            hasher = self.hasher
+            new_otps = {
+                email: (hasher.hash(email, code), hasher.seal(email, code))
+                for email, code in new_codes.items()
+            }
+            stmt = bulk_upsert_statement(
+                insert,
+                new_otps,
+                self.expiry_seconds,
+                self.max_requests,
+                self.max_verify_attempts,
+            )
+            issued: dict[str, str] = {}
+            for row in session.execute(stmt).all():
+                code = upserted_code(row.email, row, hasher)
+                if code is None:
+                    stmt = reseal_statement(row.email, *new_otps[row.email])
+                    session.execute(stmt)
+                    code = new_codes[row.email]
+                issued[row.email] = code
+        logger.info("Issued %s of %s OTPs in bulk", len(issued), len(new_codes))
+        return {
+            email: issued[email] if email in issued else _rate_limited(email)
+            for email in new_codes
+        }
+
+    def _locked_issue(self, session, email, new_code, otp_hash, otp_sealed) -> str:
+        """
+        Fallback for databases without INSERT ... ON CONFLICT, serialising
+        concurrent requests for the same email with a row lock. Returns the
+        code to send.
+        """
+        otp_obj = session.query(OTP).filter_by(email=email).with_for_update().first()
+        if otp_obj:
+            return reissue(
+                otp_obj,
+                email,
+                new_code,
+                otp_hash,
+                otp_sealed,
+                self.expiry_seconds,
+                self.max_requests,
+                self.max_verify_attempts,
+                self.hasher,
+            )
+
+        logger.debug("No existing OTP found for %s, generating new OTP.", email)
+        otp_obj = OTP(
+            email=email,
+            otp_hash=otp_hash,
+            otp_sealed=otp_sealed,
+            created_at=datetime.now(timezone.utc),
+            attempts_left=self.max_requests,
+            verify_attempts_left=self.max_verify_attempts,
+        )
+        try:
+            # A concurrent first request may insert the row before we do,
+            # in which case lock that row and go through the checks above.
+            with session.begin_nested():
+                session.add(otp_obj)
+        except IntegrityError:
+            return self._locked_issue(session, email, new_code, otp_hash, otp_sealed)
+        logger.info("Generated new OTP for %s", email)
+        return new_code
+
+    def consume(self, email: str, otp: str) -> None:
+        if self.lockouts.locked(email):
+            raise _attempts_exceeded(email)
+        with self.session(email) as session:
+            if session.get_bind().dialect.update_returning:
+                stmt = verify_statement(email, self.hasher.hash(email, otp))
+                row = session.execute(stmt).first()
+            else:
+                otp_obj = (
+                    session.query(OTP).filter_by(email=email).with_for_update().first()
+                )
+                row = take_verify_attempt(otp_obj, email, otp, self.hasher)
+            error = verify_error(email, row, self.expiry_seconds)
+            if error is None:
+                # Delete the OTP after successful verification, to avoid reuse
+                session.execute(delete(OTP).where(OTP.email == email))
+        # Raised once the session has committed the attempt taken.
+        if error is not None:
+            if isinstance(error, OTPAttemptsExceededException):
+                self.lockouts.add(email, locked_until(row, self.expiry_seconds))
+            raise error
+
+
+def upsert_statement(
+    insert,
+    email,
+    otp_hash,
+    otp_sealed,
+    expiry_seconds,
+    max_requests,
+    max_verify_attempts,
+):
+    """
+    Build the statement that stores otp_hash and otp_sealed as the OTP for
+    email, unless an unexpired one can be resent. An expired OTP is
+    replaced with a fresh expiry and attempts, an unexpired one keeps its
+    code, expiry and failed verifications, and has its attempts_left
+    decremented. The code of an unexpired OTP without a seal is replaced,
+    one whose seal does not open is replaced by reseal_statement after.
+    The update is skipped when an unexpired OTP has no attempts left or is
+    locked, so no row is returned and the caller is rate limited. The row
+    returned holds the seal of the code to send. insert is the dialect
+    specific insert construct.
+    """
+    return bulk_upsert_statement(
+        insert,
+        {email: (otp_hash, otp_sealed)},
+        expiry_seconds,
+        max_requests,
+        max_verify_attempts,
+    )
+
+
+def bulk_upsert_statement(
+    insert, new_otps, expiry_seconds, max_requests, max_verify_attempts
+):
+    """
+    upsert_statement for many emails at once, new_otps maps each email to
+    the hash and seal of its new code. Rows are returned for the emails that
+    were not rate limited, in no particular order.
+    """
+    otp_table = OTP.__table__
+    now = datetime.now(timezone.utc)
+    expired = otp_table.c.created_at <= now - timedelta(seconds=expiry_seconds)
+    replaced = or_(expired, otp_table.c.otp_sealed.is_(None))
+    stmt = insert(otp_table).values(
+        [
+            {
+                "email": email,
+                "otp_hash": otp_hash,
+                "otp_sealed": otp_sealed,
+                "created_at": now,
+                "used": False,
+                "attempts_left": max_requests,
+                "verify_attempts_left": max_verify_attempts,
+            }
+            for email, (otp_hash, otp_sealed) in new_otps.items()
+        ]
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[otp_table.c.email],
+        set_={
+            "otp_hash": case(
+                (replaced, stmt.excluded.otp_hash), else_=otp_table.c.otp_hash
+            ),
+            "otp_sealed": case(
+                (replaced, stmt.excluded.otp_sealed), else_=otp_table.c.otp_sealed
+            ),
+            "created_at": case(
+                (expired, stmt.excluded.created_at), else_=otp_table.c.created_at
+            ),
+            "attempts_left": case(
+                (expired, stmt.excluded.attempts_left),
+                else_=otp_table.c.attempts_left - 1,
+            ),
+            "verify_attempts_left": case(
+                (expired, stmt.excluded.verify_attempts_left),
+                else_=otp_table.c.verify_attempts_left,
+            ),
+        },
+        where=or_(
+            expired,
+            and_(otp_table.c.attempts_left > 0, otp_table.c.verify_attempts_left > 0),
+        ),
+    ).returning(otp_table.c.email, otp_table.c.otp_sealed)
+
+
+def upserted_code(email, row, hasher: OTPHasher) -> str | None:
+    """
+    Return the code to send, given the upsert_statement result row, or None
+    when its seal does not open, e.g. after OTP_HASH_SECRET changed. The
+    caller then stores its new code with reseal_statement.
+    """
+    if row is None:
+        raise _rate_limited(email)
+    code = hasher.unseal(email, row.otp_sealed)
+    if code is None:
+        logger.warning("Sealed OTP for %s does not open, replacing it", email)
+    else:
+        logger.info("Issued OTP for %s", email)
+    return code
+
+
+def reseal_statement(email, otp_hash, otp_sealed):
+    """
+    Build the statement that replaces the code of email's OTP, whose seal
+    does not open, keeping its expiry and attempts.
+    """
+    otp_table = OTP.__table__
+    return (
+        update(otp_table)
+        .where(otp_table.c.email == email)
+        .values(otp_hash=otp_hash, otp_sealed=otp_sealed)
+    )
+
+
+def reissue(
+    otp_obj,
+    email,
+    new_code,
+    otp_hash,
+    otp_sealed,
+    expiry_seconds,
+    max_requests,
+    max_verify_attempts,
+    hasher: OTPHasher,
+) -> str:
+    """
+    The ORM equivalent of upsert_statement for a locked OTP row, storing
+    new_code's otp_hash and otp_sealed if needed. Returns the code to send.
+    """
+    created_at = as_utc(otp_obj.created_at)
+    otp_age = (datetime.now(timezone.utc) - created_at).total_seconds()
+    if otp_age < expiry_seconds:
+        if otp_obj.attempts_left > 0 and otp_obj.verify_attempts_left > 0:
+            otp_obj.attempts_left -= 1
+            if otp_obj.otp_sealed is not None:
+                code = hasher.unseal(email, otp_obj.otp_sealed)
+                if code is not None:
+                    logger.info(
+                        "Reusing existing OTP for %s, age: %s seconds", email, otp_age
+                    )
+                    return code
+            otp_obj.otp_hash = otp_hash
+            otp_obj.otp_sealed = otp_sealed
+            logger.info("Replaced OTP for %s, age: %s seconds", email, otp_age)
+            return new_code
+        raise _rate_limited(email)
+    logger.info("Existing OTP for %s expired, generating new OTP.", email)
+    otp_obj.otp_hash = otp_hash
+    otp_obj.otp_sealed = otp_sealed
+    otp_obj.created_at = datetime.now(timezone.utc)
+    otp_obj.attempts_left = max_requests
+    otp_obj.verify_attempts_left = max_verify_attempts
+    return new_code
+
+
+def issue_outcome(otp: str | Exception, new_code: str) -> str:
+    """
+    Metrics label for the result of issue(email, new_code): issued, reused
+    when the unexpired code was returned instead, or the error label of the
+    exception raised.
+    """
+    if isinstance(otp, Exception):
+        return metrics.error_label(otp)
+    return "issued" if otp == new_code else "reused"
+
+
+def verify_statement(email, otp_hash):
+    """
+    Build the statement that checks otp_hash against the OTP for email and,
+    if it does not match, takes one of its verify attempts, in a single
+    round trip. Returns matched, created_at and the verify_attempts_left
+    after the update. The hashes are keyed, so the time the comparison
+    takes in the database reveals nothing about the code.
+    """
+    otp_table = OTP.__table__
+    matched = otp_table.c.otp_hash == otp_hash
+    attempts_left = otp_table.c.verify_attempts_left
+    return (
+        update(otp_table)
+        .where(otp_table.c.email == email)
+        .values(
+            verify_attempts_left=case(
+                (matched, attempts_left),
+                (attempts_left > 0, attempts_left - 1),
+                else_=attempts_left,
+            )
+        )
+        .returning(matched.label("matched"), otp_table.c.created_at, attempts_left)
+    )
+
+
+@dataclass(frozen=True)
+class VerifyAttempt:
+    """A verify_statement result row."""
+
+    matched: bool
+    created_at: datetime
+    verify_attempts_left: int
+
+
+def take_verify_attempt(otp_obj, email, otp, hasher: OTPHasher):
+    """The ORM equivalent of verify_statement, for a locked OTP row or None."""
+    if otp_obj is None:
+        return None
+    matched = hasher.verify(email, otp, otp_obj.otp_hash)
+    if not matched and otp_obj.verify_attempts_left > 0:
+        otp_obj.verify_attempts_left -= 1
+    return VerifyAttempt(matched, otp_obj.created_at, otp_obj.verify_attempts_left)
+
+
+def verify_error(email, row, expiry_seconds) -> Exception | None:
+    """The exception a verify_statement result row calls for, or None."""
+    if row is None:
+        logger.warning("OTP not found for email: %s", email)
+        return OTPNotFoundException("OTP not found for this email")
+
+    if row.verify_attempts_left <= 0:
+        return _attempts_exceeded(email)
+
+    if not row.matched:
+        logger.warning("Invalid OTP for email: %s", email)
+        return InvalidOTPException("Invalid OTP provided.")
+
+    created_at = as_utc(row.created_at)
+    otp_age = (datetime.now(timezone.utc) - created_at).total_seconds()
+    if otp_age > expiry_seconds:
+        logger.warning("OTP expired for email: %s", email)
+        return OTPExpiredException("OTP has expired")
+    return None
+
+
+def locked_until(row, expiry_seconds) -> float:
+    """When the OTP of a locked verify_statement result row expires."""
+    return as_utc(row.created_at).timestamp() + expiry_seconds
+
+
+@dataclass
+class _MemoryOTP:
+    otp_hash: str
+    otp_sealed: str
+    created_at: float
+    attempts_left: int
+    verify_attempts_left: int
+
+
+class MemoryOTPStore(OTPStore):
+    """
+    In-process OTP store for single node deployments.
+    Emails are spread over independently locked stripes so concurrent
+    requests for different emails rarely contend. Each stripe keeps its
+    entries in creation order, which lets expired entries be evicted from
+    the front of the stripe in time proportional to the number evicted.
+    """
+
+    def __init__(self, stripes: int = OTP_STORE_STRIPES, clock=time.monotonic, **kw):
+        super().__init__(**kw)
+        if stripes <= 0:
+            raise ValueError("stripes must be a positive integer")
+        self._clock = clock
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._entries: list[dict[str, _MemoryOTP]] = [{} for _ in range(stripes)]
+
+    def _stripe(self, email):
+        index = hash(email) % len(self._locks)
+        return self._locks[index], self._entries[index]
+
+    def _evict_expired(self, entries, now):
+        while entries:
+            email = next(iter(entries))
+            if now - entries[email].created_at < self.expiry_seconds:
+                return
+            del entries[email]
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries)
+
+    def issue(self, email: str, new_code: str) -> str:
+        hasher = self.hasher
+        lock, entries = self._stripe(email)
+        with lock:
+            now = self._clock()
+            self._evict_expired(entries, now)
+            entry = entries.get(email)
+            if entry is not None:
+                if entry.attempts_left <= 0 or entry.verify_attempts_left <= 0:
+                    raise _rate_limited(email)
+                entry.attempts_left -= 1
+                code = hasher.unseal(email, entry.otp_sealed)
+                if code is not None:
+                    logger.info("Reusing existing OTP for %s", email)
+                    return code
+                entry.otp_hash = hasher.hash(email, new_code)
+                entry.otp_sealed = hasher.seal(email, new_code)
+                logger.info("Replaced OTP for %s", email)
+                return new_code
+            entries[email] = _MemoryOTP(
+                hasher.hash(email, new_code),
+                hasher.seal(email, new_code),
+                now,
+                self.max_requests,
+                self.max_verify_attempts,
+            )
+            logger.info("Generated new OTP for %s", email)
+            return new_code
+
+    def consume(self, email: str, otp: str) -> None:
+        hasher = self.hasher
+        lock, entries = self._stripe(email)
+        with lock:
+            now = self._clock()
+            self._evict_expired(entries, now)
+            entry = entries.get(email)
+            if entry is None:
+                logger.warning("OTP not found for email: %s", email)
+                raise OTPNotFoundException("OTP not found for this email")
+            if entry.verify_attempts_left <= 0:
+                raise _attempts_exceeded(email)
+            if not hasher.verify(email, otp, entry.otp_hash):
+                entry.verify_attempts_left -= 1
+                if entry.verify_attempts_left <= 0:
+                    raise _attempts_exceeded(email)
+                logger.warning("Invalid OTP for email: %s", email)
+                raise InvalidOTPException("Invalid OTP provided.")
+            del entries[email]
+
+
+# Store the hash in ARGV[1] and the seal in ARGV[5] unless an unexpired
+# entry can be resent, returning the seal of the code to send, or nil when
+# no attempts are left. The key keeps its TTL while unexpired, like the
+# created_at of a SQL row.
+_REDIS_ISSUE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'attempts', 'verify', 'sealed')
+if not state[1] then
+    redis.call(
+        'HSET', KEYS[1], 'hash', ARGV[1], 'sealed', ARGV[5],
+        'attempts', ARGV[2], 'verify', ARGV[4]
+    )
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+    return ARGV[5]
+end
+if tonumber(state[1]) <= 0 or tonumber(state[2] or ARGV[4]) <= 0 then
+    return false
+end
+redis.call('HINCRBY', KEYS[1], 'attempts', -1)
+if not state[3] then
+    redis.call('HSET', KEYS[1], 'hash', ARGV[1], 'sealed', ARGV[5])
+    return ARGV[5]
+end
+return state[3]
+"""
+
+# Replace the hash and seal of an entry whose seal ARGV[6] does not open,
+# as _REDIS_ISSUE_SCRIPT replaces an entry without a seal, or store them
+# like it if the entry is gone. A seal another request stored meanwhile is
+# returned instead, otherwise ARGV[5].
+_REDIS_RESEAL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call(
+        'HSET', KEYS[1], 'hash', ARGV[1], 'sealed', ARGV[5],
+        'attempts', ARGV[2], 'verify', ARGV[4]
+    )
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+    return ARGV[5]
+end
+local sealed = redis.call('HGET', KEYS[1], 'sealed')
+if sealed and sealed ~= ARGV[6] then
+    return sealed
+end
+redis.call('HSET', KEYS[1], 'hash', ARGV[1], 'sealed', ARGV[5])
+return ARGV[5]
+"""
+
+# Compares keyed hashes, so the comparison time reveals nothing about the
+# code even though it is not constant. A mismatch takes a verify attempt,
+# ARGV[2] is the number an entry without the field started with.
+_REDIS_CONSUME_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'hash', 'verify')
+if not state[1] then
+    return 0
+end
+local verify = tonumber(state[2] or ARGV[2])
+if verify <= 0 then
+    return 3
+end
+if state[1] ~= ARGV[1] then
+    redis.call('HSET', KEYS[1], 'verify', verify - 1)
+    if verify <= 1 then
+        return 3
+    end
+    return 1
+end
+redis.call('DEL', KEYS[1])
+return 2
+"""
+
+_REDIS_NOT_FOUND, _REDIS_INVALID, _REDIS_CONSUMED, _REDIS_LOCKED = 0, 1, 2, 3
+
+
+class RedisOTPStore(OTPStore):
+    """
+    OTPs kept in a Redis-protocol server (Redis, Valkey, KeyDB, ...).
+    Expiry is left to native key TTLs and each operation is a single
+    server-side script, so concurrent callers cannot interleave.
+    Requires the optional redis client package.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        url: str = OTP_STORE_REDIS_URL,
+        key_prefix: str = "signi_email_otp:otp:",
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.key_prefix = key_prefix
+        self._issue = client.register_script(_REDIS_ISSUE_SCRIPT)
+        self._reseal = client.register_script(_REDIS_RESEAL_SCRIPT)
+        self._consume = client.register_script(_REDIS_CONSUME_SCRIPT)
+        # Load the scripts up front so the first request does not pay for a
+        # NOSCRIPT round trip.
+        for script in (self._issue, self._reseal, self._consume):
+            client.script_load(script.script)
+
+    def _key(self, email):
+        return f"{self.key_prefix}{email}"
+
+    def _issue_args(self, email, new_code):
+        return redis_issue_args(self, email, new_code)
+
+    def issue(self, email: str, new_code: str) -> str:
+        args = self._issue_args(email, new_code)
+        sealed = self._issue(keys=[self._key(email)], args=args)
+        return self._issued_code(email, args, sealed)
+
+    def _issued_code(self, email, args, sealed) -> str:
+        """The code to send for an issue result, resealing until one opens."""
+        while (code := redis_issued_code(email, sealed, self.hasher)) is None:
+            sealed = self._reseal(keys=[self._key(email)], args=[*args, sealed])
+        return code
+
+    def issue_many(self, new_codes: dict[str, str]) -> dict[str, str | Exception]:
+        """issue for several emails in one pipelined round trip."""
+        pipe = self.client.pipeline(transaction=False)
+        issue_args = {}
+        for email, new_code in new_codes.items():
+            args = issue_args[email] = self._issue_args(email, new_code)
+            self._issue(keys=[self._key(email)], args=args, client=pipe)
+        results: dict[str, str | Exception] = {}
+        for email, sealed in zip(new_codes, pipe.execute()):
+            try:
+                results[email] = self._issued_code(email, issue_args[email], sealed)
+            except RateLimitOTPExceededException as e:
+                results[email] = e
+        return results
+
+    def consume(self, email: str, otp: str) -> None:
+        otp_hash = self.hasher.hash(email, otp)
+        status = self._consume(
+            keys=[self._key(email)], args=[otp_hash, self.max_verify_attempts]
+        )
+        redis_consume_result(email, status)
+
+
+def redis_issue_args(store, email, new_code) -> list:
+    """
+    ARGV of _REDIS_ISSUE_SCRIPT for storing new_code as email's OTP in store,
+    an OTPStore or aio.otp_store.AsyncOTPStore.
+    """
+    hasher = store.hasher
+    return [
+        hasher.hash(email, new_code),
+        store.max_requests,
+        int(store.expiry_seconds * 1000),
+        store.max_verify_attempts,
+        hasher.seal(email, new_code),
+    ]
+
+
+def redis_issued_code(email, sealed, hasher: OTPHasher) -> str | None:
+    """
+    The code to send for a _REDIS_ISSUE_SCRIPT or _REDIS_RESEAL_SCRIPT
+    result, or None when the seal does not open and the entry needs
+    _REDIS_RESEAL_SCRIPT with the issue arguments and this seal.
+    """
+    if sealed is None:
+        raise _rate_limited(email)
+    if isinstance(sealed, bytes):
+        sealed = sealed.decode()
+    code = hasher.unseal(email, sealed)
+    if code is None:
+        logger.warning("Sealed OTP for %s does not open, replacing it", email)
+    else:
+        logger.info("Issued OTP for %s", email)
+    return code
+
+
+def redis_consume_result(email, status):
+    """Raise the exception for a _REDIS_CONSUME_SCRIPT status, if any."""
+    if status == _REDIS_NOT_FOUND:
+        logger.warning("OTP not found for email: %s", email)
+        raise OTPNotFoundException("OTP not found for this email")
+    if status == _REDIS_INVALID:
+        logger.warning("Invalid OTP for email: %s", email)
+        raise InvalidOTPException("Invalid OTP provided.")
+    if status == _REDIS_LOCKED:
+        raise _attempts_exceeded(email)
+
+
+_STORE_BACKENDS = {
+    "sql": SQLOTPStore,
+    "memory": MemoryOTPStore,
+    "redis": RedisOTPStore,
+}
+
+_store: OTPStore | None = None
+_store_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _store_lock
+    _store_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def create_otp_store(backend: str = OTP_STORE, **kwargs) -> OTPStore:
+    """Build the OTP store for the named backend: sql, memory or redis."""
+    try:
+        store_class = _STORE_BACKENDS[backend.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unknown OTP store backend {backend!r}, "
+            f"expected one of {sorted(_STORE_BACKENDS)}"
+        ) from None
+    return store_class(**kwargs)
+
+
+def get_otp_store() -> OTPStore:
+    """Return the process wide OTP store selected by the OTP_STORE setting."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_otp_store()
+                logger.info("Using %s for OTP storage", type(_store).__name__)
+    return _store
+
+
+def set_otp_store(store: OTPStore | None):
+    """Replace the process wide OTP store, None reverts to the configured one."""
+    global _store
+    with _store_lock:
+        _store = store
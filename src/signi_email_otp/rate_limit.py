@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from .config import (
+    RATE_LIMIT,
+    RATE_LIMIT_REDIS_URL,
+    RATE_LIMIT_MAX_KEYS,
+    Limit,
+    get_settings,
+)
+from . import metrics
+from .core import logger
+from .exception import RateLimitOTPExceededException
+from .shared import SharedTable
+
+
+class RateLimiter(ABC):
+    """Token buckets addressed by key."""
+
+    enabled = True
+
+    @abstractmethod
+    def acquire(self, buckets: list[tuple[str, Limit]]) -> str | None:
+        """
+        Take a token from each bucket, given as (key, limit) pairs. Returns
+        None if every bucket had one, otherwise the key of the first empty
+        bucket, in which case no token is taken from any of them.
+        """
+
+
+class NullRateLimiter(RateLimiter):
+    """Allows everything, the default."""
+
+    enabled = False
+
+    def acquire(self, buckets: list[tuple[str, Limit]]) -> str | None:
+        return None
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    Buckets kept in process. At most max_keys buckets are kept, the least
+    recently used is dropped first, which at worst refills it early.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        if max_keys <= 0:
+            raise ValueError("max_keys must be a positive integer")
+        self.max_keys = max_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> [tokens, last refill time]
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, buckets: list[tuple[str, Limit]]) -> str | None:
+        with self._lock:
+            now = self._clock()
+            states = []
+            for key, limit in buckets:
+                state = self._buckets.get(key)
+                if state is None:
+                    state = [float(limit.capacity), now]
+                else:
+                    self._buckets.move_to_end(key)
+                    state[0] = min(
+                        limit.capacity, state[0] + (now - state[1]) * limit.rate
+                    )
+                    state[1] = now
+                if state[0] < 1:
+                    return key
+                states.append((key, state))
+            for key, state in states:
+                state[0] -= 1
+                self._buckets[key] = state
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return None
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Buckets kept in a shared.SharedTable, so every process forked from
+    the one that created the table, e.g. the signi-otp-server workers,
+    draws on the same buckets. A full table drops the least recently used
+    bucket among those its new key may replace, which refills it early.
+    """
+
+    def __init__(self, table: SharedTable, clock=time.monotonic):
+        self.table = table
+        self._clock = clock
+
+    def __len__(self):
+        return len(self.table)
+
+    def acquire(self, buckets: list[tuple[str, Limit]]) -> str | None:
+        table = self.table
+        with table.lock:
+            now = self._clock()
+            levels = []
+            for key, limit in buckets:
+                state = table.get(key)
+                level = float(limit.capacity)
+                if state is not None:
+                    level = min(level, state[0] + (now - state[1]) * limit.rate)
+                if level < 1:
+                    return key
+                levels.append((key, level))
+            for key, level in levels:
+                table.set(key, level - 1, now)
+        return None
+
+
+# Refill and check every bucket in KEYS against ARGV (capacity, rate per
+# second pairs) using the server clock, then take a token from each. Returns
+# the 1-based index of the first empty bucket, or 0.
+REDIS_ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local levels = {}
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local level = capacity
+    if state[1] then
+        local refill = (now - tonumber(state[2])) * rate
+        level = math.min(capacity, tonumber(state[1]) + refill)
+    end
+    if level < 1 then
+        return i
+    end
+    levels[i] = level
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local level = tostring(levels[i] - 1)
+    redis.call('HSET', KEYS[i], 'tokens', level, 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate * 1000))
+end
+return 0
+"""
+
+
+def redis_script_args(key_prefix: str, buckets: list[tuple[str, Limit]]):
+    """KEYS and ARGV for REDIS_ACQUIRE_SCRIPT."""
+    keys = [f"{key_prefix}{key}" for key, _ in buckets]
+    args: list[int | str] = []
+    for _, limit in buckets:
+        args.extend((limit.capacity, repr(limit.rate)))
+    return keys, args
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Buckets kept in a Redis-protocol server and shared by every node. Each
+    acquire is one server-side script using the server clock, and idle
+    buckets expire once they would be full again. Requires the optional
+    redis client package.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        url: str = RATE_LIMIT_REDIS_URL,
+        key_prefix: str = "signi_email_otp:rate:",
+    ):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.key_prefix = key_prefix
+        self._acquire = client.register_script(REDIS_ACQUIRE_SCRIPT)
+        client.script_load(REDIS_ACQUIRE_SCRIPT)
+
+    def acquire(self, buckets: list[tuple[str, Limit]]) -> str | None:
+        if not buckets:
+            return None
+        keys, args = redis_script_args(self.key_prefix, buckets)
+        empty = int(self._acquire(keys=keys, args=args))
+        return buckets[empty - 1][0] if empty else None
+
+
+def otp_request_buckets(
+    email: str, client_ip: str | None = None, settings=None
+) -> list[tuple[str, Limit]]:
+    """
+    The buckets an OTP request for email from client_ip draws on, limited
+    by the RATE_LIMIT_IP, RATE_LIMIT_DOMAIN and RATE_LIMIT_EMAIL settings.
+    """
+    settings = settings or get_settings()
+    ip_limit = settings.rate_limit_ip
+    domain_limit = settings.rate_limit_domain
+    email_limit = settings.rate_limit_email
+    email = email.strip().lower()
+    buckets = []
+    if client_ip and ip_limit:
+        buckets.append((f"ip:{client_ip}", ip_limit))
+    if domain_limit and "@" in email:
+        buckets.append((f"domain:{email.rpartition('@')[2]}", domain_limit))
+    if email_limit:
+        buckets.append((f"email:{email}", email_limit))
+    return buckets
+
+
+def rate_limited(email: str, key: str) -> RateLimitOTPExceededException:
+    """Count a rejected request and return the exception to raise."""
+    # Debug only, rejections are expected in bulk under abuse.
+    logger.debug("OTP request for %s rejected by rate limit %s", email, key)
+    metrics.increment("otp_rate_limited_total", bucket=key.partition(":")[0])
+    return RateLimitOTPExceededException(
+        "Too many OTP requests. Please try again later."
+    )
+
+
+def check_otp_request(email: str, client_ip: str | None = None):
+    """
+    Take a token for an OTP request from the IP, domain and email buckets.
+    Raises RateLimitOTPExceededException if any of them is empty.
+    """
+    limiter = get_rate_limiter()
+    if not limiter.enabled:
+        return
+    key = limiter.acquire(otp_request_buckets(email, client_ip))
+    if key is not None:
+        raise rate_limited(email, key)
+
+
+_LIMITER_BACKENDS = {
+    "none": NullRateLimiter,
+    "memory": MemoryRateLimiter,
+    "redis": RedisRateLimiter,
+}
+
+_limiter: RateLimiter | None = None
+_limiter_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _limiter_lock
+    _limiter_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def create_rate_limiter(backend: str = RATE_LIMIT, **kwargs) -> RateLimiter:
+    """Build the rate limiter for the named backend: none, memory or redis."""
+    try:
+        limiter_class = _LIMITER_BACKENDS[backend.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unknown rate limit backend {backend!r}, "
+            f"expected one of {sorted(_LIMITER_BACKENDS)}"
+        ) from None
+    return limiter_class(**kwargs)
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process wide rate limiter selected by the RATE_LIMIT setting."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = create_rate_limiter()
+                logger.info("Using %s for OTP rate limiting", type(_limiter).__name__)
+    return _limiter
+
+
+def set_rate_limiter(limiter: RateLimiter | None):
+    """Replace the process wide rate limiter, None reverts to the configured one."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
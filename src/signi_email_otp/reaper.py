@@ -0,0 +1,146 @@
+import argparse
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy import delete, select
+
+from .config import (
+    REAPER_INTERVAL_SECONDS,
+    REAPER_BATCH_SIZE,
+    get_settings,
+    install_reload_handler,
+)
+from .core import logger
+from .db import get_dbs
+from .log import configure_logging
+from .models import OTP, JWT
+
+
+@dataclass
+class SweepResult:
+    """Outcome of a single reaper sweep."""
+
+    otp_deleted: int = 0
+    jwt_deleted: int = 0
+    duration_seconds: float = 0.0
+
+
+def _delete_batch(column, cutoff: datetime, batch_size: int, get_session) -> int:
+    """
+    Delete up to batch_size rows whose column is older than cutoff.
+    Each batch runs in its own short transaction, and rows locked by
+    concurrent writers are skipped rather than waited on.
+    """
+    model = column.class_
+    ids = (
+        select(model.id)
+        .where(column < cutoff)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    with get_session() as session:
+        result = session.execute(
+            delete(model).where(model.id.in_(ids)),
+            execution_options={"synchronize_session": False},
+        )
+        return result.rowcount
+
+
+def _delete_expired(column, cutoff: datetime, batch_size: int) -> int:
+    """Delete expired rows from the database, or from every shard."""
+    total = 0
+    for get_session in get_dbs():
+        while True:
+            deleted = _delete_batch(column, cutoff, batch_size, get_session)
+            total += deleted
+            if deleted < batch_size:
+                break
+    return total
+
+
+def sweep_expired(batch_size: int = REAPER_BATCH_SIZE, now=None) -> SweepResult:
+    """
+    Delete expired OTP and refresh token rows in batches of batch_size.
+    OTPs expire OTP_EXPIRY_SECONDS after creation, refresh tokens at expires_at.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be a positive integer")
+    now = now or datetime.now(timezone.utc)
+    started = time.perf_counter()
+    result = SweepResult()
+    otp_cutoff = now - timedelta(seconds=get_settings().otp_expiry_seconds)
+    result.otp_deleted = _delete_expired(OTP.created_at, otp_cutoff, batch_size)
+    result.jwt_deleted = _delete_expired(JWT.expires_at, now, batch_size)
+    result.duration_seconds = time.perf_counter() - started
+    logger.info(
+        "Reaper sweep removed %s OTPs and %s refresh tokens in %.3fs",
+        result.otp_deleted,
+        result.jwt_deleted,
+        result.duration_seconds,
+    )
+    return result
+
+
+class Reaper(threading.Thread):
+    """
+    Background thread that periodically removes expired OTP and refresh
+    token rows, keeping the delete off the request hot path.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float = REAPER_INTERVAL_SECONDS,
+        batch_size: int = REAPER_BATCH_SIZE,
+    ):
+        super().__init__(name="signi-email-otp-reaper", daemon=True)
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.last_result: SweepResult | None = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.last_result = sweep_expired(self.batch_size)
+            except Exception as e:
+                logger.error("Reaper sweep failed: %s", e)
+            self._stop_event.wait(self.interval_seconds)
+
+    def stop(self, timeout: float | None = None):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Remove expired OTP and refresh token rows."
+    )
+    parser.add_argument("--interval", type=float, default=REAPER_INTERVAL_SECONDS)
+    parser.add_argument("--batch-size", type=int, default=REAPER_BATCH_SIZE)
+    parser.add_argument(
+        "--once", action="store_true", help="Run a single sweep and exit."
+    )
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    if args.once:
+        sweep_expired(args.batch_size)
+        return
+    if hasattr(signal, "SIGHUP"):
+        install_reload_handler()
+    reaper = Reaper(args.interval, args.batch_size)
+    reaper.start()
+    try:
+        while reaper.is_alive():
+            reaper.join(1)
+    except KeyboardInterrupt:
+        reaper.stop()
+
+
+if __name__ == "__main__":
+    main()
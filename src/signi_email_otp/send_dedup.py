@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from .config import (
+    OTP_EXPIRY_SECONDS,
+    OTP_RESEND_CACHE_SIZE,
+    OTP_RESEND_WINDOW_SECONDS,
+)
+from . import metrics
+from .core import logger
+from .shared import SharedTable
+
+# Outcomes of an OTP email request
+QUEUED = "queued"
+COALESCED = "coalesced"
+
+# Seconds a send claimed in a SharedRecentSends is assumed in flight, so a
+# worker dying mid-send does not hold the email for longer.
+SEND_CLAIM_SECONDS = 30.0
+
+# A send is not remembered past the expiry of the OTP it carried.
+RESEND_WINDOW_SECONDS = min(OTP_RESEND_WINDOW_SECONDS, OTP_EXPIRY_SECONDS)
+
+
+class RecentSends:
+    """
+    Emails an OTP email was queued for, each remembered for window_seconds,
+    at most maxsize of them, the oldest dropped first. Thread safe.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = RESEND_WINDOW_SECONDS,
+        maxsize: int = OTP_RESEND_CACHE_SIZE,
+        clock=time.monotonic,
+    ):
+        self.window_seconds = window_seconds
+        self.maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sent_at: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self):
+        return len(self._sent_at)
+
+    def __contains__(self, email: str) -> bool:
+        with self._lock:
+            sent_at = self._sent_at.get(email)
+            if sent_at is None:
+                return False
+            if self._clock() - sent_at < self.window_seconds:
+                return True
+            del self._sent_at[email]
+            return False
+
+    def add(self, email: str):
+        if self.window_seconds <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._sent_at[email] = self._clock()
+            self._sent_at.move_to_end(email)
+            while len(self._sent_at) > self.maxsize:
+                self._sent_at.popitem(last=False)
+
+    def claim(self, email: str) -> bool:
+        """
+        Whether a send for email may start. Sends in this process are
+        single flighted by SendCoalescer, so only recent ones are refused.
+        """
+        return email not in self
+
+    def discard(self, email: str):
+        """Forget a claim whose send failed, or a send whose OTP is gone."""
+        with self._lock:
+            self._sent_at.pop(email, None)
+
+
+class SharedRecentSends:
+    """
+    RecentSends kept in a shared.SharedTable, so signi-otp-server workers
+    coalesce sends for an email across processes. A claimed send counts as
+    recent in every worker until it is added or discarded, or for
+    SEND_CLAIM_SECONDS; requests elsewhere are coalesced with it meanwhile
+    and are not told if it fails. A full table drops the entry claimed or
+    sent first among those a new email may replace.
+    """
+
+    def __init__(
+        self,
+        table: SharedTable,
+        window_seconds: float = RESEND_WINDOW_SECONDS,
+        clock=time.time,
+    ):
+        self.table = table
+        self.window_seconds = window_seconds
+        self._clock = clock
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, email: str) -> bool:
+        with self.table.lock:
+            state = self.table.get(email)
+        return state is not None and state[0] > self._clock()
+
+    def claim(self, email: str) -> bool:
+        now = self._clock()
+        with self.table.lock:
+            state = self.table.get(email)
+            if state is not None and state[0] > now:
+                return False
+            self.table.set(email, now + SEND_CLAIM_SECONDS, now)
+            return True
+
+    def add(self, email: str):
+        now = self._clock()
+        with self.table.lock:
+            if self.window_seconds > 0:
+                self.table.set(email, now + self.window_seconds, now)
+            else:
+                self.table.delete(email)
+
+    def discard(self, email: str):
+        with self.table.lock:
+            self.table.delete(email)
+
+
+class _Flight:
+    """A send in progress, which requests arriving meanwhile wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error: BaseException | None = None
+
+
+class SendCoalescer:
+    """
+    Lets one OTP email request per email through at a time. Requests
+    arriving while one is in flight wait for it, and requests within
+    OTP_RESEND_WINDOW_SECONDS after it queued an email return at once.
+    Both are coalesced: they issue no code and queue no email, since the
+    code was just sent and each resend uses up one of its requests.
+    Waiting requests get the in-flight request's exception if it failed.
+    forget is called once the OTP may be gone, e.g. verified or locked
+    out, so the next request issues and sends a new one.
+    Emails are matched exactly, as the OTP store matches them. Per process,
+    unless recent is a SharedRecentSends.
+    """
+
+    def __init__(self, recent: RecentSends | SharedRecentSends | None = None):
+        self.recent = recent if recent is not None else RecentSends()
+        self._lock = threading.Lock()
+        self._flights: dict[str, _Flight] = {}
+
+    def run(self, email: str, send: Callable[[], None]) -> str:
+        """Call send() for email unless coalesced, returning QUEUED or COALESCED."""
+        with self._lock:
+            waiting_for = self._flights.get(email)
+            if waiting_for is None:
+                if not self.recent.claim(email):
+                    return _coalesced(email)
+                flight = self._flights[email] = _Flight()
+        if waiting_for is not None:
+            waiting_for.done.wait()
+            if waiting_for.error is not None:
+                raise waiting_for.error
+            return _coalesced(email)
+        try:
+            send()
+            self.recent.add(email)
+        except BaseException as e:
+            flight.error = e
+            self.recent.discard(email)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[email]
+            flight.done.set()
+        metrics.increment("otp_emails_total", outcome=QUEUED)
+        return QUEUED
+
+    def forget(self, email: str):
+        """Stop coalescing requests for email with the send before."""
+        self.recent.discard(email)
+
+
+def _coalesced(email: str) -> str:
+    logger.info("OTP email for %s coalesced with the previous request", email)
+    metrics.increment("otp_emails_total", outcome=COALESCED)
+    return COALESCED
+
+
+_coalescer: SendCoalescer | None = None
+_coalescer_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _coalescer_lock
+    _coalescer_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_send_coalescer() -> SendCoalescer:
+    """Return the process wide SendCoalescer."""
+    global _coalescer
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = SendCoalescer()
+    return _coalescer
+
+
+def set_send_coalescer(coalescer: SendCoalescer | None):
+    """Replace the process wide SendCoalescer, None reverts to a new one."""
+    global _coalescer
+    with _coalescer_lock:
+        _coalescer = coalescer
@@ -0,0 +1,345 @@
+import argparse
+import importlib
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from socketserver import ThreadingMixIn
+from typing import Callable
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import jwt
+
+from . import auth, db, tokens
+from .config import (
+    SERVER_DB_CONNECTIONS,
+    SERVER_SHARED_SLOTS,
+    SERVER_WORKERS,
+    get_settings,
+    install_reload_handler,
+)
+from .core import logger
+from .exception import (
+    EmailQueueFullException,
+    RateLimitOTPExceededException,
+    RefreshTokenRevokedException,
+    signiEmailOTPException,
+)
+from .log import configure_logging
+from .otp_store import SharedLockoutCache, SQLOTPStore, set_otp_store
+from .rate_limit import SharedRateLimiter, set_rate_limiter
+from .send_dedup import SendCoalescer, SharedRecentSends, set_send_coalescer
+from .shared import SharedTable
+
+# A worker exiting sooner than this after it was forked is restarted only
+# after waiting as long, so a worker failing on startup does not spin.
+MIN_WORKER_SECONDS = 1.0
+
+# First match wins, other exceptions are internal errors.
+_ERROR_STATUSES = [
+    (RateLimitOTPExceededException, "429 Too Many Requests"),
+    (EmailQueueFullException, "503 Service Unavailable"),
+    (RefreshTokenRevokedException, "401 Unauthorized"),
+    (jwt.InvalidTokenError, "401 Unauthorized"),
+    (signiEmailOTPException, "400 Bad Request"),
+]
+
+
+def _request_otp(client_ip, email):
+    outcome = auth.request_otp_and_send_email(email, client_ip)
+    return "202 Accepted", {"status": outcome}
+
+
+def _verify_otp(client_ip, email, otp):
+    return "200 OK", {"refresh_token": auth.verify_otp(email, otp)}
+
+
+def _refresh_token(client_ip, refresh_token):
+    return "200 OK", {"refresh_token": tokens.rotate(refresh_token)}
+
+
+# Path -> (JSON body fields, handler)
+ROUTES: dict[str, tuple[tuple[str, ...], Callable[..., tuple[str, dict]]]] = {
+    "/otp/request": (("email",), _request_otp),
+    "/otp/verify": (("email", "otp"), _verify_otp),
+    "/token/refresh": (("refresh_token",), _refresh_token),
+}
+
+
+def _handle(environ) -> tuple[str, dict]:
+    route = ROUTES.get(environ.get("PATH_INFO", ""))
+    if route is None:
+        return "404 Not Found", {"detail": "Not found"}
+    if environ["REQUEST_METHOD"] != "POST":
+        return "405 Method Not Allowed", {"detail": "Method not allowed"}
+    fields, handler = route
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = json.loads(environ["wsgi.input"].read(length) or b"{}")
+    except ValueError:
+        body = None
+    if not isinstance(body, dict) or not all(
+        isinstance(body.get(f), str) for f in fields
+    ):
+        return "400 Bad Request", {"detail": f"Expected a JSON object with {fields}"}
+    try:
+        return handler(environ.get("REMOTE_ADDR"), *(body[f] for f in fields))
+    except Exception as e:
+        for error_class, status in _ERROR_STATUSES:
+            if isinstance(e, error_class):
+                return status, {"detail": str(e)}
+        logger.exception("Request to %s failed", environ["PATH_INFO"])
+        return "500 Internal Server Error", {"detail": "Internal error"}
+
+
+def application(environ, start_response):
+    """
+    WSGI app for the OTP flow. Every route takes a POST of a JSON object:
+    /otp/request {email} emails an OTP, /otp/verify {email, otp} and
+    /token/refresh {refresh_token} return {refresh_token}. Errors return
+    {detail}.
+    """
+    status, payload = _handle(environ)
+    body = json.dumps(payload).encode()
+    start_response(
+        status,
+        [("Content-Type", "application/json"), ("Content-Length", str(len(body)))],
+    )
+    return [body]
+
+
+def worker_pool_size(db_connections: int, workers: int) -> int:
+    """Pool size per worker that keeps workers within db_connections."""
+    if db_connections < workers:
+        raise ValueError(
+            f"{db_connections} database connections cannot be shared "
+            f"by {workers} workers"
+        )
+    return db_connections // workers
+
+
+class _RequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class _WorkerServer(ThreadingMixIn, WSGIServer):
+    """WSGIServer accepting on a socket the supervisor bound before forking."""
+
+    # server_close waits for requests in flight.
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, sock: socket.socket, app):
+        host, port = sock.getsockname()[:2]
+        super().__init__((host, port), _RequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_name, self.server_port = host, port
+        self.setup_environ()
+        self.set_app(app)
+
+
+class PreforkServer:
+    """
+    Serves a WSGI app from workers forked off this process, which all
+    accept on one listening socket. Workers share the RATE_LIMIT=memory
+    buckets, the SQL store's lockout cache and the emails OTP sends are
+    coalesced for through shared.SharedTable, whose locks are released
+    again when a worker is killed holding one. With db_connections set,
+    each worker's pools are sized through db.set_pool_budget so the
+    workers together hold at most db_connections per database. Exited
+    workers are replaced until stop is called.
+    """
+
+    def __init__(
+        self,
+        app=application,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        workers: int = SERVER_WORKERS,
+        db_connections: int = SERVER_DB_CONNECTIONS,
+        shared_slots: int = SERVER_SHARED_SLOTS,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.db_connections = db_connections
+        self.shared_slots = shared_slots
+        self.address: tuple[str, int] | None = None
+        self._socket: socket.socket | None = None
+        self._rate_table: SharedTable | None = None
+        self._lockout_table: SharedTable | None = None
+        self._send_table: SharedTable | None = None
+        self._pool_budget: int | None = None
+        # pid -> time.monotonic() when forked
+        self._pids: dict[int, float] = {}
+        self._stopping = False
+
+    def start(self):
+        """Bind the socket, set up the shared state and fork the workers."""
+        settings = get_settings()
+        if settings.otp_store == "memory" and self.workers > 1:
+            raise ValueError(
+                "OTP_STORE=memory is not shared between workers, use sql or redis"
+            )
+        if self.db_connections:
+            self._pool_budget = worker_pool_size(self.db_connections, self.workers)
+            logger.info(
+                "Each of %s workers may open %s connections per database",
+                self.workers,
+                self._pool_budget,
+            )
+        self._rate_table = SharedTable(self.shared_slots)
+        self._lockout_table = SharedTable(self.shared_slots)
+        self._send_table = SharedTable(self.shared_slots)
+        self._socket = socket.create_server((self.host, self.port), backlog=1024)
+        # Every worker selects on the socket, the ones losing the race for a
+        # connection must not block in accept.
+        self._socket.setblocking(False)
+        self.address = self._socket.getsockname()[:2]
+        for _ in range(self.workers):
+            self._spawn()
+        logger.info("Serving on %s:%s with %s workers", *self.address, self.workers)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._run_worker()
+                status = 0
+            except BaseException:
+                logger.exception("Worker %s failed", os.getpid())
+            finally:
+                os._exit(status)
+        self._pids[pid] = time.monotonic()
+
+    def _run_worker(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if get_settings().log_queue:
+            # The listener thread was not forked along.
+            configure_logging()
+        if self._pool_budget:
+            # Also rebuilds the engines created before the fork.
+            db.set_pool_budget(self._pool_budget)
+        set_rate_limiter(
+            SharedRateLimiter(self._rate_table)
+            if get_settings().rate_limit == "memory"
+            else None
+        )
+        if get_settings().otp_store == "sql":
+            set_otp_store(SQLOTPStore(lockouts=SharedLockoutCache(self._lockout_table)))
+        set_send_coalescer(SendCoalescer(SharedRecentSends(self._send_table)))
+        server = _WorkerServer(self._socket, self.app)
+
+        def shutdown(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        if hasattr(signal, "SIGHUP"):
+            install_reload_handler()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    def _recover_shared_state(self):
+        """Free the table locks a killed worker may have held."""
+        for table in (self._rate_table, self._lockout_table, self._send_table):
+            if table is not None and table.recover():
+                logger.warning("Released a shared table lock held by a dead worker")
+
+    def _signal_workers(self, signum):
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """
+        Supervise the workers until SIGTERM or SIGINT, then stop them.
+        SIGHUP is passed on to the workers, which reload their settings.
+        """
+
+        def stop(signum, frame):
+            self._stopping = True
+            self._signal_workers(signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(
+                signal.SIGHUP, lambda signum, frame: self._signal_workers(signum)
+            )
+        while self._pids:
+            pid, status = os.wait()
+            started = self._pids.pop(pid, None)
+            if os.WIFSIGNALED(status):
+                self._recover_shared_state()
+            if started is None or self._stopping:
+                continue
+            logger.warning("Worker %s exited with status %s, restarting", pid, status)
+            lived = time.monotonic() - started
+            if lived < MIN_WORKER_SECONDS:
+                time.sleep(MIN_WORKER_SECONDS - lived)
+            if not self._stopping:
+                self._spawn()
+        self._socket.close()
+
+    def stop(self):
+        """Stop the workers, letting requests in flight finish."""
+        self._stopping = True
+        self._signal_workers(signal.SIGTERM)
+        for pid in list(self._pids):
+            os.waitpid(pid, 0)
+            del self._pids[pid]
+        self._socket.close()
+
+
+def load_app(path: str):
+    """Import a WSGI app given as module:attribute."""
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "application")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the OTP flow over HTTP.")
+    parser.add_argument(
+        "--app",
+        default="signi_email_otp.server:application",
+        help="WSGI app to serve, as module:attribute.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=SERVER_WORKERS, help="0 for one per CPU."
+    )
+    parser.add_argument(
+        "--db-connections",
+        type=int,
+        default=SERVER_DB_CONNECTIONS,
+        help="Connections all workers may hold per database, 0 for no cap.",
+    )
+    parser.add_argument("--shared-slots", type=int, default=SERVER_SHARED_SLOTS)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    server = PreforkServer(
+        load_app(args.app),
+        args.host,
+        args.port,
+        args.workers,
+        args.db_connections,
+        args.shared_slots,
+    )
+    server.start()
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import hashlib
+from dataclasses import dataclass, field
+
+from sqlalchemy import delete, select
+
+from .config import DB_SHARD_URLS
+from .core import logger
+from .models import OTP, JWT
+
+# Tables whose rows live on the shard of their email.
+SHARDED_TABLES = (OTP.__table__, JWT.__table__)
+
+
+def parse_shard_urls(value: str = DB_SHARD_URLS) -> dict[str, str]:
+    """
+    Parse a comma separated list of name=url shards, in order. An entry
+    without a name is called shard<position>. Raises ValueError for a
+    repeated name.
+    """
+    shards: dict[str, str] = {}
+    for position, entry in enumerate(e.strip() for e in value.split(",")):
+        if not entry:
+            continue
+        name, sep, url = entry.partition("=")
+        if not sep or "://" in name:
+            name, url = f"shard{position}", entry
+        name = name.strip()
+        if name in shards:
+            raise ValueError(f"Duplicate database shard name {name!r}")
+        shards[name] = url.strip()
+    return shards
+
+
+def _weight(name: str, email: str) -> int:
+    digest = hashlib.blake2b(f"{name}\0{email}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_for(email: str, names) -> str:
+    """
+    Pick the shard for email by rendezvous hashing over the shard names.
+    The choice is stable across processes and hosts, and adding a shard
+    only moves the emails that now pick the new shard.
+    """
+    return max(names, key=lambda name: _weight(name, email))
+
+
+@dataclass
+class RebalanceResult:
+    """Rows moved by rebalance, per table name."""
+
+    moved: dict[str, int] = field(default_factory=dict)
+    skipped: dict[str, int] = field(default_factory=dict)
+
+
+def _move_batch(source, targets, table, rows, result: RebalanceResult):
+    """Copy rows to their target shards, then delete them from source."""
+    by_target: dict[str, list] = {}
+    for target, row in rows:
+        by_target.setdefault(target, []).append(row)
+    for target, batch in by_target.items():
+        with targets[target].begin() as conn:
+            existing = set(
+                conn.execute(
+                    select(table.c.email).where(
+                        table.c.email.in_([row["email"] for row in batch])
+                    )
+                ).scalars()
+            )
+            # A row already on the target was written there after the shard
+            # list changed, so it is newer than ours.
+            copies = [
+                {k: v for k, v in row.items() if k != "id"}
+                for row in batch
+                if row["email"] not in existing
+            ]
+            if copies:
+                conn.execute(table.insert(), copies)
+        result.moved[table.name] = result.moved.get(table.name, 0) + len(copies)
+        result.skipped[table.name] = (
+            result.skipped.get(table.name, 0) + len(batch) - len(copies)
+        )
+    with source.begin() as conn:
+        conn.execute(
+            delete(table).where(table.c.id.in_([row["id"] for _, row in rows]))
+        )
+
+
+def rebalance(
+    shard_urls: dict[str, str],
+    retired_urls: dict[str, str] | None = None,
+    batch_size: int = 500,
+) -> RebalanceResult:
+    """
+    Move otp and refresh_tokens rows to the shard their email maps to under
+    shard_urls, e.g. after adding a shard. Every row is moved off the
+    retired_urls shards. Run it once every node uses the new shard list:
+    rows are copied in batches of batch_size and then deleted, and a row
+    the target already has for an email is kept over the moved one.
+    """
+    from .db import _get_engine, initialize_schema
+
+    if batch_size <= 0:
+        raise ValueError("batch_size must be a positive integer")
+    retired_urls = retired_urls or {}
+    if set(shard_urls) & set(retired_urls):
+        raise ValueError("Retired shards need names of their own")
+    engines = {
+        name: _get_engine(url, f"shard:{name}")
+        for name, url in {**shard_urls, **retired_urls}.items()
+    }
+    result = RebalanceResult()
+    try:
+        for name in shard_urls:
+            initialize_schema(engines[name])
+        for name, source in engines.items():
+            for table in SHARDED_TABLES:
+                last_id = 0
+                while True:
+                    with source.connect() as conn:
+                        rows = (
+                            conn.execute(
+                                select(table)
+                                .where(table.c.id > last_id)
+                                .order_by(table.c.id)
+                                .limit(batch_size)
+                            )
+                            .mappings()
+                            .all()
+                        )
+                    if not rows:
+                        break
+                    last_id = rows[-1]["id"]
+                    moving = [
+                        (target, row)
+                        for row in rows
+                        if (target := shard_for(row["email"], shard_urls)) != name
+                    ]
+                    if moving:
+                        _move_batch(source, engines, table, moving, result)
+    finally:
+        for engine in engines.values():
+            engine.dispose()
+    logger.info(
+        "Rebalanced shards %s, moved %s rows, kept %s newer target rows",
+        list(shard_urls),
+        result.moved,
+        result.skipped,
+    )
+    return result
+
+
+def main(argv=None):
+    from .log import configure_logging
+
+    parser = argparse.ArgumentParser(
+        description="Move OTP and refresh token rows to their database shard."
+    )
+    parser.add_argument(
+        "--shards",
+        default=DB_SHARD_URLS,
+        help="Comma separated name=url shards, defaults to DB_SHARD_URLS.",
+    )
+    parser.add_argument(
+        "--retired",
+        default="",
+        help="Comma separated name=url shards to move every row off.",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    shards = parse_shard_urls(args.shards)
+    if not shards:
+        parser.error("no shards given, set DB_SHARD_URLS or pass --shards")
+    result = rebalance(shards, parse_shard_urls(args.retired), args.batch_size)
+    print(result.moved)
+
+
+if __name__ == "__main__":
+    main()
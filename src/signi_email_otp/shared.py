@@ -0,0 +1,94 @@
+import hashlib
+import mmap
+import multiprocessing
+import struct
+
+# Key hash, then two values whose meaning is up to the user of the table.
+_SLOT = struct.Struct("<Qdd")
+_EMPTY = 0
+# Far longer than any holder of a table lock keeps it.
+LOCK_TIMEOUT_SECONDS = 1.0
+
+
+class SharedTable:
+    """
+    Fixed size hash table from string keys to pairs of floats, in an
+    anonymous memory mapping that processes forked after it was created
+    share, e.g. the workers of signi-otp-server. Keys are stored as 64 bit
+    hashes. A key lives in one of PROBES slots after its hash; when they
+    are all taken, the slot with the smallest second value is replaced, so
+    the table never grows. Callers hold lock around get, set and delete,
+    and around anything that must see a consistent table.
+    """
+
+    PROBES = 8
+
+    def __init__(self, slots: int, lock=None):
+        if slots <= 0:
+            raise ValueError("slots must be a positive integer")
+        self.slots = slots
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+        self._memory = mmap.mmap(-1, slots * _SLOT.size)
+
+    def recover(self, timeout: float = LOCK_TIMEOUT_SECONDS) -> bool:
+        """
+        Release lock if it stays held for timeout, as it does after a
+        process was killed while holding it. For the process reaping a dead
+        one. Returns whether the lock was released.
+        """
+        if self.lock.acquire(timeout=timeout):
+            self.lock.release()
+            return False
+        self.lock.release()
+        return True
+
+    def __len__(self):
+        with self.lock:
+            return sum(
+                1
+                for (key_hash, _, _) in _SLOT.iter_unpack(self._memory)
+                if key_hash != _EMPTY
+            )
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def _window(self, key_hash: int):
+        start = key_hash % self.slots
+        for i in range(min(self.PROBES, self.slots)):
+            yield (start + i) % self.slots * _SLOT.size
+
+    def _find(self, key_hash: int) -> int | None:
+        for offset in self._window(key_hash):
+            if _SLOT.unpack_from(self._memory, offset)[0] == key_hash:
+                return offset
+        return None
+
+    def get(self, key: str) -> tuple[float, float] | None:
+        offset = self._find(self._hash(key))
+        if offset is None:
+            return None
+        return _SLOT.unpack_from(self._memory, offset)[1:]
+
+    def set(self, key: str, first: float, second: float):
+        key_hash = self._hash(key)
+        offset = self._find(key_hash)
+        if offset is None:
+            offset = min(
+                self._window(key_hash),
+                key=lambda o: _victim_order(_SLOT.unpack_from(self._memory, o)),
+            )
+        _SLOT.pack_into(self._memory, offset, key_hash, first, second)
+
+    def delete(self, key: str):
+        offset = self._find(self._hash(key))
+        if offset is not None:
+            _SLOT.pack_into(self._memory, offset, _EMPTY, 0.0, 0.0)
+
+
+def _victim_order(slot) -> tuple[bool, float]:
+    """Sort key for replacement: empty slots, then the smallest second value."""
+    key_hash, _, second = slot
+    return key_hash != _EMPTY, second
@@ -0,0 +1,267 @@
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Iterator
+
+from .config import (
+    SMTP_POOL_SIZE,
+    SMTP_POOL_MAX_MESSAGES,
+    SMTP_TIMEOUT,
+)
+from . import metrics
+from .core import logger
+
+
+class SMTPPoolTimeoutError(TimeoutError):
+    """No pooled SMTP session became free within the pool's timeout."""
+
+
+def _is_disconnect(error: BaseException) -> bool:
+    """
+    Whether error means the session is dead, as opposed to the server
+    rejecting a command (smtplib errors are OSErrors too) or the pool
+    having no session to hand out.
+    """
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(
+        error, (smtplib.SMTPException, SMTPPoolTimeoutError)
+    )
+
+
+class _SMTP(smtplib.SMTP):
+    """smtplib.SMTP noting whether DATA was sent for the current message."""
+
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class _SMTP_SSL(_SMTP, smtplib.SMTP_SSL):
+    pass
+
+
+@dataclass
+class SMTPPoolStats:
+    """Counters describing how an SMTPConnectionPool has been used."""
+
+    checkouts: int = 0
+    hits: int = 0
+    connects: int = 0
+    reconnects: int = 0
+    messages_sent: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+class _PooledConnection:
+    def __init__(self, smtp: _SMTP):
+        self.smtp = smtp
+        self.messages_sent = 0
+
+
+class SMTPConnectionPool:
+    """
+    Keeps up to size authenticated SMTP sessions open to one relay.
+    Idle sessions are checked with NOOP before reuse and replaced after
+    max_messages messages, or as soon as the server drops them.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str | None = None,
+        password: str | None = None,
+        size: int = SMTP_POOL_SIZE,
+        max_messages: int = SMTP_POOL_MAX_MESSAGES,
+        use_ssl: bool = True,
+        timeout: float = SMTP_TIMEOUT,
+    ):
+        if size <= 0:
+            raise ValueError("size must be a positive integer")
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.max_messages = max_messages
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self._idle: list[_PooledConnection] = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = SMTPPoolStats()
+
+    def stats(self) -> SMTPPoolStats:
+        """Return a snapshot of the pool counters."""
+        with self._lock:
+            return replace(self._stats)
+
+    def _connect(self) -> _PooledConnection:
+        smtp_class = _SMTP_SSL if self.use_ssl else _SMTP
+        with metrics.timer("smtp_connect_seconds"):
+            smtp = smtp_class(self.host, self.port, timeout=self.timeout)
+            try:
+                if self.password:
+                    smtp.login(self.username, self.password)
+            except Exception:
+                smtp.close()
+                raise
+        with self._lock:
+            self._stats.connects += 1
+        return _PooledConnection(smtp)
+
+    def _discard(self, conn: _PooledConnection):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    def _is_alive(self, conn: _PooledConnection) -> bool:
+        try:
+            return conn.smtp.noop()[0] == 250
+        except OSError:
+            return False
+
+    def _acquire(self) -> _PooledConnection:
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise SMTPPoolTimeoutError(
+                f"Timed out waiting for an SMTP connection to {self.host}"
+            )
+        waited = time.perf_counter() - started
+        metrics.observe("smtp_pool_wait_seconds", waited)
+        try:
+            with self._lock:
+                self._stats.checkouts += 1
+                self._stats.wait_seconds += waited
+                self._stats.max_wait_seconds = max(self._stats.max_wait_seconds, waited)
+                conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                if self._is_alive(conn):
+                    with self._lock:
+                        self._stats.hits += 1
+                    return conn
+                logger.info("Idle SMTP connection to %s lost, reconnecting", self.host)
+                conn.smtp.close()
+                with self._lock:
+                    self._stats.reconnects += 1
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn: _PooledConnection | None):
+        try:
+            if conn is None:
+                return
+            if conn.messages_sent >= self.max_messages:
+                self._discard(conn)
+                return
+            with self._lock:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[_PooledConnection]:
+        """
+        Check out an authenticated session. A session that fails with a
+        connection error is closed instead of being returned to the pool.
+        """
+        conn = self._acquire()
+        dropped = False
+        try:
+            yield conn
+        except OSError as e:
+            dropped = _is_disconnect(e)
+            if dropped:
+                conn.smtp.close()
+            raise
+        finally:
+            self._release(None if dropped else conn)
+
+    def send(self, email_from: str, to_addrs: list[str], message: str):
+        """
+        Send message over a pooled session, reconnecting once if the server
+        dropped the session while it was checked out and before DATA was
+        sent. Once DATA is under way the server may have taken the message,
+        and sending it again could deliver it twice.
+        """
+        for attempt in (1, 2):
+            smtp: _SMTP | None = None
+            try:
+                with self.connection() as conn, metrics.timer("smtp_send_seconds"):
+                    smtp = conn.smtp
+                    smtp.data_started = False
+                    smtp.sendmail(email_from, to_addrs, message)
+                    conn.messages_sent += 1
+                with self._lock:
+                    self._stats.messages_sent += 1
+                return
+            except OSError as e:
+                if attempt == 2 or not _is_disconnect(e):
+                    raise
+                if smtp is not None and smtp.data_started:
+                    raise
+                logger.info("SMTP connection to %s dropped, reconnecting", self.host)
+                with self._lock:
+                    self._stats.reconnects += 1
+
+    def close(self):
+        """Close every idle session."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+_pools: dict[tuple, SMTPConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_smtp_pool(
+    host: str,
+    port: int,
+    username: str | None,
+    password: str | None,
+    use_ssl: bool = True,
+) -> SMTPConnectionPool:
+    """Return the shared pool for a relay and set of credentials."""
+    key = (host, int(port), username, password, use_ssl)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = SMTPConnectionPool(
+                    host, int(port), username, password, use_ssl=use_ssl
+                )
+                _pools[key] = pool
+    return pool
+
+
+def _reset_after_fork():
+    # The sessions are shared with the parent, leave them to it.
+    global _pools, _pools_lock
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def close_smtp_pools():
+    """Close the idle sessions of every shared pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
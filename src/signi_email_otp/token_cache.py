@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .config import JWT_CACHE_SIZE, JWT_CACHE_TTL_SECONDS
+from .models import JWT
+
+
+@dataclass
+class TokenCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    size: int = 0
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified token claims, keyed by token.
+    Entries expire after ttl seconds and never later than the token's exp
+    claim, so an expired token is always verified (and rejected) again.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = JWT_CACHE_SIZE,
+        ttl: float = JWT_CACHE_TTL_SECONDS,
+        clock=time.time,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = TokenCacheStats()
+
+    def get(self, token: str, secret, algorithm: str) -> dict | None:
+        """Return the cached claims for token verified with secret and algorithm."""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                expires_at, entry_secret, entry_algorithm, claims = entry
+                if (
+                    expires_at > self._clock()
+                    and entry_secret == secret
+                    and entry_algorithm == algorithm
+                ):
+                    self._entries.move_to_end(token)
+                    self._stats.hits += 1
+                    return dict(claims)
+                del self._entries[token]
+            self._stats.misses += 1
+            return None
+
+    def put(self, token: str, secret, algorithm: str, claims: dict):
+        if self.maxsize <= 0:
+            return
+        expires_at = self._clock() + self.ttl
+        if "exp" in claims:
+            expires_at = min(expires_at, claims["exp"])
+        with self._lock:
+            self._entries[token] = (expires_at, secret, algorithm, dict(claims))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+    def invalidate(self, token: str):
+        with self._lock:
+            if self._entries.pop(token, None) is not None:
+                self._stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> TokenCacheStats:
+        with self._lock:
+            return TokenCacheStats(
+                self._stats.hits,
+                self._stats.misses,
+                self._stats.evictions,
+                self._stats.invalidations,
+                len(self._entries),
+            )
+
+
+# Shared cache, kept consistent with deletes from the refresh_tokens table.
+token_cache = TokenCache()
+
+
+@event.listens_for(JWT, "after_delete")
+def _invalidate_deleted_token(mapper, connection, target):
+    token_cache.invalidate(target.refresh_token)
+
+
+@event.listens_for(JWT, "after_update")
+def _invalidate_replaced_token(mapper, connection, target):
+    for token in inspect(target).attrs.refresh_token.history.deleted:
+        token_cache.invalidate(token)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_bulk_changes(orm_execute_state):
+    # Bulk statements do not say which rows they touched, drop everything.
+    if (orm_execute_state.is_delete or orm_execute_state.is_update) and any(
+        mapper.class_ is JWT for mapper in orm_execute_state.all_mappers
+    ):
+        token_cache.clear()
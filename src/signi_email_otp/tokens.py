@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import hmac
+from datetime import datetime, timedelta, timezone
+from typing import TypeGuard
+
+from sqlalchemy import delete, func, select
+
+from .config import get_settings
+from .core import logger
+from .db import get_db, get_dbs
+from .exception import RefreshTokenRevokedException
+from .keys import get_key_manager
+from .models import JWT, as_utc
+
+# Primary keys covered by each revocation statement, see _revoke_where.
+REVOKE_BATCH_SIZE = 10000
+
+
+def token_digest(token: str) -> str:
+    """Short digest identifying a replaced token in JWT.rotated_digests."""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+def push_digest(
+    rotated_digests: str | None, token: str, replaced_at: datetime | None = None
+) -> str:
+    """
+    The rotated_digests history with token's digest and the time it was
+    replaced (default: now) added first, keeping the newest
+    JWT_ROTATION_HISTORY entries.
+    """
+    replaced_at = replaced_at or datetime.now(timezone.utc)
+    history = [f"{token_digest(token)}:{int(replaced_at.timestamp())}"]
+    history.extend(d for d in (rotated_digests or "").split(",") if d)
+    return ",".join(history[: get_settings().jwt_rotation_history])
+
+
+def replaced_at(rotated_digests: str | None, token: str) -> datetime | None:
+    """
+    When token was replaced according to the rotated_digests history, or
+    None if it is not in it. Entries stored without a time count as
+    replaced at the epoch.
+    """
+    digest = token_digest(token)
+    for entry in (rotated_digests or "").split(","):
+        entry_digest, _, timestamp = entry.partition(":")
+        if entry_digest == digest:
+            return datetime.fromtimestamp(int(timestamp or 0), timezone.utc)
+    return None
+
+
+def reusable(jwt_obj: JWT | None, now: datetime | None = None) -> TypeGuard[JWT]:
+    """
+    Whether the stored token can be handed out again: it exists and does
+    not expire within JWT_RENEW_BEFORE_SECONDS.
+    """
+    if jwt_obj is None:
+        return False
+    now = now or datetime.now(timezone.utc)
+    renew_before = timedelta(seconds=get_settings().jwt_renew_before_seconds)
+    return as_utc(jwt_obj.expires_at) > now + renew_before
+
+
+def store_new_token(email: str, jwt_obj: JWT | None) -> JWT:
+    """
+    Sign a new refresh token for email into jwt_obj, or into a new row if
+    it is None, and return the row to add to the session. The replaced
+    token is remembered in the row's history of JWT_ROTATION_HISTORY
+    digests.
+    """
+    settings = get_settings()
+    token, expires_at = get_key_manager().generate_jwt(
+        email, settings.jwt_expiry_seconds
+    )
+    now = datetime.now(timezone.utc)
+    if jwt_obj is None:
+        return JWT(
+            email=email, refresh_token=token, created_at=now, expires_at=expires_at
+        )
+    jwt_obj.rotated_digests = push_digest(
+        jwt_obj.rotated_digests, jwt_obj.refresh_token, now
+    )
+    jwt_obj.refresh_token = token
+    jwt_obj.created_at = now
+    jwt_obj.expires_at = expires_at
+    return jwt_obj
+
+
+def login_token(session, email: str) -> str:
+    """
+    The refresh token to hand out to email at login: the stored one while
+    it is reusable, otherwise a new one stored in its place. session must
+    be on the email's database, see db.get_db.
+    """
+    jwt_obj = session.query(JWT).filter_by(email=email).first()
+    if reusable(jwt_obj):
+        logger.info("JWT already exists for %s, reusing it.", email)
+        return jwt_obj.refresh_token
+    if jwt_obj is None:
+        logger.info("No JWT found for %s, generating a new one.", email)
+    else:
+        logger.info("JWT for %s expires soon, replacing it.", email)
+    jwt_obj = store_new_token(email, jwt_obj)
+    session.add(jwt_obj)
+    return jwt_obj.refresh_token
+
+
+def rotate(token: str) -> str:
+    """
+    Exchange a refresh token for a new one. A token replaced less than
+    JWT_ROTATION_GRACE_SECONDS ago gets the current token instead, so
+    concurrent refreshes rotate it only once. A replaced token presented
+    later is treated as stolen: the email's refresh token is revoked.
+    Raises jwt.InvalidTokenError if token does not verify, and
+    RefreshTokenRevokedException if it was revoked or replaced.
+    """
+    email = get_key_manager().decode_jwt(token)["email"]
+    with get_db(email) as session:
+        jwt_obj = session.query(JWT).filter_by(email=email).with_for_update().first()
+        if jwt_obj is None:
+            reused = False
+        elif hmac.compare_digest(jwt_obj.refresh_token, token):
+            logger.info("Rotating refresh token for %s", email)
+            return store_new_token(email, jwt_obj).refresh_token
+        elif (rotated := replaced_at(jwt_obj.rotated_digests, token)) is None:
+            reused = False
+        else:
+            grace = timedelta(seconds=get_settings().jwt_rotation_grace_seconds)
+            if datetime.now(timezone.utc) <= rotated + grace:
+                logger.info("Refresh token for %s was rotated, returning it", email)
+                return jwt_obj.refresh_token
+            session.delete(jwt_obj)
+            reused = True
+    if reused:
+        logger.warning("Replaced refresh token of %s reused, revoking it", email)
+    else:
+        logger.warning("Refresh token for %s is revoked", email)
+    raise RefreshTokenRevokedException()
+
+
+def _revoke_where(condition, batch_size: int) -> int:
+    """
+    Delete the refresh tokens matching condition from every database. Each
+    statement covers a range of batch_size primary keys, so statements stay
+    short and the table is read once, whether or not condition is indexed.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be a positive integer")
+    total = 0
+    for get_session in get_dbs():
+        with get_session() as session:
+            first_id, last_id = session.execute(
+                select(func.min(JWT.id), func.max(JWT.id))
+            ).one()
+        if first_id is None:
+            continue
+        for start in range(first_id - 1, last_id, batch_size):
+            with get_session() as session:
+                total += session.execute(
+                    delete(JWT).where(
+                        JWT.id > start, JWT.id <= start + batch_size, condition
+                    ),
+                    execution_options={"synchronize_session": False},
+                ).rowcount
+    return total
+
+
+def revoke_email(email: str) -> int:
+    """Revoke the refresh token of email, returning the number revoked."""
+    with get_db(email) as session:
+        revoked = session.execute(
+            delete(JWT).where(JWT.email == email),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+    logger.info("Revoked %s refresh tokens of %s", revoked, email)
+    return revoked
+
+
+def revoke_domain(domain: str, batch_size: int = REVOKE_BATCH_SIZE) -> int:
+    """Revoke the refresh tokens of every email at domain."""
+    escaped = domain.lower().replace("\\", "\\\\").replace("%", "\\%")
+    escaped = escaped.replace("_", "\\_")
+    revoked = _revoke_where(
+        func.lower(JWT.email).like(f"%@{escaped}", escape="\\"), batch_size
+    )
+    logger.info("Revoked %s refresh tokens at %s", revoked, domain)
+    return revoked
+
+
+def revoke_issued_before(cutoff: datetime, batch_size: int = REVOKE_BATCH_SIZE) -> int:
+    """Revoke every refresh token issued before cutoff, e.g. after a breach."""
+    revoked = _revoke_where(JWT.created_at < cutoff, batch_size)
+    logger.info("Revoked %s refresh tokens issued before %s", revoked, cutoff)
+    return revoked
+
+
+def main(argv=None):
+    from .log import configure_logging
+
+    parser = argparse.ArgumentParser(description="Revoke refresh tokens.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--email")
+    target.add_argument("--domain")
+    target.add_argument(
+        "--issued-before",
+        type=datetime.fromisoformat,
+        help="ISO 8601 timestamp, UTC unless it has an offset.",
+    )
+    parser.add_argument("--batch-size", type=int, default=REVOKE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    if args.email:
+        print(revoke_email(args.email))
+    elif args.domain:
+        print(revoke_domain(args.domain, args.batch_size))
+    else:
+        cutoff = args.issued_before
+        if cutoff.tzinfo is None:
+            cutoff = cutoff.replace(tzinfo=timezone.utc)
+        print(revoke_issued_before(cutoff, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
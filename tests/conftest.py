@@ -0,0 +1,171 @@
+import os
+import socket
+import socketserver
+import threading
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from signi_email_otp.models import Base
+
+
+@pytest.fixture
+def sqlite_engine():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def sqlite_get_db(sqlite_engine):
+    """A drop-in replacement for db.get_db bound to an in-memory SQLite db."""
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=sqlite_engine)
+
+    @contextmanager
+    def get_db(email=None):
+        session = factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    return get_db
+
+
+@pytest.fixture
+def run_forked():
+    """Run a function in a forked child process and check that it succeeded."""
+    if not hasattr(os, "fork"):
+        pytest.skip("needs os.fork")
+
+    def run(func):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                func()
+                status = 0
+            finally:
+                os._exit(status)
+        assert os.waitpid(pid, 0)[1] == 0
+
+    return run
+
+
+@pytest.fixture
+def redis_server():
+    """A local Redis-protocol stand-in server."""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    server = fakeredis.TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    yield f"redis://{host}:{port}/0"
+    server.shutdown()
+    server.server_close()
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    A minimal debugging SMTP server that accepts any login and keeps the
+    messages it receives in memory.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+        self._sockets = set()
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def disconnect_all(self):
+        """Drop every open client connection, as a relay restart would."""
+        with self._lock:
+            sockets, self._sockets = self._sockets, set()
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server._lock:
+            server.connections += 1
+            server._sockets.add(self.connection)
+        self._reply("220 localhost test SMTP")
+        mail_from, rcpts = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN\r\n250 OK\r\n")
+            elif verb == "HELO":
+                self._reply("250 localhost")
+            elif verb == "AUTH":
+                self._reply("235 Authentication successful")
+            elif verb == "MAIL":
+                mail_from, rcpts = command.split(":", 1)[1].strip(), []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                rcpts.append(command.split(":", 1)[1].strip())
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(line.decode().replace("\r\n", "\n"))
+                with server._lock:
+                    failing = server.fail_next > 0
+                    if failing:
+                        server.fail_next -= 1
+                    else:
+                        server.messages.append((mail_from, rcpts, "".join(data)))
+                self._reply("451 Try again later" if failing else "250 OK")
+            elif verb in ("NOOP", "RSET"):
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+@pytest.fixture
+def smtp_server():
+    server = LocalSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.disconnect_all()
+    server.server_close()
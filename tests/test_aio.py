@@ -0,0 +1,177 @@
+import asyncio
+from contextlib import asynccontextmanager
+from email import message_from_string
+from unittest.mock import patch
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from signi_email_otp import aio  # noqa: E402
+from signi_email_otp.aio import otp_store as aio_store  # noqa: E402
+from signi_email_otp.aio.email_service import send_otp_email  # noqa: E402
+from signi_email_otp.exception import (  # noqa: E402
+    InvalidOTPException,
+    OTPAttemptsExceededException,
+    RateLimitOTPExceededException,
+)
+from signi_email_otp.migrations import upgrade  # noqa: E402
+
+EMAIL = "user@example.com"
+
+
+async def _async_get_db():
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.connect() as conn:
+        await conn.run_sync(upgrade)
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def get_db():
+        async with factory() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    return engine, get_db
+
+
+@pytest.fixture
+def run_with_sqlite():
+    """Run a coroutine with the aio API bound to an in-memory SQLite db."""
+
+    def run(test):
+        async def main():
+            engine, get_db = await _async_get_db()
+            aio_store.set_otp_store(aio_store.AsyncSQLOTPStore(get_db))
+            try:
+                with patch("signi_email_otp.aio.auth.get_db", get_db):
+                    return await test()
+            finally:
+                aio_store.set_otp_store(None)
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_async_request_and_verify(run_with_sqlite):
+    async def test():
+        await aio.request_otp(EMAIL)
+        # A second request resends the first OTP.
+        otp = await aio.request_otp(EMAIL)
+        with pytest.raises(InvalidOTPException):
+            await aio.verify_otp(EMAIL, "not-the-otp")
+        token = await aio.verify_otp(EMAIL, otp)
+        assert await aio.verify_otp(EMAIL, await aio.request_otp(EMAIL)) == token
+
+    run_with_sqlite(test)
+
+
+def test_async_rate_limit(run_with_sqlite):
+    async def test():
+        for _ in range(4):
+            await aio.request_otp(EMAIL)
+        with pytest.raises(RateLimitOTPExceededException):
+            await aio.request_otp(EMAIL)
+
+    run_with_sqlite(test)
+
+
+def test_async_verify_lockout(run_with_sqlite):
+    async def test():
+        otp = await aio.request_otp(EMAIL)
+        store = aio_store.get_otp_store()
+        for _ in range(store.max_verify_attempts - 1):
+            with pytest.raises(InvalidOTPException):
+                await aio.verify_otp(EMAIL, "not-the-otp")
+        with pytest.raises(OTPAttemptsExceededException):
+            await aio.verify_otp(EMAIL, "not-the-otp")
+        with pytest.raises(OTPAttemptsExceededException):
+            await aio.verify_otp(EMAIL, otp)
+        assert len(store.lockouts) == 1
+
+    run_with_sqlite(test)
+
+
+def test_async_concurrent_requests(run_with_sqlite):
+    async def test():
+        emails = [f"user{i}@example.com" for i in range(50)]
+        otps = await asyncio.gather(*(aio.request_otp(email) for email in emails))
+        assert len(otps) == 50
+        assert all(otp.isdigit() for otp in otps)
+
+    run_with_sqlite(test)
+
+
+def test_async_memory_store():
+    store = aio_store.create_otp_store("memory")
+
+    async def test():
+        otp = await store.issue(EMAIL, "123456")
+        await store.consume(EMAIL, otp)
+
+    asyncio.run(test())
+
+
+def test_async_send_otp_email(smtp_server):
+    pytest.importorskip("aiosmtplib")
+    asyncio.run(
+        send_otp_email(
+            "127.0.0.1",
+            smtp_server.port,
+            "noreply@example.com",
+            "secret",
+            EMAIL,
+            "Your code",
+            "123456",
+            use_tls=False,
+        )
+    )
+    [(_, rcpts, data)] = smtp_server.messages
+    assert rcpts == [f"<{EMAIL}>"]
+    assert message_from_string(data)["Subject"] == "Your code"
+
+
+def test_async_init_migrates_and_warms_up(tmp_path):
+    from signi_email_otp.aio import db as aio_db
+    from signi_email_otp.migrations import HEAD_VERSION, current_version
+
+    async def main():
+        await aio_db.init(warmup_connections=2)
+        try:
+            assert aio_db._engine.sync_engine.pool.checkedin() == 2
+            async with aio_db._engine.connect() as conn:
+                assert await conn.run_sync(current_version) == HEAD_VERSION
+        finally:
+            await aio_db.dispose()
+
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    url = f"sqlite+aiosqlite:///{tmp_path / 'aio.db'}"
+    # aiosqlite defaults to NullPool for files, which takes no pool options.
+    options = {"poolclass": AsyncAdaptedQueuePool, "pool_size": 2}
+    with (
+        patch("signi_email_otp.aio.db.ASYNC_DB_URL", url),
+        patch("signi_email_otp.aio.db.pool_options", return_value=options),
+    ):
+        asyncio.run(main())
+
+
+def test_async_init_refuses_shards():
+    from signi_email_otp.aio import db as aio_db
+
+    with patch("signi_email_otp.db.DB_SHARD_URLS", "a=sqlite://"):
+        with pytest.raises(ValueError, match="DB_SHARD_URLS"):
+            asyncio.run(aio_db.init(warmup_connections=0))
@@ -3,24 +3,33 @@ from unittest.mock import patch, MagicMock
 from datetime import datetime, timedelta, timezone
 
 from signi_email_otp import auth
+from signi_email_otp.config import get_settings
 from signi_email_otp.auth import RateLimitOTPExceededException
+from signi_email_otp.exception import EmailQueueFullException
 from signi_email_otp.models import OTP
+from signi_email_otp.otp_hash import get_otp_hasher
+from signi_email_otp.send_dedup import QUEUED, SendCoalescer
 
 EMAIL = "user@example.com"
 
 
+def _hash(code):
+    return get_otp_hasher().hash(EMAIL, code)
+
+
 @pytest.fixture
 def mock_session():
     return MagicMock()
 
 
-@patch("signi_email_otp.auth.get_db")
-@patch("signi_email_otp.auth.random.randint")
-def test_request_otp_new(mock_randint, mock_get_db):
-    mock_randint.return_value = 123456
+@patch("signi_email_otp.otp_store.get_db")
+@patch("signi_email_otp.auth.generate_otp")
+def test_request_otp_new(mock_generate_otp, mock_get_db):
+    mock_generate_otp.return_value = "123456"
     mock_session = MagicMock()
     # Simulate no existing OTP
-    mock_session.query.return_value.filter_by.return_value.first.return_value = None
+    locked_query = mock_session.query.return_value.filter_by.return_value
+    locked_query.with_for_update.return_value.first.return_value = None
     mock_get_db.return_value.__enter__.return_value = mock_session
 
     otp = auth.request_otp(EMAIL)
@@ -29,43 +38,78 @@ def test_request_otp_new(mock_randint, mock_get_db):
     assert mock_session.add.called
 
 
-@patch("signi_email_otp.auth.get_db")
-@patch("signi_email_otp.auth.random.randint")
-def test_request_otp_reuse_valid(mock_randint, mock_get_db):
-    mock_randint.return_value = 654321
+@patch("signi_email_otp.otp_store.get_db")
+@patch("signi_email_otp.auth.generate_otp")
+def test_request_otp_reuses_valid(mock_generate_otp, mock_get_db):
+    mock_generate_otp.return_value = "654321"
     mock_session = MagicMock()
     created_at = datetime.now(timezone.utc) - timedelta(seconds=10)
     otp_obj = OTP(
         email=EMAIL,
-        otp_code="111111",
+        otp_hash=_hash("111111"),
+        otp_sealed=get_otp_hasher().seal(EMAIL, "111111"),
         created_at=created_at,
         used=False,
         attempts_left=2,
+        verify_attempts_left=5,
     )
-    mock_session.query.return_value.filter_by.return_value.first.return_value = otp_obj
+    locked_query = mock_session.query.return_value.filter_by.return_value
+    locked_query.with_for_update.return_value.first.return_value = otp_obj
     mock_get_db.return_value.__enter__.return_value = mock_session
 
     otp = auth.request_otp(EMAIL)
     assert otp == "111111"
-    # Should not add a new OTP object, just reuse
+    # Should resend the code, keeping its expiry
+    assert not mock_session.add.called
+    assert otp_obj.otp_hash == _hash("111111")
+    assert otp_obj.created_at == created_at
+    assert otp_obj.attempts_left == 1
+
+
+@patch("signi_email_otp.otp_store.get_db")
+@patch("signi_email_otp.auth.generate_otp")
+def test_request_otp_replaces_valid_unsealed(mock_generate_otp, mock_get_db):
+    mock_generate_otp.return_value = "654321"
+    mock_session = MagicMock()
+    created_at = datetime.now(timezone.utc) - timedelta(seconds=10)
+    otp_obj = OTP(
+        email=EMAIL,
+        otp_hash=_hash("111111"),
+        created_at=created_at,
+        used=False,
+        attempts_left=2,
+        verify_attempts_left=5,
+    )
+    locked_query = mock_session.query.return_value.filter_by.return_value
+    locked_query.with_for_update.return_value.first.return_value = otp_obj
+    mock_get_db.return_value.__enter__.return_value = mock_session
+
+    otp = auth.request_otp(EMAIL)
+    assert otp == "654321"
+    # Stored before seals, so the code is replaced, keeping its expiry
+    assert not mock_session.add.called
+    assert otp_obj.otp_hash == _hash("654321")
+    assert otp_obj.created_at == created_at
+    assert otp_obj.attempts_left == 1
 
 
-@patch("signi_email_otp.auth.get_db")
-@patch("signi_email_otp.auth.random.randint")
-def test_request_otp_expired(mock_randint, mock_get_db):
-    mock_randint.return_value = 222222
+@patch("signi_email_otp.otp_store.get_db")
+@patch("signi_email_otp.auth.generate_otp")
+def test_request_otp_expired(mock_generate_otp, mock_get_db):
+    mock_generate_otp.return_value = "222222"
     mock_session = MagicMock()
     created_at = datetime.now(timezone.utc) - timedelta(
-        seconds=auth.OTP_EXPIRY_SECONDS + 10
+        seconds=get_settings().otp_expiry_seconds + 10
     )
     otp_obj = OTP(
         email=EMAIL,
-        otp_code="333333",
+        otp_hash=_hash("333333"),
         created_at=created_at,
         used=False,
         attempts_left=2,
     )
-    mock_session.query.return_value.filter_by.return_value.first.return_value = otp_obj
+    locked_query = mock_session.query.return_value.filter_by.return_value
+    locked_query.with_for_update.return_value.first.return_value = otp_obj
     mock_get_db.return_value.__enter__.return_value = mock_session
 
     otp = auth.request_otp(EMAIL)
@@ -73,30 +117,174 @@ def test_request_otp_expired(mock_randint, mock_get_db):
     # Should update the existing OTP object
 
 
-@patch("signi_email_otp.auth.get_db")
-@patch("signi_email_otp.auth.random.randint")
-def test_request_otp_rate_limit(mock_randint, mock_get_db):
-    mock_randint.return_value = 444444
+@patch("signi_email_otp.otp_store.get_db")
+@patch("signi_email_otp.auth.generate_otp")
+def test_request_otp_rate_limit(mock_generate_otp, mock_get_db):
+    mock_generate_otp.return_value = "444444"
     mock_session = MagicMock()
     created_at = datetime.now(timezone.utc) - timedelta(seconds=10)
     otp_obj = OTP(
         email=EMAIL,
-        otp_code="444444",
+        otp_hash=_hash("444444"),
         created_at=created_at,
         used=False,
         attempts_left=0,
     )
-    mock_session.query.return_value.filter_by.return_value.first.return_value = otp_obj
+    locked_query = mock_session.query.return_value.filter_by.return_value
+    locked_query.with_for_update.return_value.first.return_value = otp_obj
     mock_get_db.return_value.__enter__.return_value = mock_session
 
     with pytest.raises(RateLimitOTPExceededException):
         auth.request_otp(EMAIL)
 
 
-@patch("signi_email_otp.auth.send_otp_email")
+@patch("signi_email_otp.auth.get_send_coalescer", SendCoalescer)
+@patch("signi_email_otp.auth.enqueue_email")
 @patch("signi_email_otp.auth.request_otp")
-def test_request_otp_and_send_email(mock_request_otp, mock_send_otp_email):
+def test_request_otp_and_send_email(mock_request_otp, mock_enqueue_email):
     mock_request_otp.return_value = "999999"
-    auth.request_otp_and_send_email(EMAIL)
-    mock_request_otp.assert_called_once_with(EMAIL)
-    mock_send_otp_email.assert_called_once_with(EMAIL, "999999")
+    assert auth.request_otp_and_send_email(EMAIL) == QUEUED
+    mock_request_otp.assert_called_once_with(EMAIL, None)
+    mock_enqueue_email.assert_called_once_with(
+        EMAIL,
+        get_settings().otp_email_subject,
+        get_settings().otp_email_body.format(otp="999999"),
+    )
+
+
+@pytest.fixture
+def sqlite_auth(sqlite_get_db):
+    with (
+        patch("signi_email_otp.otp_store.get_db", sqlite_get_db),
+        patch("signi_email_otp.auth.get_db", sqlite_get_db),
+    ):
+        yield sqlite_get_db
+
+
+def _otp_row(get_db):
+    with get_db() as session:
+        otp_obj = session.query(OTP).filter_by(email=EMAIL).one()
+        return otp_obj.otp_hash, otp_obj.attempts_left
+
+
+@patch("signi_email_otp.auth.generate_otp")
+def test_request_otp_upsert_new_and_resend(mock_generate_otp, sqlite_auth):
+    mock_generate_otp.side_effect = ["123456", "654321"]
+
+    assert auth.request_otp(EMAIL) == "123456"
+    assert _otp_row(sqlite_auth) == (_hash("123456"), 3)
+
+    assert auth.request_otp(EMAIL) == "123456"
+    assert _otp_row(sqlite_auth) == (_hash("123456"), 2)
+
+
+@patch("signi_email_otp.auth.generate_otp")
+def test_request_otp_upsert_replaces_unsealed(mock_generate_otp, sqlite_auth):
+    mock_generate_otp.return_value = "654321"
+    with sqlite_auth() as session:
+        session.add(OTP(email=EMAIL, otp_hash=_hash("111111"), attempts_left=3))
+
+    assert auth.request_otp(EMAIL) == "654321"
+    assert _otp_row(sqlite_auth) == (_hash("654321"), 2)
+
+
+@patch("signi_email_otp.auth.generate_otp")
+def test_request_otp_upsert_rotates_expired(mock_generate_otp, sqlite_auth):
+    mock_generate_otp.return_value = "222222"
+    created_at = datetime.now(timezone.utc) - timedelta(
+        seconds=get_settings().otp_expiry_seconds + 10
+    )
+    with sqlite_auth() as session:
+        session.add(
+            OTP(
+                email=EMAIL,
+                otp_hash=_hash("333333"),
+                created_at=created_at,
+                attempts_left=0,
+            )
+        )
+
+    assert auth.request_otp(EMAIL) == "222222"
+    assert _otp_row(sqlite_auth) == (_hash("222222"), 3)
+
+
+def test_request_otp_upsert_rate_limit(sqlite_auth):
+    with sqlite_auth() as session:
+        session.add(OTP(email=EMAIL, otp_hash=_hash("444444"), attempts_left=0))
+
+    with pytest.raises(RateLimitOTPExceededException):
+        auth.request_otp(EMAIL)
+    assert _otp_row(sqlite_auth) == (_hash("444444"), 0)
+
+
+@patch("signi_email_otp.auth.generate_otp")
+def test_verify_otp_issues_and_reuses_jwt(mock_generate_otp, sqlite_auth):
+    mock_generate_otp.return_value = "123456"
+
+    otp = auth.request_otp(EMAIL)
+    with pytest.raises(auth.InvalidOTPException):
+        auth.verify_otp(EMAIL, "000000")
+    token = auth.verify_otp(EMAIL, otp)
+    with pytest.raises(auth.OTPNotFoundException):
+        auth.verify_otp(EMAIL, otp)
+
+    assert auth.verify_otp(EMAIL, auth.request_otp(EMAIL)) == token
+
+
+@patch("signi_email_otp.auth.enqueue_email")
+def test_request_after_verify_is_not_coalesced(mock_enqueue_email, sqlite_auth):
+    def request():
+        outcome = auth.request_otp_and_send_email(EMAIL)
+        body = mock_enqueue_email.call_args.args[2]
+        return outcome, body.rsplit(" ", 1)[1]
+
+    with patch("signi_email_otp.auth.get_send_coalescer", return_value=SendCoalescer()):
+        outcome, otp = request()
+        assert outcome == QUEUED
+        token = auth.verify_otp(EMAIL, otp)
+        outcome, otp = request()
+        assert outcome == QUEUED
+        assert auth.verify_otp(EMAIL, otp) == token
+
+    assert mock_enqueue_email.call_count == 2
+
+
+def test_request_otp_batch(sqlite_auth):
+    for _ in range(4):
+        auth.request_otp("limited@example.com")
+    auth.request_otp("resent@example.com")
+    emails = (f"user{i}@example.com" for i in range(5))
+
+    chunks = list(
+        auth.request_otp_batch(
+            ["limited@example.com", "resent@example.com", *emails], chunk_size=3
+        )
+    )
+
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    results = {email: otp for chunk in chunks for email, otp in chunk.items()}
+    limited = results.pop("limited@example.com")
+    assert isinstance(limited, RateLimitOTPExceededException)
+    assert all(otp.isdigit() for otp in results.values())
+    with sqlite_auth() as session:
+        assert session.query(OTP).count() == 7
+    auth.verify_otp("resent@example.com", results["resent@example.com"])
+
+
+def test_request_otp_batch_repeated_email(sqlite_auth):
+    [results] = auth.request_otp_batch([EMAIL] * 5)
+
+    assert isinstance(results[EMAIL], RateLimitOTPExceededException)
+    assert _otp_row(sqlite_auth)[1] == 0
+
+
+@patch("signi_email_otp.auth.enqueue_email")
+def test_request_otp_batch_sends_email(mock_enqueue_email, sqlite_auth):
+    mock_enqueue_email.side_effect = [None, EmailQueueFullException()]
+
+    [results] = auth.request_otp_batch(
+        ["a@example.com", "b@example.com"], send_email=True
+    )
+
+    assert results["a@example.com"].isdigit()
+    assert isinstance(results["b@example.com"], EmailQueueFullException)
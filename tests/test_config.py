@@ -1,3 +1,8 @@
+import logging
+import os
+import signal
+import time
+
 from signi_email_otp import config
 import pytest
 
@@ -72,3 +77,136 @@ def test_get_env_raises_if_missing_and_no_default(monkeypatch):
     monkeypatch.delenv("TEST_ENV_VAR", raising=False)
     with pytest.raises(KeyError):
         config.get_env("TEST_ENV_VAR")
+
+
+def test_get_env_does_not_log_values(monkeypatch):
+    monkeypatch.setenv("TEST_ENV_VAR", "s3cret")
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    config.logger.addHandler(handler)
+    previous_level = config.logger.level
+    config.logger.setLevel(logging.DEBUG)
+    try:
+        config.get_env("TEST_ENV_VAR")
+    finally:
+        config.logger.removeHandler(handler)
+        config.logger.setLevel(previous_level)
+
+    assert records
+    assert all("s3cret" not in record.getMessage() for record in records)
+
+
+def test_load_settings_parses_types():
+    settings = config.load_settings(
+        {
+            "OTP_EXPIRY_SECONDS": "120",
+            "DB_POOL_TIMEOUT": "2.5",
+            "SMTP_USE_SSL": "no",
+            "RATE_LIMIT_EMAIL": "3/30",
+            "RATE_LIMIT_IP": "",
+            "LOG_LEVEL": "debug",
+            "JWT_SECRET": "jwt-secret",
+        }
+    )
+
+    assert settings.otp_expiry_seconds == 120
+    assert settings.db_pool_timeout == 2.5
+    assert settings.smtp_use_ssl is False
+    assert settings.rate_limit_email == config.Limit(3, 30)
+    assert settings.rate_limit_ip is None
+    assert settings.log_level == "DEBUG"
+    assert settings.rate_limit_redis_url == settings.otp_store_redis_url
+    assert settings.otp_hash_secret == "jwt-secret"
+
+
+def test_load_settings_reports_every_invalid_value():
+    with pytest.raises(ValueError) as excinfo:
+        config.load_settings(
+            {"OTP_EXPIRY_SECONDS": "soon", "SMTP_PORT": "0", "RATE_LIMIT_IP": "5"}
+        )
+
+    message = str(excinfo.value)
+    for name in ("OTP_EXPIRY_SECONDS", "SMTP_PORT", "RATE_LIMIT_IP"):
+        assert name in message
+
+
+def test_parse_limit():
+    assert config.parse_limit("5/60") == config.Limit(5, 60.0)
+    assert config.parse_limit("") is None
+    for value in ("5", "a/60", "0/60", "5/0"):
+        with pytest.raises(ValueError):
+            config.parse_limit(value)
+
+
+def test_config_file_is_overridden_by_environment(tmp_path):
+    config_file = tmp_path / "otp.env"
+    config_file.write_text(
+        "# OTP settings\nOTP_EXPIRY_SECONDS=60\nOTP_EMAIL_SUBJECT='Your code'\n"
+    )
+
+    settings = config.load_settings(
+        {"SIGNI_OTP_CONFIG_FILE": str(config_file), "OTP_EXPIRY_SECONDS": "90"}
+    )
+
+    assert settings.otp_expiry_seconds == 90
+    assert settings.otp_email_subject == "Your code"
+
+
+def test_redacted_hides_secrets():
+    settings = config.load_settings(
+        {
+            "JWT_SECRET": "jwt-secret",
+            "SMTP_PASSWORD": "smtp-secret",
+            "DB_URL": "postgresql://otp:db-secret@db/otp",
+        }
+    )
+
+    text = repr(settings)
+    for secret in ("jwt-secret", "smtp-secret", "db-secret"):
+        assert secret not in text
+    assert settings.redacted()["DB_URL"] == "postgresql://otp:***@db/otp"
+
+
+@pytest.fixture
+def restore_settings():
+    yield
+    config.set_settings(None)
+
+
+def test_reload_applies_only_reloadable_settings(restore_settings):
+    seen = []
+    config.on_reload(lambda old, new: seen.append((old, new)))
+    try:
+        settings = config.reload_settings(
+            {"OTP_EXPIRY_SECONDS": "42", "DB_URL": "sqlite:///other.db"}
+        )
+    finally:
+        config._reload_listeners.pop()
+
+    assert settings is config.get_settings()
+    assert settings.otp_expiry_seconds == 42
+    # Needs a restart.
+    assert settings.db_url == config.DB_URL
+    assert [new.otp_expiry_seconds for _, new in seen] == [42]
+
+
+def test_invalid_reload_keeps_current_settings(restore_settings):
+    current = config.get_settings()
+    with pytest.raises(ValueError):
+        config.reload_settings({"OTP_EXPIRY_SECONDS": "-1"})
+    assert config.get_settings() is current
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGHUP"), reason="requires SIGHUP")
+def test_sighup_reloads_settings(monkeypatch, restore_settings):
+    previous = config.install_reload_handler()
+    monkeypatch.setenv("JWT_EXPIRY_SECONDS", "77")
+    try:
+        os.kill(os.getpid(), signal.SIGHUP)
+        deadline = time.monotonic() + 5
+        while config.get_settings().jwt_expiry_seconds != 77:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        signal.signal(signal.SIGHUP, previous)
@@ -0,0 +1,248 @@
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from signi_email_otp import auth, config, db, metrics, migrations
+from signi_email_otp.config import get_settings
+from signi_email_otp.models import JWT, Base
+from signi_email_otp.otp_store import MemoryOTPStore, set_otp_store
+
+WEEK = 7 * 24 * 3600
+EMAIL = "user@example.com"
+
+
+@pytest.fixture
+def replica(tmp_path):
+    """A second SQLite database standing in for a read replica."""
+    url = f"sqlite:///{tmp_path / 'replica.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with (
+        patch("signi_email_otp.db.DB_REPLICA_URL", url),
+        patch("signi_email_otp.db._ReadSessionLocal", None),
+    ):
+        yield sessionmaker(bind=engine)
+        if db._ReadSessionLocal is not None:
+            db._ReadSessionLocal.kw["bind"].dispose()
+    engine.dispose()
+
+
+@pytest.fixture
+def primary(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+
+    @contextmanager
+    def get_db(email=None):
+        session = factory()
+        try:
+            yield session
+            session.commit()
+        finally:
+            session.close()
+
+    store = MemoryOTPStore()
+    set_otp_store(store)
+    with (
+        patch("signi_email_otp.auth.get_db", get_db),
+        patch("signi_email_otp.db.get_db", get_db),
+    ):
+        yield factory
+    set_otp_store(None)
+    engine.dispose()
+
+
+def _add_token(factory, token, expires_in):
+    now = datetime.now(timezone.utc)
+    with factory() as session:
+        session.add(
+            JWT(
+                email=EMAIL,
+                refresh_token=token,
+                created_at=now,
+                expires_at=now + timedelta(seconds=expires_in),
+            )
+        )
+        session.commit()
+
+
+def _verify():
+    otp = auth.request_otp(EMAIL)
+    return auth.verify_otp(EMAIL, otp)
+
+
+def test_pool_options_follow_settings():
+    settings = replace(
+        get_settings(),
+        db_pool_max_overflow=0,
+        db_pool_pre_ping=True,
+        db_pool_use_lifo=True,
+    )
+
+    options = db.pool_options(settings)
+
+    assert options["max_overflow"] == 0
+    assert options["pool_pre_ping"] is True
+    assert options["pool_use_lifo"] is True
+    assert options["pool_size"] == settings.max_conn
+
+
+def test_get_read_db_without_replica_uses_primary(primary):
+    _add_token(primary, "primary-token", WEEK)
+
+    assert not db.has_read_replica()
+    with db.get_read_db() as session:
+        assert session.query(JWT).one().refresh_token == "primary-token"
+
+
+def test_verify_otp_reuses_token_from_replica(primary, replica):
+    _add_token(replica, "replica-token", WEEK)
+
+    assert _verify() == "replica-token"
+    with primary() as session:
+        assert session.query(JWT).count() == 0
+
+
+def test_verify_otp_falls_back_to_primary_on_replica_miss(primary, replica):
+    # Written to the primary but not replicated yet.
+    _add_token(primary, "primary-token", WEEK)
+
+    assert _verify() == "primary-token"
+
+
+def test_verify_otp_ignores_expired_replica_token(primary, replica):
+    _add_token(replica, "stale-token", -60)
+    _add_token(primary, "primary-token", WEEK)
+
+    assert _verify() == "primary-token"
+
+
+def test_pool_metrics(replica):
+    registry = metrics.MetricsRegistry()
+    metrics.set_metrics_sink(registry)
+    try:
+        with db.get_read_db() as session:
+            session.query(JWT).count()
+            metrics.collect()
+            assert registry.gauge_value("db_pool_checked_out", pool="replica") == 1
+        metrics.collect()
+    finally:
+        metrics.set_metrics_sink(None)
+
+    assert registry.counter("db_pool_checkouts_total", pool="replica") == 1
+    assert registry.counter("db_pool_connects_total", pool="replica") == 1
+    assert registry.gauge_value("db_pool_checked_out", pool="replica") == 0
+    assert registry.histogram("db_connection_wait_seconds", pool="replica")[0] == 1
+
+
+@pytest.fixture
+def fresh_db(tmp_path):
+    """Point db at an empty SQLite file and reset its lazily created state."""
+    url = f"sqlite:///{tmp_path / 'fresh.db'}"
+    with (
+        patch("signi_email_otp.db.DB_URL", url),
+        patch("signi_email_otp.db._SessionLocal", None),
+        patch("signi_email_otp.db._ReadSessionLocal", None),
+    ):
+        yield url
+        if db._SessionLocal is not None:
+            db._SessionLocal.kw["bind"].dispose()
+
+
+def test_concurrent_init_creates_one_engine(fresh_db):
+    start = threading.Barrier(8)
+
+    def first_call():
+        start.wait()
+        db.init()
+
+    with patch("signi_email_otp.db._get_engine", wraps=db._get_engine) as get_engine:
+        threads = [threading.Thread(target=first_call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert get_engine.call_count == 1
+    assert migrations.current_version(db._SessionLocal.kw["bind"]) == (
+        migrations.HEAD_VERSION
+    )
+
+
+def test_init_without_migrate_leaves_schema_alone(fresh_db):
+    db.init(migrate=False)
+
+    engine = db._SessionLocal.kw["bind"]
+    assert migrations.current_version(engine) is None
+    assert not inspect(engine).has_table("otp")
+
+
+def test_warmup_opens_pool_connections(fresh_db):
+    db.init(warmup_connections=3)
+
+    assert db._SessionLocal.kw["bind"].pool.checkedin() == 3
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_forked_child_gets_its_own_pool(fresh_db):
+    db.init(warmup_connections=1)
+    parent_pool = db._SessionLocal.kw["bind"].pool
+
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            with db.get_db() as session:
+                session.query(JWT).count()
+            ok = db._SessionLocal.kw["bind"].pool is not parent_pool
+        finally:
+            os._exit(0 if ok else 1)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    # The parent's connection is still usable.
+    with db.get_db() as session:
+        assert session.query(JWT).count() == 0
+
+
+def test_pool_budget_rebuilds_existing_pools(fresh_db):
+    db.init()
+    old_engine = db._SessionLocal.kw["bind"]
+    try:
+        db.set_pool_budget(2)
+        engine = db._SessionLocal.kw["bind"]
+        assert engine is not old_engine
+        assert engine.pool.size() == 2
+        assert engine.pool._max_overflow == 0
+        # A reload of the pool settings keeps the budget.
+        config.reload_settings({"DB_POOL_MAX_CONN": "7"})
+        assert db._SessionLocal.kw["bind"].pool.size() == 2
+    finally:
+        config.set_settings(None)
+        db.set_pool_budget(None)
+
+    assert db._SessionLocal.kw["bind"].pool.size() == config.get_settings().max_conn
+
+
+def test_reloading_pool_settings_rebuilds_the_pool(fresh_db):
+    db.init()
+    old_engine = db._SessionLocal.kw["bind"]
+    try:
+        config.reload_settings({"DB_POOL_MAX_CONN": "7"})
+    finally:
+        config.set_settings(None)
+
+    engine = db._SessionLocal.kw["bind"]
+    assert engine is not old_engine
+    assert engine.pool.size() == 7
+    assert str(engine.url) == fresh_db
+    with db.get_db() as session:
+        assert session.query(JWT).count() == 0
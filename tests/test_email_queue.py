@@ -0,0 +1,170 @@
+import time
+from email import message_from_string
+
+import pytest
+from sqlalchemy import event
+
+from signi_email_otp.email_queue import (
+    DBEmailQueue,
+    EmailWorkerPool,
+    MemoryEmailQueue,
+    OutboundEmail,
+)
+from signi_email_otp.exception import EmailQueueFullException
+from signi_email_otp.smtp_pool import SMTPConnectionPool
+
+
+def _message(i=0):
+    return OutboundEmail(f"user{i}@example.com", "Your code", f"code {i}")
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def smtp_pool(smtp_server):
+    pool = SMTPConnectionPool("127.0.0.1", smtp_server.port, use_ssl=False)
+    yield pool
+    pool.close()
+
+
+def test_memory_queue_applies_backpressure():
+    queue = MemoryEmailQueue(maxsize=2)
+    queue.put(_message(0))
+    queue.put(_message(1))
+    with pytest.raises(EmailQueueFullException):
+        queue.put(_message(2), timeout=0)
+
+    batch = queue.get_batch(10, timeout=0)
+    # Handed out messages still count until they are acked.
+    with pytest.raises(EmailQueueFullException):
+        queue.put(_message(2), timeout=0)
+    queue.ack(batch)
+    queue.put(_message(2), timeout=0)
+
+
+@pytest.mark.parametrize("db", [False, True], ids=["memory", "db"])
+def test_zero_maxsize_is_unbounded(db, sqlite_get_db):
+    queue = DBEmailQueue(sqlite_get_db, maxsize=0) if db else MemoryEmailQueue(0)
+    for i in range(3):
+        queue.put(_message(i), timeout=0)
+    assert len(queue) == 3
+
+
+def test_memory_queue_delays_retries():
+    queue = MemoryEmailQueue()
+    queue.put(_message())
+    [message] = queue.get_batch(10, timeout=0)
+    queue.retry(message, delay=0.2)
+
+    assert queue.get_batch(10, timeout=0) == []
+    assert queue.get_batch(10, timeout=1) == [message]
+
+
+def test_workers_send_batches_over_one_session(smtp_server, smtp_pool):
+    queue = MemoryEmailQueue()
+    for i in range(20):
+        queue.put(_message(i))
+    workers = EmailWorkerPool(queue, smtp_pool, "noreply@example.com", workers=1)
+    workers.start()
+    try:
+        _wait_for(lambda: workers.stats.sent == 20)
+    finally:
+        workers.stop()
+
+    assert smtp_server.connections == 1
+    message = message_from_string(smtp_server.messages[0][2])
+    assert message["To"] == "user0@example.com"
+    assert message["From"] == "noreply@example.com"
+
+
+def test_workers_retry_transient_failures(smtp_server, smtp_pool):
+    smtp_server.fail_next = 2
+    queue = MemoryEmailQueue()
+    queue.put(_message())
+    workers = EmailWorkerPool(
+        queue, smtp_pool, workers=1, backoff_seconds=0.01, poll_interval=0.05
+    )
+    workers.start()
+    try:
+        _wait_for(lambda: workers.stats.sent == 1)
+    finally:
+        workers.stop()
+
+    assert workers.stats.retried == 2
+    assert len(smtp_server.messages) == 1
+
+
+def test_workers_give_up_after_max_attempts(smtp_server, smtp_pool):
+    smtp_server.fail_next = 1
+    queue = MemoryEmailQueue()
+    queue.put(_message())
+    workers = EmailWorkerPool(queue, smtp_pool, max_attempts=1)
+
+    workers.deliver(queue.get_batch(10, timeout=0))
+
+    assert workers.stats.failed == 1
+    assert len(queue) == 0
+
+
+def test_db_queue_is_durable(sqlite_get_db):
+    queue = DBEmailQueue(sqlite_get_db, maxsize=2, poll_interval=0.01)
+    queue.put(_message(0))
+    queue.put(_message(1))
+    with pytest.raises(EmailQueueFullException):
+        queue.put(_message(2), timeout=0)
+
+    first, second = queue.get_batch(10, timeout=0)
+    assert queue.get_batch(10, timeout=0) == []
+    queue.ack([first])
+    queue.retry(second, delay=0)
+
+    # A new queue over the same table, as after a restart, sees the retry.
+    restarted = DBEmailQueue(sqlite_get_db)
+    [message] = restarted.get_batch(10, timeout=0)
+    assert message.email_to == "user1@example.com"
+    restarted.fail(message)
+    assert len(restarted) == 0
+
+
+def test_db_queue_put_is_one_statement(sqlite_engine, sqlite_get_db):
+    queue = DBEmailQueue(sqlite_get_db, maxsize=1)
+    statements = []
+    event.listen(
+        sqlite_engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement.split()[0]),
+    )
+
+    queue.put(_message(0))
+    with pytest.raises(EmailQueueFullException):
+        queue.put(_message(1), timeout=0)
+    assert statements == ["INSERT", "INSERT"]
+    assert len(queue) == 1
+
+
+def test_db_queue_reclaims_abandoned_messages(sqlite_get_db):
+    queue = DBEmailQueue(sqlite_get_db, visibility_timeout=0)
+    queue.put(_message())
+    [message] = queue.get_batch(10, timeout=0)
+
+    assert queue.get_batch(10, timeout=0)[0].id == message.id
+
+
+def test_db_queue_with_workers(smtp_server, smtp_pool, sqlite_get_db):
+    queue = DBEmailQueue(sqlite_get_db, poll_interval=0.01)
+    for i in range(5):
+        queue.put(_message(i))
+    workers = EmailWorkerPool(queue, smtp_pool, workers=1, poll_interval=0.01)
+    workers.start()
+    try:
+        _wait_for(lambda: workers.stats.sent == 5)
+    finally:
+        workers.stop()
+
+    assert len(queue) == 0
+    assert len(smtp_server.messages) == 5
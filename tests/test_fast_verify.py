@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import event
+
+from signi_email_otp import auth, config, fast_verify, otp_store
+from signi_email_otp.exception import (
+    InvalidOTPException,
+    OTPAttemptsExceededException,
+    OTPExpiredException,
+    OTPNotFoundException,
+)
+from signi_email_otp.models import JWT, OTP
+from signi_email_otp.token_cache import token_cache
+from signi_email_otp.tokens import replaced_at
+
+EMAIL = "user@example.com"
+
+
+@pytest.fixture
+def core_path(sqlite_engine, sqlite_get_db):
+    @contextmanager
+    def get_connection(email=None):
+        with sqlite_engine.begin() as conn:
+            yield conn
+
+    store = otp_store.SQLOTPStore(sqlite_get_db)
+    otp_store.set_otp_store(store)
+    config.set_settings(replace(config.get_settings(), verify_path="core"))
+    try:
+        with (
+            patch("signi_email_otp.fast_verify.get_connection", get_connection),
+            patch("signi_email_otp.auth.get_db", sqlite_get_db),
+        ):
+            yield store
+    finally:
+        config.set_settings(None)
+        otp_store.set_otp_store(None)
+
+
+def _statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement.split()[0])
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def test_verify_consumes_otp_and_reuses_token(core_path, sqlite_engine):
+    token = auth.verify_otp(EMAIL, core_path.issue(EMAIL, "123456"))
+    core_path.issue(EMAIL, "654321")
+    statements = _statements(sqlite_engine)
+
+    assert auth.verify_otp(EMAIL, "654321") == token
+    assert statements == ["DELETE", "SELECT"]
+    with pytest.raises(OTPNotFoundException):
+        auth.verify_otp(EMAIL, "654321")
+
+
+def test_verify_renews_token_due_for_renewal(core_path, sqlite_engine, sqlite_get_db):
+    token = auth.verify_otp(EMAIL, core_path.issue(EMAIL, "123456"))
+    with sqlite_get_db() as session:
+        jwt_obj = session.query(JWT).filter_by(email=EMAIL).one()
+        jwt_obj.expires_at = datetime.now(timezone.utc) + timedelta(minutes=1)
+
+    renewed = auth.verify_otp(EMAIL, core_path.issue(EMAIL, "123456"))
+
+    assert renewed != token
+    with sqlite_get_db() as session:
+        jwt_obj = session.query(JWT).filter_by(email=EMAIL).one()
+        assert jwt_obj.refresh_token == renewed
+        assert replaced_at(jwt_obj.rotated_digests, token) is not None
+
+
+def test_store_keeps_concurrently_renewed_token(core_path, sqlite_engine):
+    token = auth.verify_otp(EMAIL, core_path.issue(EMAIL, "123456"))
+    statements = fast_verify.verify_statements("sqlite")
+    params = {
+        "new_email": EMAIL,
+        "new_token": "new",
+        "new_created_at": datetime.now(timezone.utc),
+        "new_expires_at": datetime.now(timezone.utc),
+        "history": "",
+        "replaced": "not-the-stored-token",
+    }
+
+    with sqlite_engine.begin() as conn:
+        assert conn.execute(statements.store, params).first() is None
+        row = conn.execute(statements.lookup, {"email": EMAIL}).first()
+    assert row.refresh_token == token
+
+
+def test_failed_verify_settles_on_one_connection(
+    core_path, sqlite_engine, sqlite_get_db
+):
+    core_path.issue(EMAIL, "123456")
+    statements = _statements(sqlite_engine)
+
+    with patch.object(core_path, "consume") as consume:
+        with pytest.raises(InvalidOTPException):
+            auth.verify_otp(EMAIL, "000000")
+    consume.assert_not_called()
+    assert statements == ["DELETE", "UPDATE"]
+    with sqlite_get_db() as session:
+        otp_obj = session.query(OTP).filter_by(email=EMAIL).one()
+        assert otp_obj.verify_attempts_left == core_path.max_verify_attempts - 1
+        otp_obj.created_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    with pytest.raises(OTPExpiredException):
+        auth.verify_otp(EMAIL, "123456")
+
+
+def test_failed_verify_locks_out(core_path, sqlite_engine):
+    core_path.issue(EMAIL, "123456")
+    for _ in range(core_path.max_verify_attempts - 1):
+        with pytest.raises(InvalidOTPException):
+            auth.verify_otp(EMAIL, "000000")
+    with pytest.raises(OTPAttemptsExceededException):
+        auth.verify_otp(EMAIL, "000000")
+    statements = _statements(sqlite_engine)
+
+    with pytest.raises(OTPAttemptsExceededException):
+        auth.verify_otp(EMAIL, "123456")
+    assert statements == []
+
+
+def test_renewal_invalidates_cached_token(core_path, sqlite_get_db):
+    token = auth.verify_otp(EMAIL, core_path.issue(EMAIL, "123456"))
+    with sqlite_get_db() as session:
+        jwt_obj = session.query(JWT).filter_by(email=EMAIL).one()
+        jwt_obj.expires_at = datetime.now(timezone.utc) + timedelta(minutes=1)
+
+    with patch.object(token_cache, "invalidate") as invalidate:
+        auth.verify_otp(EMAIL, core_path.issue(EMAIL, "123456"))
+    invalidate.assert_called_once_with(token)
+
+
+def test_statements_are_built_once():
+    assert fast_verify.verify_statements("sqlite") is fast_verify.verify_statements(
+        "sqlite"
+    )
+    assert fast_verify.verify_statements("mysql") is None
+
+
+def test_unknown_verify_path_is_rejected():
+    config.set_settings(replace(config.get_settings(), verify_path="raw"))
+    try:
+        with pytest.raises(ValueError):
+            fast_verify.enabled(otp_store.MemoryOTPStore())
+    finally:
+        config.set_settings(None)
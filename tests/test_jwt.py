@@ -32,3 +32,67 @@ def test_decode_jwt_expired():
     time.sleep(2)
     with pytest.raises(jwt.ExpiredSignatureError):
         decode_jwt(token, SECRET, ALGORITHM)
+
+
+def test_decode_jwt_with_cache():
+    from signi_email_otp.token_cache import TokenCache
+
+    cache = TokenCache(maxsize=10, ttl=60)
+    token, _ = generate_jwt("test@test.com", SECRET, ALGORITHM, 60)
+
+    first = decode_jwt(token, SECRET, ALGORITHM, cache=cache)
+    assert decode_jwt(token, SECRET, ALGORITHM, cache=cache) == first
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+    # The cached entry is only valid for the secret it was verified with.
+    with pytest.raises(jwt.exceptions.InvalidSignatureError):
+        decode_jwt(token, "wrongsecret", ALGORITHM, cache=cache)
+
+
+def test_token_cache_entries_expire_at_token_exp():
+    from signi_email_otp.token_cache import TokenCache
+
+    now = [1000.0]
+    cache = TokenCache(maxsize=10, ttl=60, clock=lambda: now[0])
+    cache.put("token", SECRET, ALGORITHM, {"exp": 1010})
+    assert cache.get("token", SECRET, ALGORITHM) == {"exp": 1010}
+    now[0] = 1010
+    assert cache.get("token", SECRET, ALGORITHM) is None
+
+
+def test_token_cache_evicts_least_recently_used():
+    from signi_email_otp.token_cache import TokenCache
+
+    cache = TokenCache(maxsize=2, ttl=60)
+    for token in ("a", "b"):
+        cache.put(token, SECRET, ALGORITHM, {})
+    cache.get("a", SECRET, ALGORITHM)
+    cache.put("c", SECRET, ALGORITHM, {})
+
+    assert cache.get("b", SECRET, ALGORITHM) is None
+    assert cache.get("a", SECRET, ALGORITHM) == {}
+    assert cache.stats().evictions == 1
+
+
+def test_token_cache_invalidated_on_refresh_token_delete(sqlite_get_db):
+    from sqlalchemy import delete
+
+    from signi_email_otp.models import JWT
+    from signi_email_otp.token_cache import token_cache
+
+    tokens = [generate_jwt(f"u{i}@test.com", SECRET, ALGORITHM, 60) for i in (0, 1)]
+    with sqlite_get_db() as session:
+        for i, (token, exp) in enumerate(tokens):
+            session.add(JWT(email=f"u{i}@test.com", refresh_token=token))
+    for token, _ in tokens:
+        decode_jwt(token, SECRET, ALGORITHM, cache=token_cache)
+
+    with sqlite_get_db() as session:
+        session.delete(session.query(JWT).filter_by(email="u0@test.com").one())
+    assert token_cache.get(tokens[0][0], SECRET, ALGORITHM) is None
+    assert token_cache.get(tokens[1][0], SECRET, ALGORITHM) is not None
+
+    with sqlite_get_db() as session:
+        session.execute(delete(JWT))
+    assert token_cache.get(tokens[1][0], SECRET, ALGORITHM) is None
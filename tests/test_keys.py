@@ -0,0 +1,111 @@
+import json
+
+import jwt
+import pytest
+
+pytest.importorskip("cryptography")
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa  # noqa: E402
+
+from signi_email_otp.jwt_utils import decode_jwt, prepare_key  # noqa: E402
+from signi_email_otp.keys import KeyManager, load_key, load_key_manager  # noqa: E402
+
+EMAIL = "user@example.com"
+
+
+def _pem(private_key) -> str:
+    return private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+@pytest.fixture(scope="module")
+def rsa_pem():
+    return _pem(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+
+
+@pytest.fixture(scope="module")
+def ed25519_pem():
+    return _pem(ed25519.Ed25519PrivateKey.generate())
+
+
+def test_prepare_key_parses_each_key_once(rsa_pem):
+    assert prepare_key(rsa_pem, "RS256") is prepare_key(rsa_pem, "RS256")
+
+
+@pytest.mark.parametrize("algorithm", ["HS256", "RS256", "EdDSA"])
+def test_sign_and_verify(algorithm, rsa_pem, ed25519_pem):
+    secret = {"HS256": "s3cret", "RS256": rsa_pem, "EdDSA": ed25519_pem}[algorithm]
+    keys = KeyManager([load_key("k1", algorithm, secret)])
+
+    token, expires_at = keys.generate_jwt(EMAIL, 60)
+
+    assert jwt.get_unverified_header(token)["kid"] == "k1"
+    assert expires_at.tzinfo is not None
+    assert keys.decode_jwt(token)["email"] == EMAIL
+
+
+def test_rotation_keeps_old_tokens_valid(rsa_pem):
+    keys = KeyManager([load_key("old", "HS256", "old-secret")])
+    old_token, _ = keys.generate_jwt(EMAIL, 60)
+
+    keys.add(load_key("new", "RS256", rsa_pem))
+    keys.activate("new")
+    new_token, _ = keys.generate_jwt(EMAIL, 60)
+
+    assert jwt.get_unverified_header(new_token)["kid"] == "new"
+    assert keys.decode_jwt(old_token)["email"] == EMAIL
+    assert keys.decode_jwt(new_token)["email"] == EMAIL
+
+    keys.remove("old")
+    with pytest.raises(jwt.InvalidSignatureError, match="Unknown JWT key id"):
+        keys.decode_jwt(old_token)
+    with pytest.raises(ValueError):
+        keys.remove("new")
+
+
+def test_tokens_without_kid_use_legacy_key():
+    legacy = load_key_manager("", "", "legacy-secret", "HS256")
+    token, _ = legacy.generate_jwt(EMAIL, 60)
+
+    assert "kid" not in jwt.get_unverified_header(token)
+    assert decode_jwt(token, "legacy-secret", "HS256")["email"] == EMAIL
+    assert legacy.decode_jwt(token)["email"] == EMAIL
+
+
+def test_load_key_manager_from_json(tmp_path, rsa_pem):
+    key_file = tmp_path / "signing.pem"
+    key_file.write_text(rsa_pem)
+    public_pem = (
+        serialization.load_pem_private_key(rsa_pem.encode(), None)
+        .public_key()
+        .public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        .decode()
+    )
+    keys_json = json.dumps(
+        [
+            {"kid": "a", "algorithm": "RS256", "key_file": str(key_file)},
+            {"kid": "b", "algorithm": "RS256", "public_key": public_pem},
+        ]
+    )
+
+    keys = load_key_manager(keys_json, "a")
+
+    assert keys.kids == ["a", "b"]
+    token, _ = keys.generate_jwt(EMAIL, 60)
+    assert keys.decode_jwt(token)["email"] == EMAIL
+    # b can only verify.
+    with pytest.raises(ValueError):
+        keys.activate("b")
+
+
+@pytest.mark.parametrize("algorithm", ["changeme", "none"])
+def test_invalid_algorithm_is_rejected(algorithm):
+    with pytest.raises(ValueError, match="Unsupported JWT algorithm"):
+        load_key_manager("", "", "secret", algorithm)
@@ -0,0 +1,71 @@
+import json
+import logging.handlers
+
+import pytest
+
+from signi_email_otp.core import logger
+from signi_email_otp.log import configure_logging, reset_logging
+
+
+@pytest.fixture(autouse=True)
+def restore_logger():
+    level, propagate = logger.level, logger.propagate
+    logger.propagate = False
+    yield
+    reset_logging()
+    logger.setLevel(level)
+    logger.propagate = propagate
+
+
+def test_configure_logging_writes_level_filtered_text(tmp_path):
+    log_file = tmp_path / "otp.log"
+    configure_logging("WARNING", str(log_file), "text", use_queue=False)
+
+    logger.info("hidden %s", "info")
+    logger.warning("visible %s", "warning")
+    reset_logging()
+
+    content = log_file.read_text()
+    assert "visible warning" in content
+    assert "hidden" not in content
+
+
+def test_configure_logging_json_includes_extra_fields(tmp_path):
+    log_file = tmp_path / "otp.log"
+    configure_logging("INFO", str(log_file), "json", use_queue=False)
+
+    logger.info("OTP issued for %s", "a@x.com", extra={"email": "a@x.com"})
+    reset_logging()
+
+    entry = json.loads(log_file.read_text().splitlines()[-1])
+    assert entry["message"] == "OTP issued for a@x.com"
+    assert entry["level"] == "INFO"
+    assert entry["email"] == "a@x.com"
+
+
+def test_configure_logging_queue_delivers_on_reset(tmp_path):
+    log_file = tmp_path / "otp.log"
+    configure_logging("INFO", str(log_file), "text", use_queue=True)
+
+    assert any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers)
+    for i in range(100):
+        logger.info("queued %s", i)
+    reset_logging()
+
+    assert log_file.read_text().count("queued") == 100
+    assert not logger.handlers
+
+
+def test_disabled_level_does_not_format_arguments():
+    configure_logging("WARNING", None, "text", use_queue=False)
+
+    class Expensive:
+        def __str__(self):
+            raise AssertionError("formatted while disabled")
+
+    logger.debug("value %s", Expensive())
+
+
+def test_configure_logging_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        configure_logging("INFO", None, "xml", use_queue=False)
@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from signi_email_otp import auth, metrics
+from signi_email_otp.exception import InvalidOTPException
+from signi_email_otp.otp_store import MemoryOTPStore, set_otp_store
+
+
+@pytest.fixture
+def registry():
+    registry = metrics.MetricsRegistry()
+    metrics.set_metrics_sink(registry)
+    yield registry
+    metrics.set_metrics_sink(None)
+    metrics.set_tracer(None)
+
+
+def test_disabled_timer_is_shared_no_op():
+    assert not metrics.enabled()
+    assert metrics.timer("a") is metrics.timer("b", x=1)
+    metrics.increment("ignored_total")
+
+
+def test_registry_counts_and_times(registry):
+    metrics.increment("otp_requests_total", outcome="issued")
+    metrics.increment("otp_requests_total", outcome="issued")
+    metrics.increment("otp_requests_total", outcome="reused")
+    with metrics.timer("otp_request_seconds"):
+        pass
+
+    assert registry.counter("otp_requests_total", outcome="issued") == 2
+    assert registry.counter("otp_requests_total", outcome="reused") == 1
+    count, total = registry.histogram("otp_request_seconds")
+    assert count == 1 and total >= 0
+
+
+def test_render_prometheus(registry):
+    metrics.increment("otp_requests_total", outcome="reused")
+    metrics.observe("smtp_send_seconds", 0.003)
+    metrics.observe("smtp_send_seconds", 20)
+
+    text = registry.render_prometheus()
+
+    assert "# TYPE signi_otp_otp_requests_total counter" in text
+    assert 'signi_otp_otp_requests_total{outcome="reused"} 1' in text
+    assert "# TYPE signi_otp_smtp_send_seconds histogram" in text
+    assert 'signi_otp_smtp_send_seconds_bucket{le="0.0025"} 0' in text
+    assert 'signi_otp_smtp_send_seconds_bucket{le="0.005"} 1' in text
+    assert 'signi_otp_smtp_send_seconds_bucket{le="+Inf"} 2' in text
+    assert "signi_otp_smtp_send_seconds_count 2" in text
+    assert 'signi_otp_otp_requests_total{outcome="reused"} 1' in (
+        metrics.prometheus_text()
+    )
+
+
+def test_error_label():
+    assert metrics.error_label(InvalidOTPException()) == "invalid_otp"
+    assert metrics.error_label(ValueError()) == "value_error"
+
+
+def test_tracer_spans_wrap_timed_phases(registry):
+    spans = []
+
+    class Tracer:
+        @contextmanager
+        def start_as_current_span(self, name, attributes=None):
+            spans.append((name, attributes))
+            yield
+
+    metrics.set_tracer(Tracer())
+    with metrics.timer("jwt_sign_seconds", algorithm="HS256"):
+        pass
+
+    assert spans == [("jwt_sign_seconds", {"algorithm": "HS256"})]
+
+
+def test_auth_flow_outcomes(registry, sqlite_get_db):
+    set_otp_store(MemoryOTPStore())
+    try:
+        with patch("signi_email_otp.auth.get_db", sqlite_get_db):
+            auth.request_otp("a@x.com")
+            otp = auth.request_otp("a@x.com")
+            with pytest.raises(InvalidOTPException):
+                auth.verify_otp("a@x.com", "not-the-otp")
+            auth.verify_otp("a@x.com", otp)
+    finally:
+        set_otp_store(None)
+
+    assert registry.counter("otp_requests_total", outcome="issued") == 1
+    assert registry.counter("otp_requests_total", outcome="reused") == 1
+    assert registry.counter("otp_verifications_total", outcome="invalid_otp") == 1
+    assert registry.counter("otp_verifications_total", outcome="verified") == 1
+    assert registry.histogram("otp_verify_seconds")[0] == 2
+    assert registry.histogram("jwt_sign_seconds", algorithm="HS256")[0] == 1
+
+
+def test_batch_counts_reused_codes(registry):
+    set_otp_store(MemoryOTPStore())
+    try:
+        list(auth.request_otp_batch(["a@x.com", "b@x.com"]))
+        list(auth.request_otp_batch(["a@x.com"]))
+    finally:
+        set_otp_store(None)
+
+    assert registry.counter("otp_requests_total", outcome="issued") == 2
+    assert registry.counter("otp_requests_total", outcome="reused") == 1
+
+
+def test_instrument_engine_times_queries(registry, sqlite_engine):
+    metrics.instrument_engine(sqlite_engine)
+    with sqlite_engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 1")
+
+    assert registry.histogram("db_query_seconds")[0] == 1
+
+
+def test_failed_queries_leave_nothing_on_the_connection(registry, sqlite_engine):
+    metrics.instrument_engine(sqlite_engine)
+    with sqlite_engine.connect() as conn:
+        with pytest.raises(DBAPIError):
+            conn.exec_driver_sql("SELECT * FROM missing_table")
+        conn.exec_driver_sql("SELECT 1")
+        info = dict(conn.connection.info)
+
+    assert "signi_query_started" not in info
+    assert registry.histogram("db_query_seconds")[0] == 1
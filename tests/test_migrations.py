@@ -0,0 +1,81 @@
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from signi_email_otp import migrations
+from signi_email_otp.otp_hash import get_otp_hasher
+
+
+def _legacy_engine():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE otp (id INTEGER PRIMARY KEY, email VARCHAR NOT NULL, "
+                "otp_code VARCHAR NOT NULL, created_at DATETIME, used BOOLEAN, "
+                "attempts_left INTEGER NOT NULL)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE refresh_tokens (id INTEGER PRIMARY KEY, "
+                "email VARCHAR NOT NULL, refresh_token VARCHAR NOT NULL, "
+                "created_at DATETIME, expires_at DATETIME)"
+            )
+        )
+        for code in ("111111", "222222"):
+            conn.execute(
+                text(
+                    "INSERT INTO otp (email, otp_code, attempts_left) "
+                    "VALUES ('a@example.com', :code, 3)"
+                ),
+                {"code": code},
+            )
+    return engine
+
+
+def test_upgrade_fresh_database_creates_head_schema():
+    engine = create_engine("sqlite://")
+    assert migrations.current_version(engine) is None
+
+    assert migrations.upgrade(engine) == migrations.HEAD_VERSION
+    assert migrations.current_version(engine) == migrations.HEAD_VERSION
+    index_names = {index["name"] for index in inspect(engine).get_indexes("otp")}
+    assert {"ix_otp_email", "ix_otp_created_at"} <= index_names
+
+
+# The installed SQLite, and the newest one that cannot rename columns.
+@pytest.mark.parametrize("sqlite_version", [sqlite3.sqlite_version_info, (3, 24, 0)])
+def test_upgrade_legacy_tables_in_place(sqlite_version):
+    engine = _legacy_engine()
+
+    with patch.object(migrations, "_sqlite_version", return_value=sqlite_version):
+        assert migrations.upgrade(engine) == migrations.HEAD_VERSION
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT email, otp_hash FROM otp")).all()
+    # Duplicates collapse onto the newest row before the unique index is built,
+    # and the remaining code is replaced by its hash.
+    assert len(rows) == 1
+    assert get_otp_hasher().verify("a@example.com", "222222", rows[0].otp_hash)
+    indexes = {
+        index["name"]: index["unique"]
+        for index in inspect(engine).get_indexes("refresh_tokens")
+    }
+    assert indexes["ix_refresh_tokens_email"]
+    assert not indexes["ix_refresh_tokens_expires_at"]
+    otp_indexes = {
+        index["name"]: index["unique"] for index in inspect(engine).get_indexes("otp")
+    }
+    assert otp_indexes == {"ix_otp_email": True, "ix_otp_created_at": False}
+    columns = {column["name"] for column in inspect(engine).get_columns("otp")}
+    assert {"otp_hash", "otp_sealed", "verify_attempts_left"} <= columns
+    assert "otp_code" not in columns
+
+
+def test_upgrade_is_idempotent():
+    engine = _legacy_engine()
+    migrations.upgrade(engine)
+    assert migrations.upgrade(engine) == migrations.HEAD_VERSION
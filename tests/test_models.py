@@ -6,13 +6,13 @@ def test_otp_model_fields():
     now = utcnow_timeaware()
     otp = OTP(
         email="user@example.com",
-        otp_code="123456",
+        otp_hash="123456",
         created_at=now,
         used=False,
         attempts_left=3,
     )
     assert otp.email == "user@example.com"
-    assert otp.otp_code == "123456"
+    assert otp.otp_hash == "123456"
     assert isinstance(otp.created_at, datetime)
     assert otp.created_at.tzinfo == timezone.utc
     assert otp.used is False
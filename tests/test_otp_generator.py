@@ -0,0 +1,74 @@
+import os
+import threading
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+
+from signi_email_otp import otp_generator
+from signi_email_otp.otp_generator import OTPGenerator
+
+
+def test_default_codes_are_six_digits():
+    codes = [otp_generator.generate_otp() for _ in range(100)]
+
+    assert all(len(code) == 6 and code.isdigit() for code in codes)
+    assert len(set(codes)) > 90
+
+
+def test_every_character_is_equally_likely():
+    generator = OTPGenerator(length=1, buffer_size=256)
+    # Bytes 250 to 255 would favour 0 to 5 and are dropped.
+    with patch("os.urandom", return_value=bytes(range(256))):
+        codes = [generator.generate() for _ in range(250)]
+
+    assert Counter(codes) == {digit: 25 for digit in "0123456789"}
+
+
+def test_custom_length_and_alphabet_across_refills():
+    generator = OTPGenerator(length=8, alphabet="ABCDEFGH", buffer_size=3)
+    codes = [generator.generate() for _ in range(50)]
+
+    assert all(len(code) == 8 and set(code) <= set("ABCDEFGH") for code in codes)
+
+
+def test_threads_never_share_a_code():
+    generator = OTPGenerator(length=16, buffer_size=64)
+    codes = []
+
+    def worker():
+        codes.extend(generator.generate() for _ in range(1000))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(codes)) == 8000
+
+
+def test_forked_child_does_not_reuse_the_buffer(run_forked):
+    generator = OTPGenerator(length=16)
+    generator.generate()
+    read_end, write_end = os.pipe()
+
+    run_forked(lambda: os.write(write_end, generator.generate().encode()))
+    os.close(write_end)
+    with os.fdopen(read_end) as child:
+        assert child.read() != generator.generate()
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"length": 0},
+        {"buffer_size": 0},
+        {"alphabet": "1"},
+        {"alphabet": "1123"},
+        {"alphabet": "0123456789é"},
+    ],
+)
+def test_invalid_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        OTPGenerator(**kwargs)
@@ -0,0 +1,54 @@
+from signi_email_otp import otp_hash
+from signi_email_otp.otp_hash import OTPHasher
+
+EMAIL = "user@example.com"
+
+
+def test_hash_is_keyed_and_bound_to_the_email():
+    hasher = OTPHasher("secret")
+    otp_hash_value = hasher.hash(EMAIL, "123456")
+
+    assert otp_hash_value == OTPHasher(b"secret").hash(EMAIL, "123456")
+    assert "123456" not in otp_hash_value
+    assert otp_hash_value != OTPHasher("other").hash(EMAIL, "123456")
+    assert otp_hash_value != hasher.hash("other@example.com", "123456")
+
+
+def test_verify():
+    hasher = OTPHasher("secret")
+    otp_hash_value = hasher.hash(EMAIL, "123456")
+
+    assert hasher.verify(EMAIL, "123456", otp_hash_value)
+    assert not hasher.verify(EMAIL, "654321", otp_hash_value)
+    assert not hasher.verify("other@example.com", "123456", otp_hash_value)
+
+
+def test_seal_round_trips_under_fresh_nonces():
+    hasher = OTPHasher("secret")
+    sealed = hasher.seal(EMAIL, "123456")
+
+    assert hasher.unseal(EMAIL, sealed) == "123456"
+    assert "123456" not in sealed
+    assert hasher.seal(EMAIL, "123456") != sealed
+    long_code = "x" * 100
+    assert hasher.unseal(EMAIL, hasher.seal(EMAIL, long_code)) == long_code
+
+
+def test_seal_does_not_open_for_another_secret_email_or_tampering():
+    sealed = OTPHasher("secret").seal(EMAIL, "123456")
+    tampered = sealed[:-2] + ("00" if sealed[-2:] != "00" else "01")
+
+    assert OTPHasher("other").unseal(EMAIL, sealed) is None
+    assert OTPHasher("secret").unseal("other@example.com", sealed) is None
+    assert OTPHasher("secret").unseal(EMAIL, tampered) is None
+    assert OTPHasher("secret").unseal(EMAIL, "not hex") is None
+
+
+def test_set_otp_hasher():
+    hasher = OTPHasher("secret")
+    otp_hash.set_otp_hasher(hasher)
+    try:
+        assert otp_hash.get_otp_hasher() is hasher
+    finally:
+        otp_hash.set_otp_hasher(None)
+    assert otp_hash.get_otp_hasher() is not hasher
@@ -0,0 +1,200 @@
+from unittest.mock import Mock, patch
+
+import pytest
+from sqlalchemy import event
+
+from signi_email_otp import otp_store
+from signi_email_otp.models import OTP
+from signi_email_otp.otp_hash import OTPHasher
+from signi_email_otp.shared import SharedTable
+from signi_email_otp.exception import (
+    InvalidOTPException,
+    OTPAttemptsExceededException,
+    OTPNotFoundException,
+    RateLimitOTPExceededException,
+)
+
+EMAIL = "user@example.com"
+
+
+@pytest.fixture(params=["sql", "memory", "redis"])
+def store(request, sqlite_get_db):
+    if request.param == "sql":
+        return otp_store.SQLOTPStore(sqlite_get_db)
+    if request.param == "memory":
+        return otp_store.MemoryOTPStore(stripes=4)
+    return otp_store.RedisOTPStore(url=request.getfixturevalue("redis_server"))
+
+
+def test_issue_resends_until_rate_limited(store):
+    assert store.issue(EMAIL, "111111") == "111111"
+    for _ in range(otp_store.OTP_REQUEST_ATTEMPTS):
+        assert store.issue(EMAIL, "222222") == "111111"
+    with pytest.raises(RateLimitOTPExceededException):
+        store.issue(EMAIL, "333333")
+    with pytest.raises(InvalidOTPException):
+        store.consume(EMAIL, "222222")
+    store.consume(EMAIL, "111111")
+
+
+def test_consume(store):
+    with pytest.raises(OTPNotFoundException):
+        store.consume(EMAIL, "111111")
+    store.issue(EMAIL, "111111")
+    with pytest.raises(InvalidOTPException):
+        store.consume(EMAIL, "999999")
+    store.consume(EMAIL, "111111")
+    with pytest.raises(OTPNotFoundException):
+        store.consume(EMAIL, "111111")
+
+
+def test_memory_store_evicts_expired_entries():
+    now = [0.0]
+    store = otp_store.MemoryOTPStore(
+        stripes=1, clock=lambda: now[0], expiry_seconds=300
+    )
+    store.issue("a@example.com", "111111")
+    now[0] = 100
+    store.issue("b@example.com", "222222")
+    now[0] = 350
+    # Expired entries are evicted, the unexpired OTP is resent.
+    assert store.issue("b@example.com", "333333") == "222222"
+    assert len(store) == 1
+    assert store.issue("a@example.com", "444444") == "444444"
+
+
+def test_redis_store_uses_key_ttl(redis_server):
+    store = otp_store.RedisOTPStore(url=redis_server, expiry_seconds=300)
+    store.issue(EMAIL, "111111")
+    ttl = store.client.pttl(store._key(EMAIL))
+    assert 0 < ttl <= 300_000
+
+
+def test_create_otp_store():
+    assert isinstance(otp_store.create_otp_store("memory"), otp_store.MemoryOTPStore)
+    with pytest.raises(ValueError):
+        otp_store.create_otp_store("nope")
+
+
+def test_issue_many(store):
+    for _ in range(otp_store.OTP_REQUEST_ATTEMPTS + 1):
+        store.issue("limited@example.com", "111111")
+    store.issue("reused@example.com", "222222")
+
+    results = store.issue_many(
+        {
+            "limited@example.com": "333333",
+            "reused@example.com": "444444",
+            "new@example.com": "555555",
+        }
+    )
+
+    assert isinstance(results["limited@example.com"], RateLimitOTPExceededException)
+    assert results["reused@example.com"] == "222222"
+    assert results["new@example.com"] == "555555"
+
+
+def test_issue_replaces_codes_sealed_under_another_secret(store):
+    store.issue(EMAIL, "111111")
+    store.issue("bulk@example.com", "111111")
+    store._hasher = OTPHasher("rotated")
+
+    assert store.issue(EMAIL, "222222") == "222222"
+    assert store.issue(EMAIL, "333333") == "222222"
+    assert store.issue_many({"bulk@example.com": "444444"}) == {
+        "bulk@example.com": "444444"
+    }
+    store.consume(EMAIL, "222222")
+    store.consume("bulk@example.com", "444444")
+
+
+def test_locked_issue_replaces_codes_sealed_under_another_secret(sqlite_get_db):
+    store = otp_store.SQLOTPStore(sqlite_get_db, hasher=OTPHasher("old"))
+    store.issue(EMAIL, "111111")
+    store._hasher = OTPHasher("rotated")
+
+    with patch.dict(otp_store._UPSERT_INSERTS, clear=True):
+        assert store.issue(EMAIL, "222222") == "222222"
+        assert store.issue(EMAIL, "333333") == "222222"
+    store.consume(EMAIL, "222222")
+
+
+def test_sql_store_keeps_only_hashes_and_seals(sqlite_get_db):
+    hasher = OTPHasher("secret")
+    store = otp_store.SQLOTPStore(sqlite_get_db, hasher=hasher)
+    store.issue(EMAIL, "111111")
+
+    with sqlite_get_db() as session:
+        otp_obj = session.query(OTP).filter_by(email=EMAIL).one()
+        otp_hash, otp_sealed = otp_obj.otp_hash, otp_obj.otp_sealed
+    assert otp_hash == hasher.hash(EMAIL, "111111")
+    assert "111111" not in otp_sealed
+    assert hasher.unseal(EMAIL, otp_sealed) == "111111"
+    with pytest.raises(InvalidOTPException):
+        otp_store.SQLOTPStore(sqlite_get_db, hasher=OTPHasher("other")).consume(
+            EMAIL, "111111"
+        )
+
+
+def test_consume_locks_after_failed_attempts(store):
+    store.issue(EMAIL, "111111")
+    for _ in range(store.max_verify_attempts - 1):
+        with pytest.raises(InvalidOTPException):
+            store.consume(EMAIL, "999999")
+    with pytest.raises(OTPAttemptsExceededException):
+        store.consume(EMAIL, "999999")
+
+    # Locked until it expires, even for the right code or a new request.
+    with pytest.raises(OTPAttemptsExceededException):
+        store.consume(EMAIL, "111111")
+    with pytest.raises(RateLimitOTPExceededException):
+        store.issue(EMAIL, "222222")
+
+
+def test_sql_failed_attempt_is_one_statement(sqlite_engine, sqlite_get_db):
+    store = otp_store.SQLOTPStore(sqlite_get_db, max_verify_attempts=2)
+    store.issue(EMAIL, "111111")
+    statements = []
+    event.listen(
+        sqlite_engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+
+    with pytest.raises(InvalidOTPException):
+        store.consume(EMAIL, "999999")
+    assert len(statements) == 1
+    with pytest.raises(OTPAttemptsExceededException):
+        store.consume(EMAIL, "999999")
+    assert len(store.lockouts) == 1
+
+    # Further guesses are rejected by the lockout cache without a query.
+    store._get_db = Mock(side_effect=AssertionError("database used"))
+    with pytest.raises(OTPAttemptsExceededException):
+        store.consume(EMAIL, "111111")
+    assert len(statements) == 2
+
+
+def test_lockout_cache_expires_and_is_bounded():
+    now = [0.0]
+    lockouts = otp_store.LockoutCache(maxsize=2, clock=lambda: now[0])
+    lockouts.add("a@example.com", 10)
+    lockouts.add("b@example.com", 20)
+    lockouts.add("c@example.com", 20)
+
+    assert not lockouts.locked("a@example.com")
+    assert lockouts.locked("b@example.com")
+    now[0] = 20
+    assert not lockouts.locked("b@example.com")
+    assert len(lockouts) == 1
+
+
+def test_shared_lockout_cache_is_shared_with_forked_processes(run_forked):
+    lockouts = otp_store.SharedLockoutCache(SharedTable(16), clock=lambda: 0.0)
+
+    run_forked(lambda: lockouts.add(EMAIL, 10))
+
+    assert lockouts.locked(EMAIL)
+    assert not lockouts.locked("other@example.com")
+    lockouts.add("expired@example.com", 0)
+    assert len(lockouts) == 1
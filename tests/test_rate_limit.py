@@ -0,0 +1,150 @@
+import asyncio
+from dataclasses import replace
+from unittest.mock import patch
+
+import pytest
+
+from signi_email_otp import auth, config, metrics, rate_limit
+from signi_email_otp.aio import auth as aio_auth
+from signi_email_otp.aio import rate_limit as aio_rate_limit
+from signi_email_otp.exception import RateLimitOTPExceededException
+from signi_email_otp.rate_limit import (
+    Limit,
+    MemoryRateLimiter,
+    RedisRateLimiter,
+    SharedRateLimiter,
+    otp_request_buckets,
+)
+from signi_email_otp.shared import SharedTable
+
+TWO_PER_10S = Limit(2, 10)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def limiter():
+    rate_limit.set_rate_limiter(MemoryRateLimiter())
+    yield rate_limit.get_rate_limiter()
+    rate_limit.set_rate_limiter(None)
+
+
+def _limits(ip=None, domain=None, email=None):
+    return replace(
+        config.get_settings(),
+        rate_limit_ip=ip,
+        rate_limit_domain=domain,
+        rate_limit_email=email,
+    )
+
+
+def test_otp_request_buckets():
+    buckets = otp_request_buckets(
+        " User@Example.COM", "10.0.0.1", _limits(TWO_PER_10S, TWO_PER_10S)
+    )
+
+    assert [key for key, _ in buckets] == ["ip:10.0.0.1", "domain:example.com"]
+
+
+def test_memory_bucket_refills():
+    clock = FakeClock()
+    limiter = MemoryRateLimiter(clock=clock)
+    bucket = [("email:a", TWO_PER_10S)]
+
+    assert limiter.acquire(bucket) is None
+    assert limiter.acquire(bucket) is None
+    assert limiter.acquire(bucket) == "email:a"
+    clock.now = 5
+    assert limiter.acquire(bucket) is None
+    assert limiter.acquire(bucket) == "email:a"
+
+
+def test_rejected_request_takes_no_tokens():
+    limiter = MemoryRateLimiter(clock=FakeClock())
+    ip, email = ("ip:1", Limit(10, 10)), ("email:a", Limit(1, 10))
+
+    assert limiter.acquire([ip, email]) is None
+    for _ in range(5):
+        assert limiter.acquire([ip, email]) == "email:a"
+    # Only the first request was charged to the IP.
+    for _ in range(9):
+        assert limiter.acquire([ip]) is None
+    assert limiter.acquire([ip]) == "ip:1"
+
+
+def test_memory_limiter_is_bounded():
+    limiter = MemoryRateLimiter(max_keys=100, clock=FakeClock())
+    for i in range(1000):
+        limiter.acquire([(f"email:{i}", TWO_PER_10S)])
+
+    assert len(limiter) == 100
+
+
+def test_shared_limiter_is_shared_with_forked_processes(run_forked):
+    clock = FakeClock()
+    limiter = SharedRateLimiter(SharedTable(16), clock=clock)
+    bucket = [("email:a", TWO_PER_10S)]
+
+    def take_one():
+        assert limiter.acquire(bucket) is None
+
+    run_forked(take_one)
+    run_forked(take_one)
+    assert limiter.acquire(bucket) == "email:a"
+    clock.now = 5
+    assert limiter.acquire(bucket) is None
+    assert len(limiter) == 1
+
+
+def test_redis_limiter_is_shared(redis_server):
+    pytest.importorskip("redis")
+    node_a = RedisRateLimiter(url=redis_server)
+    node_b = RedisRateLimiter(url=redis_server)
+    bucket = [("email:a", TWO_PER_10S)]
+
+    assert node_a.acquire(bucket) is None
+    assert node_b.acquire(bucket) is None
+    assert node_a.acquire(bucket) == "email:a"
+    assert 0 < node_a.client.pttl("signi_email_otp:rate:email:a") <= 10000
+
+
+def test_request_otp_is_limited_before_the_store(limiter):
+    registry = metrics.MetricsRegistry()
+    metrics.set_metrics_sink(registry)
+    config.set_settings(_limits(ip=Limit(2, 60)))
+    try:
+        with patch("signi_email_otp.auth.get_otp_store") as get_store:
+            auth.request_otp("user@example.com", "10.0.0.1")
+            auth.request_otp("other@example.com", "10.0.0.1")
+            with pytest.raises(RateLimitOTPExceededException):
+                auth.request_otp("third@example.com", "10.0.0.1")
+    finally:
+        config.set_settings(None)
+        metrics.set_metrics_sink(None)
+
+    assert get_store.return_value.issue.call_count == 2
+    assert registry.counter("otp_rate_limited_total", bucket="ip") == 1
+
+
+def test_async_request_otp_is_limited():
+    aio_rate_limit.set_rate_limiter(aio_rate_limit.create_rate_limiter("memory"))
+
+    async def main():
+        with patch("signi_email_otp.aio.auth.get_otp_store") as get_store:
+            get_store.return_value.issue.return_value = asyncio.Future()
+            get_store.return_value.issue.return_value.set_result("123456")
+            await aio_auth.request_otp("user@example.com")
+            with pytest.raises(RateLimitOTPExceededException):
+                for _ in range(10):
+                    await aio_auth.request_otp("user@example.com")
+
+    try:
+        asyncio.run(main())
+    finally:
+        aio_rate_limit.set_rate_limiter(None)
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+
+from signi_email_otp import reaper
+from signi_email_otp.config import get_settings
+from signi_email_otp.models import OTP, JWT
+
+
+def _seed(get_db, now):
+    expired = now - timedelta(seconds=get_settings().otp_expiry_seconds + 10)
+    with get_db() as session:
+        for i in range(5):
+            session.add(
+                OTP(email=f"old{i}@example.com", otp_hash="111111", created_at=expired)
+            )
+        session.add(OTP(email="new@example.com", otp_hash="222222", created_at=now))
+        for i in range(3):
+            session.add(
+                JWT(
+                    email=f"old{i}@example.com",
+                    refresh_token="t",
+                    created_at=expired,
+                    expires_at=now - timedelta(seconds=1),
+                )
+            )
+        session.add(
+            JWT(
+                email="new@example.com",
+                refresh_token="t",
+                created_at=now,
+                expires_at=now + timedelta(days=1),
+            )
+        )
+
+
+def test_sweep_expired_deletes_in_batches(sqlite_get_db):
+    now = datetime.now(timezone.utc)
+    _seed(sqlite_get_db, now)
+
+    with patch("signi_email_otp.reaper.get_dbs", lambda: [sqlite_get_db]):
+        result = reaper.sweep_expired(batch_size=2, now=now)
+
+    assert result.otp_deleted == 5
+    assert result.jwt_deleted == 3
+    assert result.duration_seconds >= 0
+    with sqlite_get_db() as session:
+        assert [o.email for o in session.query(OTP).all()] == ["new@example.com"]
+        assert [j.email for j in session.query(JWT).all()] == ["new@example.com"]
+
+
+def test_sweep_expired_rejects_invalid_batch_size():
+    with pytest.raises(ValueError):
+        reaper.sweep_expired(batch_size=0)
+
+
+def test_reaper_thread_runs_and_stops(sqlite_get_db):
+    with patch("signi_email_otp.reaper.get_dbs", lambda: [sqlite_get_db]):
+        thread = reaper.Reaper(interval_seconds=60, batch_size=10)
+        thread.start()
+        for _ in range(100):
+            if thread.last_result is not None:
+                break
+            thread.join(0.01)
+        thread.stop(timeout=1)
+
+    assert not thread.is_alive()
+    assert thread.last_result == reaper.SweepResult(
+        0, 0, thread.last_result.duration_seconds
+    )
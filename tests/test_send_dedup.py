@@ -0,0 +1,221 @@
+import asyncio
+import threading
+
+import pytest
+
+from signi_email_otp.aio.send_dedup import AsyncSendCoalescer
+from signi_email_otp.send_dedup import (
+    COALESCED,
+    QUEUED,
+    RecentSends,
+    SendCoalescer,
+    SharedRecentSends,
+)
+from signi_email_otp.shared import SharedTable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_requests_within_the_window_are_coalesced():
+    clock = FakeClock()
+    coalescer = SendCoalescer(RecentSends(window_seconds=10, clock=clock))
+    sent = []
+
+    assert coalescer.run("a@example.com", lambda: sent.append("a")) == QUEUED
+    assert coalescer.run("a@example.com", lambda: sent.append("a")) == COALESCED
+    assert coalescer.run("b@example.com", lambda: sent.append("b")) == QUEUED
+    clock.now = 10
+    assert coalescer.run("a@example.com", lambda: sent.append("a")) == QUEUED
+
+    assert sent == ["a", "b", "a"]
+
+
+def test_emails_are_coalesced_as_the_store_matches_them():
+    coalescer = SendCoalescer(RecentSends(window_seconds=10))
+
+    assert coalescer.run("User@Example.com", lambda: None) == QUEUED
+    # A different OTP row, so its code must be sent.
+    assert coalescer.run("user@example.com", lambda: None) == QUEUED
+    assert coalescer.run("User@Example.com", lambda: None) == COALESCED
+
+
+def test_shared_recent_sends_coalesce_across_coalescers():
+    clock = FakeClock()
+    recent = SharedRecentSends(SharedTable(64), window_seconds=10, clock=clock)
+    # Coalescers of two workers sharing one table.
+    first, second = SendCoalescer(recent), SendCoalescer(recent)
+    outcomes = []
+
+    def send():
+        # Another worker's request while this send is in flight.
+        outcomes.append(second.run("a@example.com", lambda: None))
+
+    assert first.run("a@example.com", send) == QUEUED
+    assert outcomes == [COALESCED]
+    assert second.run("a@example.com", lambda: None) == COALESCED
+    clock.now = 10
+    assert second.run("a@example.com", lambda: None) == QUEUED
+
+
+def test_shared_recent_sends_release_failed_claims():
+    recent = SharedRecentSends(SharedTable(64), window_seconds=10)
+    coalescer = SendCoalescer(recent)
+
+    def fail():
+        raise RuntimeError("queue is full")
+
+    with pytest.raises(RuntimeError):
+        coalescer.run("a@example.com", fail)
+    assert "a@example.com" not in recent
+    assert coalescer.run("a@example.com", lambda: None) == QUEUED
+
+
+def test_failed_sends_are_not_remembered():
+    coalescer = SendCoalescer(RecentSends(window_seconds=10))
+
+    def fail():
+        raise RuntimeError("queue is full")
+
+    with pytest.raises(RuntimeError):
+        coalescer.run("a@example.com", fail)
+    assert coalescer.run("a@example.com", lambda: None) == QUEUED
+
+
+def test_recent_sends_are_bounded():
+    recent = RecentSends(window_seconds=10, maxsize=2)
+    for email in ["a", "b", "c"]:
+        recent.add(email)
+
+    assert len(recent) == 2
+    assert "a" not in recent and "c" in recent
+
+
+def test_zero_window_remembers_nothing():
+    recent = RecentSends(window_seconds=0)
+    recent.add("a")
+
+    assert len(recent) == 0
+
+
+def test_concurrent_requests_are_single_flighted():
+    coalescer = SendCoalescer(RecentSends(window_seconds=10))
+    started, release = threading.Event(), threading.Event()
+    sends = []
+
+    def send():
+        sends.append(1)
+        started.set()
+        release.wait(5)
+
+    outcomes = []
+    leader = threading.Thread(
+        target=lambda: outcomes.append(coalescer.run("a@example.com", send))
+    )
+    leader.start()
+    started.wait(5)
+    followers = [
+        threading.Thread(
+            target=lambda: outcomes.append(coalescer.run("a@example.com", send))
+        )
+        for _ in range(4)
+    ]
+    for thread in followers:
+        thread.start()
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    # Followers wait for the leader, or find its send recent if they start late.
+    assert sends == [1]
+    assert sorted(outcomes) == [COALESCED] * 4 + [QUEUED]
+
+
+def test_waiting_requests_get_the_leaders_error():
+    coalescer = SendCoalescer(RecentSends(window_seconds=0))
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("queue is full")
+
+    def request():
+        try:
+            coalescer.run("a@example.com", fail)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=request)
+    follower.start()
+    # The follower waits on the flight, or starts its own after it ended.
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2
+
+
+def test_async_concurrent_requests_are_single_flighted():
+    coalescer = AsyncSendCoalescer(RecentSends(window_seconds=10))
+    sends = []
+
+    async def send():
+        sends.append(1)
+        await asyncio.sleep(0.01)
+
+    async def main():
+        return await asyncio.gather(
+            *(coalescer.run("a@example.com", send) for _ in range(5))
+        )
+
+    assert asyncio.run(main()) == [QUEUED] + [COALESCED] * 4
+    assert sends == [1]
+
+
+def test_async_waiting_requests_get_the_leaders_error():
+    coalescer = AsyncSendCoalescer(RecentSends(window_seconds=10))
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("smtp is down")
+
+    async def main():
+        return await asyncio.gather(
+            *(coalescer.run("a@example.com", fail) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(main()))
+    assert "a@example.com" not in coalescer.recent
+
+
+def test_async_waiting_requests_retry_after_the_leader_is_cancelled():
+    coalescer = AsyncSendCoalescer(RecentSends(window_seconds=10))
+    sends = []
+
+    async def send():
+        sends.append(1)
+        await asyncio.sleep(0.01)
+
+    async def main():
+        leader = asyncio.ensure_future(coalescer.run("a@example.com", send))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(coalescer.run("a@example.com", send))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == QUEUED
+    assert sends == [1, 1]
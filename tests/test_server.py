@@ -0,0 +1,124 @@
+import io
+import json
+import os
+import urllib.request
+from unittest.mock import patch
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from signi_email_otp import config, db, rate_limit, server
+from signi_email_otp.config import Limit
+from signi_email_otp.keys import KeyManager, load_key
+from signi_email_otp.exception import (
+    InvalidOTPException,
+    RateLimitOTPExceededException,
+)
+
+
+def _call(path, body=b"", method="POST"):
+    if isinstance(body, dict):
+        body = json.dumps(body).encode()
+    environ = {
+        "PATH_INFO": path,
+        "REQUEST_METHOD": method,
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    started = []
+    payload = b"".join(
+        server.application(environ, lambda status, headers: started.append(status))
+    )
+    return started[0], json.loads(payload)
+
+
+@patch("signi_email_otp.auth.verify_otp")
+def test_application_routes(verify_otp):
+    verify_otp.return_value = "token"
+
+    assert _call("/otp/verify", {"email": "a@example.com", "otp": "1"}) == (
+        "200 OK",
+        {"refresh_token": "token"},
+    )
+    verify_otp.assert_called_once_with("a@example.com", "1")
+    assert _call("/otp/verify", {"email": "a@example.com"})[0] == "400 Bad Request"
+    assert _call("/otp/verify", b"not json")[0] == "400 Bad Request"
+    assert _call("/otp/verify", method="GET")[0] == "405 Method Not Allowed"
+    assert _call("/missing")[0] == "404 Not Found"
+
+
+@pytest.mark.parametrize(
+    "error, status",
+    [
+        (InvalidOTPException("Invalid OTP provided."), "400 Bad Request"),
+        (RateLimitOTPExceededException("Too many"), "429 Too Many Requests"),
+        (RuntimeError("database is down"), "500 Internal Server Error"),
+    ],
+)
+def test_application_errors(error, status):
+    with patch("signi_email_otp.auth.verify_otp", side_effect=error):
+        result = _call("/otp/verify", {"email": "a@example.com", "otp": "1"})
+
+    assert result[0] == status
+    assert "database" not in result[1]["detail"]
+
+
+def test_refresh_with_removed_key_is_unauthorized():
+    keys = KeyManager([load_key("old", "HS256", "old-secret")])
+    token, _ = keys.generate_jwt("a@example.com", 60)
+    keys.add(load_key("new", "HS256", "new-secret"))
+    keys.activate("new")
+    keys.remove("old")
+
+    with patch("signi_email_otp.tokens.get_key_manager", return_value=keys):
+        result = _call("/token/refresh", {"refresh_token": token})
+
+    assert result == ("401 Unauthorized", {"detail": "Unknown JWT key id 'old'"})
+
+
+def test_worker_pool_size():
+    assert server.worker_pool_size(20, 8) == 2
+    with pytest.raises(ValueError):
+        server.worker_pool_size(4, 8)
+
+
+def _state_app(environ, start_response):
+    """Reports the worker's pid, pool settings and a shared rate limit check."""
+    options = db.pool_options()
+    limited = rate_limit.get_rate_limiter().acquire([("ip:test", Limit(3, 3600))])
+    body = json.dumps(
+        {
+            "pid": os.getpid(),
+            "pool": [options["pool_size"], options["max_overflow"]],
+            "limited": limited,
+        }
+    ).encode()
+    start_response("200 OK", [("Content-Type", "application/json")])
+    return [body]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_prefork_server_shares_state_and_connection_budget(monkeypatch):
+    monkeypatch.setenv("DB_POOL_MAX_CONN", "5")
+    monkeypatch.setenv("DB_POOL_MAX_OVERFLOW", "5")
+    monkeypatch.setenv("RATE_LIMIT", "memory")
+    monkeypatch.setenv("OTP_STORE", "sql")
+    config.set_settings(None)
+    prefork = server.PreforkServer(_state_app, port=0, workers=2, db_connections=5)
+    prefork.start()
+    try:
+        host, port = prefork.address
+        responses = []
+        for _ in range(6):
+            with urllib.request.urlopen(f"http://{host}:{port}/", timeout=10) as r:
+                responses.append(json.loads(r.read()))
+    finally:
+        prefork.stop()
+        config.set_settings(None)
+
+    assert os.getpid() not in {r["pid"] for r in responses}
+    assert [r["pool"] for r in responses] == [[2, 0]] * 6
+    # Only the workers' pools are capped.
+    assert db.pool_options()["pool_size"] == 5
+    assert [r["limited"] for r in responses] == [None] * 3 + ["ip:test"] * 3
@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from signi_email_otp import auth, db, reaper
+from signi_email_otp.models import JWT, OTP
+from signi_email_otp.otp_store import set_otp_store
+from signi_email_otp.sharding import parse_shard_urls, rebalance, shard_for
+
+EMAILS = [f"user{i}@example.com" for i in range(40)]
+
+
+def _urls(tmp_path, names):
+    return {name: f"sqlite:///{tmp_path / f'{name}.db'}" for name in names}
+
+
+def _emails(url, model):
+    engine = create_engine(url)
+    try:
+        with Session(engine) as session:
+            return {row.email for row in session.query(model)}
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    """Three SQLite shards next to an SQLite primary."""
+    urls = _urls(tmp_path, ["a", "b", "c"])
+    setting = ",".join(f"{name}={url}" for name, url in urls.items())
+    set_otp_store(None)
+    with (
+        patch("signi_email_otp.db.DB_URL", f"sqlite:///{tmp_path / 'primary.db'}"),
+        patch("signi_email_otp.db.DB_SHARD_URLS", setting),
+        patch("signi_email_otp.db._SessionLocal", None),
+        patch("signi_email_otp.db._ShardSessionLocals", None),
+    ):
+        yield urls
+        for factory in (db._SessionLocal, *(db._ShardSessionLocals or {}).values()):
+            if factory is not None:
+                factory.kw["bind"].dispose()
+    set_otp_store(None)
+
+
+def test_parse_shard_urls():
+    shards = parse_shard_urls(
+        "a=postgresql://h1/otp?sslmode=require, sqlite:///b.db,,c=sqlite:///c.db"
+    )
+
+    assert shards == {
+        "a": "postgresql://h1/otp?sslmode=require",
+        "shard1": "sqlite:///b.db",
+        "c": "sqlite:///c.db",
+    }
+    assert parse_shard_urls("") == {}
+    with pytest.raises(ValueError):
+        parse_shard_urls("a=sqlite:///1.db,a=sqlite:///2.db")
+
+
+def test_adding_a_shard_only_moves_emails_to_it():
+    before = {email: shard_for(email, ["a", "b"]) for email in EMAILS}
+    after = {email: shard_for(email, ["a", "b", "c"]) for email in EMAILS}
+
+    assert set(before.values()) == {"a", "b"}
+    moved = [email for email in EMAILS if before[email] != after[email]]
+    assert moved
+    assert all(after[email] == "c" for email in moved)
+
+
+def test_auth_routes_to_the_email_shard(sharded):
+    with patch("signi_email_otp.auth.generate_otp", return_value="123456"):
+        for email in EMAILS:
+            assert auth.request_otp(email) == "123456"
+        for email in EMAILS[:10]:
+            assert auth.verify_otp(email, "123456")
+        batch = next(auth.request_otp_batch(EMAILS[10:20]))
+
+    assert all(otp == "123456" for otp in batch.values())
+    for name, url in sharded.items():
+        expected = {e for e in EMAILS if shard_for(e, sharded) == name}
+        assert _emails(url, OTP) == expected - set(EMAILS[:10])
+        assert _emails(url, JWT) == expected & set(EMAILS[:10])
+    assert db.shard_names() == ["a", "b", "c"]
+    with db.get_db() as session:
+        assert session.query(OTP).count() == 0
+
+
+def test_reaper_sweeps_every_shard(sharded):
+    expired = datetime.now(timezone.utc) - timedelta(days=1)
+    for email in EMAILS:
+        with db.get_db(email) as session:
+            session.add(OTP(email=email, otp_hash="111111", created_at=expired))
+
+    result = reaper.sweep_expired(batch_size=5)
+
+    assert result.otp_deleted == len(EMAILS)
+    assert all(not _emails(url, OTP) for url in sharded.values())
+
+
+def test_rebalance_moves_rows_to_new_shard(tmp_path):
+    old = _urls(tmp_path, ["a", "b"])
+    now = datetime.now(timezone.utc)
+    engines = {name: create_engine(url) for name, url in old.items()}
+    try:
+        for name, engine in engines.items():
+            db.initialize_schema(engine)
+            with Session(engine) as session:
+                for email in EMAILS:
+                    if shard_for(email, old) == name:
+                        session.add(OTP(email=email, otp_hash="1", created_at=now))
+                        session.add(
+                            JWT(email=email, refresh_token=email, expires_at=now)
+                        )
+                session.commit()
+    finally:
+        for engine in engines.values():
+            engine.dispose()
+    new = {**old, **_urls(tmp_path, ["c"])}
+
+    result = rebalance(new, batch_size=7)
+
+    moved = {e for e in EMAILS if shard_for(e, new) == "c"}
+    assert result.moved == {"otp": len(moved), "refresh_tokens": len(moved)}
+    for name, url in new.items():
+        expected = {e for e in EMAILS if shard_for(e, new) == name}
+        assert _emails(url, OTP) == expected
+        assert _emails(url, JWT) == expected
+
+    # Retiring a shard moves all of its rows to the remaining ones.
+    remaining = {"a": new["a"], "c": new["c"]}
+    rebalance(remaining, {"b": new["b"]})
+
+    assert not _emails(new["b"], OTP)
+    assert _emails(new["a"], OTP) | _emails(new["c"], OTP) == set(EMAILS)
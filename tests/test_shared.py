@@ -0,0 +1,65 @@
+import os
+import signal
+
+import pytest
+
+from signi_email_otp.shared import SharedTable
+
+
+def test_get_set_delete():
+    table = SharedTable(64)
+    with table.lock:
+        table.set("a", 1.0, 2.0)
+        table.set("b", 3.0, 4.0)
+        table.set("a", 5.0, 6.0)
+
+        assert table.get("a") == (5.0, 6.0)
+        assert table.get("b") == (3.0, 4.0)
+        assert table.get("c") is None
+        table.delete("a")
+        assert table.get("a") is None
+    assert len(table) == 1
+
+
+def test_full_table_replaces_smallest_second_value():
+    table = SharedTable(4)
+    with table.lock:
+        for i in range(4):
+            table.set(f"key{i}", 0.0, float(i))
+        table.set("new", 0.0, 10.0)
+
+        assert table.get("key0") is None
+        assert table.get("new") == (0.0, 10.0)
+    assert len(table) == 4
+
+
+def test_writes_are_seen_by_the_parent(run_forked):
+    table = SharedTable(64)
+
+    def write():
+        with table.lock:
+            table.set("child", 1.0, 2.0)
+
+    run_forked(write)
+
+    with table.lock:
+        assert table.get("child") == (1.0, 2.0)
+
+
+def test_recover_releases_a_lock_left_by_a_killed_process():
+    table = SharedTable(64)
+    pid = os.fork()
+    if pid == 0:
+        table.lock.acquire()
+        os.kill(os.getpid(), signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+    assert table.recover(timeout=0.1)
+    assert not table.recover(timeout=0.1)
+    with table.lock:
+        table.set("a", 1.0, 2.0)
+
+
+def test_invalid_size_is_rejected():
+    with pytest.raises(ValueError):
+        SharedTable(0)
@@ -0,0 +1,128 @@
+import smtplib
+import threading
+from email import message_from_string
+from unittest.mock import patch
+
+import pytest
+
+from signi_email_otp import email_service
+from signi_email_otp.smtp_pool import (
+    SMTPConnectionPool,
+    SMTPPoolTimeoutError,
+    close_smtp_pools,
+)
+
+
+@pytest.fixture
+def pool(smtp_server):
+    pool = SMTPConnectionPool(
+        "127.0.0.1", smtp_server.port, "user", "secret", size=2, use_ssl=False
+    )
+    yield pool
+    pool.close()
+
+
+def test_pool_reuses_authenticated_session(pool, smtp_server):
+    for i in range(5):
+        pool.send("from@example.com", ["to@example.com"], f"Subject: {i}\r\n\r\nhi")
+
+    stats = pool.stats()
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 1
+    assert stats.connects == 1
+    assert stats.hits == 4
+    assert stats.messages_sent == 5
+
+
+def test_pool_caps_messages_per_connection(smtp_server):
+    pool = SMTPConnectionPool(
+        "127.0.0.1", smtp_server.port, size=1, max_messages=2, use_ssl=False
+    )
+    for _ in range(5):
+        pool.send("from@example.com", ["to@example.com"], "hi")
+    pool.close()
+
+    assert len(smtp_server.messages) == 5
+    assert pool.stats().connects == 3
+
+
+def test_pool_reconnects_after_server_disconnect(pool, smtp_server):
+    pool.send("from@example.com", ["to@example.com"], "one")
+    smtp_server.disconnect_all()
+    pool.send("from@example.com", ["to@example.com"], "two")
+
+    assert [data for _, _, data in smtp_server.messages] == ["one\n", "two\n"]
+    assert pool.stats().reconnects == 1
+
+
+def test_pool_keeps_session_after_rejected_message(pool, smtp_server):
+    smtp_server.fail_next = 1
+    with pytest.raises(smtplib.SMTPDataError):
+        pool.send("from@example.com", ["to@example.com"], "rejected")
+    pool.send("from@example.com", ["to@example.com"], "accepted")
+
+    assert pool.stats().connects == 1
+    assert len(smtp_server.messages) == 1
+
+
+def test_pool_bounds_concurrent_sessions(pool, smtp_server):
+    threads = [
+        threading.Thread(
+            target=pool.send, args=("from@example.com", ["to@example.com"], "hi")
+        )
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(smtp_server.messages) == 10
+    assert pool.stats().connects <= 2
+    assert pool.stats().checkouts == 10
+
+
+def test_pool_does_not_retry_acquire_timeouts(smtp_server):
+    pool = SMTPConnectionPool(
+        "127.0.0.1", smtp_server.port, size=1, use_ssl=False, timeout=0.05
+    )
+    with pool.connection():
+        with pytest.raises(SMTPPoolTimeoutError):
+            pool.send("from@example.com", ["to@example.com"], "hi")
+    pool.close()
+
+    assert pool.stats().reconnects == 0
+    assert smtp_server.messages == []
+
+
+def test_pool_does_not_resend_after_data_started(pool, smtp_server):
+    pool.send("from@example.com", ["to@example.com"], "one")
+    dropped = smtplib.SMTPServerDisconnected("dropped during DATA")
+    with patch.object(smtplib.SMTP, "data", side_effect=dropped) as data:
+        with pytest.raises(smtplib.SMTPServerDisconnected):
+            pool.send("from@example.com", ["to@example.com"], "two")
+
+    assert data.call_count == 1
+    assert pool.stats().reconnects == 0
+
+
+@patch("signi_email_otp.email_service.SMTP_USE_SSL", False)
+def test_send_otp_email_uses_shared_pool(smtp_server):
+    try:
+        for _ in range(2):
+            email_service.send_otp_email(
+                "127.0.0.1",
+                smtp_server.port,
+                "noreply@example.com",
+                "secret",
+                "user@example.com",
+                "Your code",
+                "123456",
+            )
+    finally:
+        close_smtp_pools()
+
+    assert smtp_server.connections == 1
+    message = message_from_string(smtp_server.messages[0][2])
+    assert message["To"] == "user@example.com"
+    assert message.get_payload().strip() == "123456"
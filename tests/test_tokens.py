@@ -0,0 +1,142 @@
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+
+from signi_email_otp import config, tokens
+from signi_email_otp.exception import RefreshTokenRevokedException
+from signi_email_otp.keys import get_key_manager
+from signi_email_otp.models import JWT
+
+EMAIL = "user@example.com"
+
+
+@pytest.fixture
+def sqlite_tokens(sqlite_get_db):
+    with (
+        patch("signi_email_otp.tokens.get_db", sqlite_get_db),
+        patch("signi_email_otp.tokens.get_dbs", lambda: [sqlite_get_db]),
+    ):
+        yield sqlite_get_db
+
+
+def _login(get_db, email=EMAIL):
+    with get_db() as session:
+        return tokens.login_token(session, email)
+
+
+def _stored(get_db, email=EMAIL):
+    with get_db() as session:
+        return session.query(JWT).filter_by(email=email).one().refresh_token
+
+
+def test_login_token_reuses_until_renewal_is_due(sqlite_tokens):
+    token = _login(sqlite_tokens)
+    assert _login(sqlite_tokens) == token
+
+    with sqlite_tokens() as session:
+        jwt_obj = session.query(JWT).filter_by(email=EMAIL).one()
+        jwt_obj.expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    renewed = _login(sqlite_tokens)
+
+    assert renewed != token
+    with sqlite_tokens() as session:
+        jwt_obj = session.query(JWT).filter_by(email=EMAIL).one()
+        assert jwt_obj.rotated_digests.split(",") == [
+            f"{tokens.token_digest(token)}:{int(jwt_obj.created_at.timestamp())}"
+        ]
+
+
+def test_rotate_returns_current_token_for_replaced_ones(sqlite_tokens):
+    first = _login(sqlite_tokens)
+    second = tokens.rotate(first)
+
+    assert second != first
+    assert tokens.rotate(first) == second
+    third = tokens.rotate(second)
+    assert tokens.rotate(first) == tokens.rotate(second) == third
+    assert _stored(sqlite_tokens) == third
+
+
+def test_rotation_history_is_bounded(sqlite_tokens):
+    config.set_settings(replace(config.get_settings(), jwt_rotation_history=2))
+    try:
+        issued = [_login(sqlite_tokens)]
+        for _ in range(3):
+            issued.append(tokens.rotate(issued[-1]))
+    finally:
+        config.set_settings(None)
+
+    assert tokens.rotate(issued[1]) == issued[-1]
+    with pytest.raises(RefreshTokenRevokedException):
+        tokens.rotate(issued[0])
+
+
+def test_rotate_revokes_tokens_replaced_before_the_grace(sqlite_tokens):
+    first = _login(sqlite_tokens)
+    second = tokens.rotate(first)
+    with sqlite_tokens() as session:
+        jwt_obj = session.query(JWT).filter_by(email=EMAIL).one()
+        rotated = datetime.now(timezone.utc) - timedelta(seconds=11)
+        jwt_obj.rotated_digests = tokens.push_digest("", first, rotated)
+
+    with pytest.raises(RefreshTokenRevokedException):
+        tokens.rotate(first)
+    with pytest.raises(RefreshTokenRevokedException):
+        tokens.rotate(second)
+    assert tokens.revoke_email(EMAIL) == 0
+
+
+def test_replaced_at_reads_the_history():
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    history = tokens.push_digest("legacy", "old", now)
+
+    assert tokens.replaced_at(history, "old") == now
+    assert tokens.replaced_at(history, "other") is None
+    assert tokens.replaced_at(f"{history},{tokens.token_digest('older')}", "older") == (
+        datetime.fromtimestamp(0, timezone.utc)
+    )
+
+
+def test_rotate_rejects_revoked_tokens(sqlite_tokens):
+    token = _login(sqlite_tokens)
+    other, _ = get_key_manager().generate_jwt(EMAIL, 60)
+
+    with pytest.raises(RefreshTokenRevokedException):
+        tokens.rotate(other)
+    assert tokens.revoke_email(EMAIL) == 1
+    with pytest.raises(RefreshTokenRevokedException):
+        tokens.rotate(token)
+
+
+def test_revoke_domain_in_batches(sqlite_tokens):
+    for email in ["a@corp.com", "B@Corp.com", "c@example.com", "d@corpxcom.com"]:
+        _login(sqlite_tokens, email)
+
+    assert tokens.revoke_domain("corp.com", batch_size=1) == 2
+    assert tokens.revoke_domain("corp_com.com") == 0
+    with sqlite_tokens() as session:
+        remaining = [j.email for j in session.query(JWT).order_by(JWT.email)]
+    assert remaining == ["c@example.com", "d@corpxcom.com"]
+
+
+def test_revoke_issued_before(sqlite_tokens, capsys):
+    now = datetime.now(timezone.utc)
+    for i in range(5):
+        _login(sqlite_tokens, f"user{i}@example.com")
+    with sqlite_tokens() as session:
+        for jwt_obj in session.query(JWT).filter(JWT.id <= 3):
+            jwt_obj.created_at = now - timedelta(days=1)
+
+    with patch("signi_email_otp.log.configure_logging"):
+        tokens.main(["--issued-before", now.isoformat(), "--batch-size", "2"])
+
+    assert capsys.readouterr().out == "3\n"
+    with sqlite_tokens() as session:
+        assert session.query(JWT).count() == 2
+
+
+def test_revoke_rejects_invalid_batch_size():
+    with pytest.raises(ValueError):
+        tokens.revoke_domain("corp.com", batch_size=0)